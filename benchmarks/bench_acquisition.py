@@ -0,0 +1,347 @@
+import sys, os
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('CRYO_FTS_CONFIG_DIR', tempfile.mkdtemp()) # keep the simulated devices out of ~/.cryo_fts
+
+from src.simulate import SimulatedBench, Stage, ENC_RES_MM
+from src.procacq import ProcessEncoder
+from src.synchronizer import Synchronizer
+from src.writer import open_writer, read_scan
+import argparse
+import contextlib
+import json
+import platform
+import shutil
+import threading
+import time
+import tracemalloc
+import numpy as np
+
+def percentiles(latency):
+    """Latency percentiles [ms]."""
+    latency = np.asarray(latency, dtype=float) * 1e3
+    if not latency.size:
+        return {'p50': None, 'p90': None, 'p99': None, 'max': None}
+    p50, p90, p99 = np.percentile(latency, [50, 90, 99])
+    return {'p50': float(p50), 'p90': float(p90), 'p99': float(p99), 'max': float(latency.max())}
+
+def out_of_order(values, direction=1):
+    """Number of samples that step backwards relative to `direction`."""
+    values = np.asarray(values, dtype=float)
+    return int(np.count_nonzero(direction * np.diff(values) < 0)) if values.size > 1 else 0
+
+def result(stage, params, samples, elapsed, latency, peak, dropped, disorder, **extra):
+    return {
+        'stage': stage,
+        'params': params,
+        'samples': int(samples),
+        'elapsed_s': elapsed,
+        'samples_per_s': samples / elapsed if elapsed > 0 else None,
+        'latency_ms': percentiles(latency),
+        'memory_peak_mb': peak / 2**20,
+        'dropped': int(dropped),
+        'out_of_order': int(disorder),
+        **extra,
+        }
+
+def make_bench(velocity, duration, encoder_rate=20000, corruption=0.0):
+    travel = abs(velocity) * (duration + 1) + 10
+    return SimulatedBench(stage=Stage(limit_max=travel, max_speed=max(2 * abs(velocity), 50.0), accel=500.0),
+                          encoder_rate=encoder_rate, corruption=corruption, seed=0)
+
+def drain(get, duration, poll):
+    """Poll `get` for `duration` seconds, recording each block's drain latency (drain time - sample timestamp)."""
+    blocks, latency = [], []
+    t_end = time.time() + duration
+    while time.time() < t_end:
+        blk = get()
+        now = time.time()
+        if len(blk):
+            blocks.append(np.array(blk))
+            latency.append(now - blk['timestamp'])
+        else:
+            time.sleep(poll)
+    data = np.concatenate(blocks) if blocks else np.empty(0)
+    return data, np.concatenate(latency) if latency else np.empty(0)
+
+def bench_encoder(velocity, duration, encoder_rate, corruption=0.0, poll=0.001):
+    """Encoder reader: E201 stream -> RecordReader -> ring buffer -> get_all()."""
+    bench = make_bench(velocity, duration, encoder_rate, corruption)
+    enc = bench.encoder()
+    bench.stage.move_velocity(velocity)
+    tracemalloc.start()
+    enc.start_transmission()
+    t0 = time.time()
+    data, latency = drain(enc.get_all, duration, poll)
+    elapsed = time.time() - t0
+    enc.stop_transmission()
+    data = np.concatenate([data, np.array(enc.get_all())]) if len(data) else np.array(enc.get_all())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    stats = enc.get_stats()
+    enc.close()
+    disorder = out_of_order(data['timestamp']) + out_of_order(data['count'], np.sign(velocity) or 1) if len(data) else 0
+    return result('encoder', {'velocity_mm_s': velocity, 'rate_hz': encoder_rate, 'corruption': corruption},
+                  stats['records'], elapsed, latency, peak, bench.e201.records_sent - stats['records'], disorder,
+                  bytes_dropped=int(stats['bytes_dropped']), resyncs=int(stats['resyncs']),
+                  buffer_overflows=int(stats['overflows']), receive_overrun_bytes=bench.e201.bytes_overrun)
+
+def gil_load(stop):
+    """Pure-Python work that holds the GIL, standing in for a busy analysis or GUI thread."""
+    while not stop.is_set():
+        sum(i * i for i in range(10000))
+
+def bench_reader(velocity, duration, encoder_rate, processes, load_threads=2, poll=0.001):
+    """
+    Encoder reader in a thread of this process or in its own process (procacq), while `load_threads` threads
+    here keep the GIL busy. A reader that waits on the GIL reads late and stamps records late, so besides
+    throughput this reports the timestamp error: the lag of each record's timestamp behind the time the stage
+    was at its count, over the constant-velocity part of the move.
+    """
+    bench = make_bench(velocity, duration, encoder_rate)
+    enc = ProcessEncoder(connection=bench.e201) if processes else bench.encoder() # fork before any threads start
+    stop = threading.Event()
+    load = [threading.Thread(target=gil_load, args=(stop,), daemon=True) for _ in range(load_threads)]
+    for thread in load:
+        thread.start()
+    t_move = time.time()
+    bench.stage.move_velocity(velocity)
+    tracemalloc.start()
+    enc.start_transmission()
+    t0 = time.time()
+    data, latency = drain(enc.get_all, duration, poll)
+    elapsed = time.time() - t0
+    enc.stop_transmission()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    stop.set()
+    for thread in load:
+        thread.join()
+    stats = enc.get_stats()
+    enc.close()
+    steady = data[data['timestamp'] > t_move + abs(velocity) / bench.stage.accel] if len(data) else data
+    if len(steady) and velocity:
+        measured = (steady['count'] - bench.e201.zero) * ENC_RES_MM
+        lag = (bench.stage.position(steady['timestamp']) - measured) / velocity
+        lag_ms = {'median': float(np.median(lag) * 1e3), 'p99': float(np.percentile(lag, 99) * 1e3),
+                  'max': float(lag.max() * 1e3)}
+    else:
+        lag_ms = None
+    disorder = out_of_order(data['timestamp']) + out_of_order(data['count'], np.sign(velocity) or 1) if len(data) else 0
+    # the transport's own counters live in the reader process when processes=True, so count losses at the reader
+    dropped = int(stats['overflows']) + int(stats['bytes_dropped']) // 9
+    return result('reader', {'velocity_mm_s': velocity, 'rate_hz': encoder_rate,
+                             'reader': 'process' if processes else 'thread', 'gil_load_threads': load_threads},
+                  stats['records'], elapsed, latency, peak, dropped, disorder, timestamp_lag_ms=lag_ms,
+                  nominal_fraction=stats['records'] / (encoder_rate * elapsed) if elapsed > 0 else None)
+
+def bench_lockin(velocity, duration, capture=True, rate_divider=4, sample_rate=200, poll=0.005):
+    """Lock-in reader: on-board capture (CAPTUREGET?) or SNAPD? polling -> ring buffer -> get_new()."""
+    bench = make_bench(velocity, duration)
+    lockin = bench.lockin()
+    bench.stage.move_velocity(velocity)
+    tracemalloc.start()
+    if capture:
+        lockin.start_capture(rate_divider=rate_divider, poll_interval=poll)
+    else:
+        lockin.start_transmission(sample_rate=sample_rate)
+    t0 = time.time()
+    data, latency = drain(lockin.get_new, duration, poll)
+    elapsed = time.time() - t0
+    lockin.stop_transmission()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    lockin.close()
+    samples = len(data)
+    # samples lost: overwritten on the instrument before transfer (4 float32 per XYRT sample) or in the ring buffer
+    dropped = lockin.capture_overflows * 1024 // 16 + lockin.data_buffer.overflows
+    rate = bench.sr865a.capture_rate if capture else sample_rate
+    return result('lockin', {'velocity_mm_s': velocity, 'mode': 'capture' if capture else 'poll', 'rate_hz': rate},
+                  samples, elapsed, latency, peak, dropped, out_of_order(data['timestamp']) if samples else 0,
+                  nominal_fraction=samples / (rate * elapsed) if elapsed > 0 else None)
+
+def bench_synchronizer(velocity, duration, encoder_rate, lockin_rate=5000, block_s=0.01, mode='lockin'):
+    """Synchronizer: merge pre-generated encoder and lock-in blocks as the scan worker would, timing process()."""
+    rng = np.random.default_rng(0)
+    t_enc = np.arange(0, duration, 1 / encoder_rate)
+    pos = velocity * t_enc + rng.normal(0, 1e-4, t_enc.size)
+    t_lock = np.arange(0, duration, 1 / lockin_rate) + 0.5 / lockin_rate
+    lock = {f: rng.normal(size=t_lock.size) for f in ('x', 'y', 'r', 'theta')}
+    sync = Synchronizer(mode=mode, direction=1 if velocity >= 0 else -1)
+    edges = np.arange(0, duration + block_s, block_s)
+    e_idx, l_idx = np.searchsorted(t_enc, edges), np.searchsorted(t_lock, edges)
+    latency, opd = [], []
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    for k in range(len(edges) - 1):
+        t1 = time.perf_counter()
+        sync.push_encoder(t_enc[e_idx[k]:e_idx[k + 1]], pos[e_idx[k]:e_idx[k + 1]])
+        sl = slice(l_idx[k], l_idx[k + 1])
+        sync.push_lockin(timestamp=t_lock[sl], **{f: v[sl] for f, v in lock.items()})
+        out = sync.process()
+        latency.append(time.perf_counter() - t1)
+        opd.append(out['opd_mm'])
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    opd = np.concatenate(opd)
+    return result('synchronizer', {'velocity_mm_s': velocity, 'mode': mode, 'encoder_rate_hz': encoder_rate,
+                                   'lockin_rate_hz': lockin_rate, 'block_s': block_s},
+                  sync.emitted, elapsed, latency, peak, sync.dropped, out_of_order(opd, np.sign(velocity) or 1))
+
+def bench_writer(backend, rows, block_rows=1000, flush_interval=1.0):
+    """Writer: append blocks of SYNC-shaped rows to a ScanWriter and read them back."""
+    columns = ['timestamp', 'position_mm', 'opd_mm', 'x', 'y', 'r', 'theta']
+    ext = {'npy': '', 'csv': '.csv', 'hdf5': '.h5'}[backend]
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'scan' + ext)
+    block = {c: np.random.default_rng(0).normal(size=block_rows) for c in columns}
+    ramp = np.arange(block_rows, dtype=float)
+    latency = []
+    try:
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        with open_writer(path, columns, backend=backend, flush_interval=flush_interval) as writer:
+            for k in range(rows // block_rows):
+                block['timestamp'] = ramp + k * block_rows
+                t1 = time.perf_counter()
+                writer.write(**block)
+                latency.append(time.perf_counter() - t1)
+        elapsed = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        written = (rows // block_rows) * block_rows
+        cols, _ = read_scan(path)
+        stored = len(cols['timestamp'])
+        disorder = out_of_order(cols['timestamp'])
+    finally:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return result('writer', {'backend': backend, 'block_rows': block_rows}, written, elapsed, latency, peak,
+                  written - stored, disorder)
+
+def bench_scan(velocity, duration, encoder_rate, capture=True):
+    """End to end: MirrorController continuous scan on the simulated bench, streamed to an npy directory."""
+    bench = make_bench(velocity, duration, encoder_rate)
+    bench.stage.limit_max = abs(velocity) * duration
+    mirror = bench.mirror(use_lockin=True)
+    mirror.init()
+    tmp = tempfile.mkdtemp()
+    try:
+        tracemalloc.start()
+        t0 = time.time()
+        mirror.scan_and_collect(velocity, save_to=os.path.join(tmp, 'scan'), lockin_capture=capture)
+        mirror._scan_thread.join()
+        elapsed = time.time() - t0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        stats = mirror.encoder.get_stats()
+        overflow_kb = mirror.lockin.capture_overflows
+        mirror.close()
+        cols, _ = read_scan(os.path.join(tmp, 'scan'))
+        latency = []
+    finally:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return result('scan', {'velocity_mm_s': velocity, 'encoder_rate_hz': encoder_rate,
+                           'mode': 'capture' if capture else 'poll'},
+                  len(cols['timestamp']), elapsed, latency, peak, bench.e201.records_sent - stats['records'],
+                  out_of_order(cols['opd_mm'], np.sign(velocity) or 1), encoder_bytes_dropped=int(stats['bytes_dropped']),
+                  capture_overflow_kb=overflow_kb)
+
+STAGES = ('encoder', 'reader', 'lockin', 'synchronizer', 'writer', 'scan')
+
+def run(stages, velocities, duration, encoder_rate, corruption, writer_rows, backends):
+    results = []
+    for stage in stages:
+        if stage == 'writer':
+            for backend in backends:
+                results.append(bench_writer(backend, writer_rows))
+            continue
+        for v in velocities:
+            if stage == 'encoder':
+                results.append(bench_encoder(v, duration, encoder_rate, corruption))
+            elif stage == 'reader':
+                results.append(bench_reader(v, duration, encoder_rate, processes=False))
+                results.append(bench_reader(v, duration, encoder_rate, processes=True))
+            elif stage == 'lockin':
+                results.append(bench_lockin(v, duration, capture=True))
+                results.append(bench_lockin(v, duration, capture=False))
+            elif stage == 'synchronizer':
+                results.append(bench_synchronizer(v, duration, encoder_rate))
+            elif stage == 'scan':
+                results.append(bench_scan(v, duration, encoder_rate))
+    return results
+
+def key(res):
+    return res['stage'] + ':' + ','.join(f'{k}={v}' for k, v in sorted(res['params'].items()))
+
+def compare(results, baseline, tolerance):
+    """
+    Compare against a previous results file. A stage regresses if its sustained rate falls by more than
+    `tolerance` (fractional) or it drops or reorders samples that the baseline did not.
+
+    Returns: list of regression messages
+    """
+    base = {key(r): r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        b = base.get(key(r))
+        if b is None:
+            continue
+        if b['samples_per_s'] and r['samples_per_s'] is not None and r['samples_per_s'] < (1 - tolerance) * b['samples_per_s']:
+            regressions.append(f"{key(r)}: {r['samples_per_s']:.0f} samples/s vs baseline {b['samples_per_s']:.0f}")
+        for field in ('dropped', 'out_of_order'):
+            if r[field] > b[field]:
+                regressions.append(f'{key(r)}: {field} {r[field]} vs baseline {b[field]}')
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the acquisition path on simulated hardware.')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES), help='Stages to benchmark')
+    parser.add_argument('--velocities', nargs='+', type=float, default=[1.0, 10.0], help='Mirror velocities [mm/s]')
+    parser.add_argument('--duration', type=float, default=2.0, help='Seconds of streaming per run')
+    parser.add_argument('--encoder_rate', type=float, default=20000, help='Simulated E201 record rate [Hz]')
+    parser.add_argument('--corruption', type=float, default=0.0, help='Fraction of encoder records corrupted')
+    parser.add_argument('--writer_rows', type=int, default=200000, help='Rows per writer benchmark')
+    parser.add_argument('--backends', nargs='+', default=['npy', 'csv', 'hdf5'], help='Writer backends to benchmark')
+    parser.add_argument('--output', default=None, help='Write results as JSON to this file (default: stdout)')
+    parser.add_argument('--baseline', default=None, help='Previous results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed fractional slowdown vs the baseline')
+    args = parser.parse_args()
+
+    backends = list(args.backends)
+    if 'hdf5' in backends:
+        try:
+            import h5py
+        except ImportError:
+            print('h5py not installed; skipping the hdf5 writer benchmark.', file=sys.stderr)
+            backends.remove('hdf5')
+
+    with contextlib.redirect_stdout(sys.stderr): # keep controller status messages out of the JSON
+        results = run(args.stages, args.velocities, args.duration, args.encoder_rate, args.corruption, args.writer_rows, backends)
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'args': vars(args),
+            },
+        'results': results,
+        }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for msg in regressions:
+            print(f'REGRESSION {msg}', file=sys.stderr)
+        sys.exit(1 if regressions else 0)
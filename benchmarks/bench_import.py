@@ -0,0 +1,112 @@
+import sys, os
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+import numpy as np
+
+PACKAGE = 'src' # the package as imported from a checkout (installed as cryo_fts)
+HEAVY = ['zaber_motion', 'serial', 'toptica', 'pandas', 'astropy', 'h5py']
+TARGETS = { # module -> heavy modules it must not pull in
+    '': HEAVY,
+    'fresnel': ['zaber_motion', 'serial', 'toptica', 'pandas', 'h5py'],
+    'spectrum': HEAVY,
+    'zpd': HEAVY,
+    'batch': ['zaber_motion', 'serial', 'toptica', 'h5py'],
+    'simulate': ['zaber_motion', 'serial', 'toptica', 'pandas', 'h5py'],
+    'mirror': ['zaber_motion', 'serial', 'toptica', 'h5py'],
+    }
+
+CHILD = '''
+import sys, time, importlib, resource
+sys.path.insert(0, {root!r})
+t0 = time.perf_counter()
+importlib.import_module({module!r})
+elapsed = time.perf_counter() - t0
+loaded = sorted(m for m in {heavy!r} if m in sys.modules)
+print(repr((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, loaded)))
+'''
+
+def measure(target, repeat):
+    """
+    Import `target` in `repeat` fresh interpreters.
+
+    Returns: dict with the import times [s], peak resident memory [MB] and the heavy modules loaded
+    """
+    module = f'{PACKAGE}.{target}' if target else PACKAGE
+    times, rss, loaded = [], [], set()
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', CHILD.format(root=ROOT, module=module, heavy=HEAVY)],
+                             capture_output=True, text=True, cwd=ROOT)
+        if out.returncode:
+            raise RuntimeError(f'Importing {module} failed:\n{out.stderr}')
+        elapsed, maxrss, mods = eval(out.stdout.strip().splitlines()[-1])
+        times.append(elapsed)
+        rss.append(maxrss / 1024) # kB on Linux
+        loaded.update(mods)
+    forbidden = sorted(loaded & set(TARGETS[target]))
+    return {
+        'module': module,
+        'import_s': {'median': float(np.median(times)), 'min': float(np.min(times)), 'max': float(np.max(times))},
+        'rss_mb': float(np.median(rss)),
+        'heavy_loaded': sorted(loaded),
+        'forbidden_loaded': forbidden,
+        }
+
+def compare(results, baseline, tolerance):
+    """
+    Compare against a previous results file. A module regresses if its median import time grows by more than
+    `tolerance` (fractional) or it loads a heavy module the baseline did not.
+
+    Returns: list of regression messages
+    """
+    base = {r['module']: r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        b = base.get(r['module'])
+        if b is None:
+            continue
+        if r['import_s']['median'] > (1 + tolerance) * b['import_s']['median']:
+            regressions.append(f"{r['module']}: {r['import_s']['median'] * 1e3:.0f} ms vs baseline {b['import_s']['median'] * 1e3:.0f} ms")
+        new = sorted(set(r['heavy_loaded']) - set(b['heavy_loaded']))
+        if new:
+            regressions.append(f"{r['module']}: now imports {', '.join(new)}")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark cold import time and memory of the package and its modules.')
+    parser.add_argument('--targets', nargs='+', choices=list(TARGETS), default=list(TARGETS),
+                        help="Modules to import ('' for the package itself)")
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters per module')
+    parser.add_argument('--output', default=None, help='Write results as JSON to this file (default: stdout)')
+    parser.add_argument('--baseline', default=None, help='Previous results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Allowed fractional slowdown vs the baseline')
+    args = parser.parse_args()
+
+    results = [measure(target, args.repeat) for target in args.targets]
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+            },
+        'results': results,
+        }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    regressions = [f"{r['module']}: imports {', '.join(r['forbidden_loaded'])}" for r in results if r['forbidden_loaded']]
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions += compare(results, json.load(f), args.tolerance)
+    for msg in regressions:
+        print(f'REGRESSION {msg}', file=sys.stderr)
+    sys.exit(1 if regressions else 0)
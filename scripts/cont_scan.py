@@ -2,26 +2,36 @@ import sys, os
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
 from src.mirror import MirrorController
+from src import metrics
 import argparse
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--velocity', help='Magnitude of scan velocity', default=None)
 parser.add_argument('--units', help='Units of scan velocity', default=None)
-parser.add_argument('--csv_file', help='Where to save collected data', default = None)
+parser.add_argument('--strokes', help='Number of strokes to scan back and forth (0 = until interrupted)', type=int, default=1)
+parser.add_argument('--save_to', '--csv_file', dest='save_to', help='Where to save collected data (.h5, .csv, or a directory of .npy columns)', default = None)
+parser.add_argument('--metrics_port', help='Serve acquisition metrics (Prometheus text) on this local port', type=int, default=None)
+parser.add_argument('--trace', help='Write a Chrome trace JSON of the scan to this file', default=None)
+parser.add_argument('--processes', help='Run the encoder reader in its own process (shared-memory transport)', action='store_true')
 
 args = parser.parse_args()
 VEL = float(args.velocity) if args.velocity is not None else None
 UNITS = str(args.units) if args.units is not None else None
-CSV = str(args.csv_file) if args.csv_file is not None else None
+SAVE_TO = str(args.save_to) if args.save_to is not None else None
 
-fts = MirrorController()
+fts = MirrorController(processes=args.processes) # forks any reader processes, so before the metrics thread starts
+if args.metrics_port is not None:
+    metrics.serve(args.metrics_port)
 fts.init()
 print("Moving to start position")
 fts.move_absolute(0, 'mm')
 print(f"Scanning at velocity = {VEL} {UNITS}")
-fts.scan_and_collect(velocity=VEL, velocity_unit=UNITS, save_to_csv=CSV)
-while fts._scan_thread and fts._scan_thread.is_alive():
-    fts._scan_thread.join(timeout=0.5)
+fts.scan_and_collect(velocity=VEL, velocity_unit=UNITS, save_to=SAVE_TO, strokes=args.strokes or None, trace=args.trace)
+try:
+    while fts._scan_thread and fts._scan_thread.is_alive():
+        fts._scan_thread.join(timeout=0.5)
+except KeyboardInterrupt:
+    print("KeyboardInterrupt detected. Stopping scan.")
 
 fts.stop_scan()
 fts.close()
@@ -4,19 +4,19 @@ from cryo_fts.mirror import MirrorController
 parser = argparse.ArgumentParser()
 parser.add_argument('--velocity', help='Magnitude of scan velocity', default=None)
 parser.add_argument('--units', help='Units of scan velocity', default=None)
-parser.add_argument('--csv_file', help='Where to save collected data', default = None)
+parser.add_argument('--save_to', '--csv_file', dest='save_to', help='Where to save collected data (.h5, .csv, or a directory of .npy columns)', default = None)
 
 args = parser.parse_args()
 VEL = float(args.velocity) if args.velocity is not None else None
 UNITS = str(args.units) if args.units is not None else None
-CSV = str(args.csv_file) if args.csv_file is not None else None
+SAVE_TO = str(args.save_to) if args.save_to is not None else None
 
 fts = MirrorController()
 fts.init()
 print("Moving to start position")
 fts.move_absolute(0, 'mm')
 print(f"Scanning at velocity = {VEL} {UNITS}")
-fts.scan_and_collect(velocity=VEL, velocity_unit=UNITS, poll_interval=0.001, save_to_csv=CSV)
+fts.scan_and_collect(velocity=VEL, velocity_unit=UNITS, poll_interval=0.001, save_to=SAVE_TO)
 while fts._scan_thread and fts._scan_thread.is_alive():
     fts._scan_thread.join(timeout=0.5)
 
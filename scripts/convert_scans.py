@@ -0,0 +1,4 @@
+from cryo_fts.archive import main
+
+if __name__ == "__main__":
+    main()
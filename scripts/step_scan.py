@@ -1,6 +1,7 @@
 from cryo_fts.motor import MotorController
 from cryo_fts.lockin import LockinController
 from cryo_fts.encoder import EncoderController
+from cryo_fts.stepscan import StepScanner, TIMING_KEYS
 import numpy as np
 from datetime import date, datetime
 import time
@@ -31,30 +32,12 @@ def main():
         print(f'Total steps in run: {NSTEPS}')
         NSAMPS = 50
 
-        data = []
-        positions = []
+        scanner = StepScanner(motor, encoder, lockin, nsamps=NSAMPS)
+        result = scanner.run(np.arange(NSTEPS) * RES)
+        data = result['data'].reshape(-1, 4)
+        positions = result['counts']
 
-        for n in range(NSTEPS):
-            pos = n * RES
-            try:
-                motor.move_absolute(pos)
-                time.sleep(0.1)  
-                
-                current_pos = encoder.get_count()
-                positions.append(current_pos)
-                
-                d = [lockin.get_x_y_r_theta() for _ in range(NSAMPS)]
-                data.extend(d)
-                
-                print(f'Count: {n + 1}/{NSTEPS} | Position: {current_pos:.2f} mm')
-                time.sleep(0.1) 
-
-            except Exception as e:
-                print(f'FAILURE OCCURRED at step {n}: {e}')
-                continue
-
-        if data:
-            data = np.array(data)
+        if np.isfinite(data).any():
             database = {
                 'Date': date.today().strftime("%Y-%m-%d"),
                 'RES_mm': RES,
@@ -65,6 +48,7 @@ def main():
                 'R_V': data[:, 2],
                 'THETA_deg': data[:, 3],
                 'ENCODER_POS_mm': positions,
+                **{key.upper(): result[key] for key in TIMING_KEYS},
             }
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             np.savez(f'../scan_data/{timestamp}.npz', **database)
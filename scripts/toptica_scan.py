@@ -9,7 +9,7 @@ parser.add_argument('--sample_rate', help = 'Sampling rate (Hz)', default = 10)
 parser.add_argument('--amplifier_gain', help = 'Amplifier Gain (V/A)', default = 1e6)
 parser.add_argument('--lockin_freq', help='Toptica Lockin modulation frequency (Hz)',default=5000.0)
 parser.add_argument('--lockin_int_time', help='Toptica Lockin integration time (ms)', default=100.0)
-parser.add_argument('--csv_file', help='Where to save collected data', default = None)
+parser.add_argument('--save_to', '--csv_file', dest='save_to', help='Where to save collected data (.h5, .csv, or a directory of .npy columns)', default = None)
 
 args = parser.parse_args()
 
@@ -27,7 +27,7 @@ toptica.scan_and_collect(
     lockin_freq_hz=args.lockin_freq,
     lockin_int_time_ms=args.lockin_int_time,
     amplifier_gain=args.amplifier_gain,
-    save_to_csv=args.csv_file
+    save_to=args.save_to
 )
 
 while toptica._scan_thread and toptica._scan_thread.is_alive():
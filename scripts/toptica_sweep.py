@@ -0,0 +1,27 @@
+from cryo_fts.laser_old import TopticaController
+from cryo_fts.sweep import SweepScheduler
+import numpy as np
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--freqs', help='Frequencies (GHz): start stop step', nargs=3, type=float, required=True)
+parser.add_argument('--positions', help='Mirror positions (mm): start stop step', nargs=3, type=float, required=True)
+parser.add_argument('--nsamps', help='Lock-in integrations per point', type=int, default=1)
+parser.add_argument('--nesting', help="Loop order: 'frequency', 'position' or 'auto'", default='auto')
+parser.add_argument('--tolerance', help='Frequency convergence tolerance (GHz)', type=float, default=0.05)
+parser.add_argument('--amplifier_gain', help = 'Amplifier Gain (V/A)', type=float, default = 1e6)
+parser.add_argument('--lockin_freq', help='Toptica Lockin modulation frequency (Hz)', type=float, default=5000.0)
+parser.add_argument('--lockin_int_time', help='Toptica Lockin integration time (ms)', type=float, default=100.0)
+parser.add_argument('--save_to', help='Where to save collected data (.h5, .csv, or a directory of .npy columns)', default=None)
+
+args = parser.parse_args()
+FREQS = np.arange(args.freqs[0], args.freqs[1] + args.freqs[2] / 2, args.freqs[2])
+POSITIONS = np.arange(args.positions[0], args.positions[1] + args.positions[2] / 2, args.positions[2])
+
+toptica = TopticaController()
+toptica.init()
+toptica.setup_lockin(freq_hz=args.lockin_freq, int_time_ms=args.lockin_int_time, amp_gain=args.amplifier_gain, phase_deg=0)
+print(f"Sweeping {len(FREQS)} frequencies x {len(POSITIONS)} positions")
+SweepScheduler(toptica, tolerance=args.tolerance).run(FREQS, POSITIONS, 'mm', nsamps=args.nsamps, nesting=args.nesting, save_to=args.save_to)
+toptica.close()
+print("Sweep done")
@@ -16,5 +16,8 @@ setup(
         "zaber-motion",
         "toptica-lasersdk",
     ],
+    extras_require={
+        "hdf5": ["h5py"],
+    },
     python_requires=">=3.8",
 )
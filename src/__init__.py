@@ -1,5 +1,20 @@
-from . import fresnel
-from . import motor
-from . import encoder
-from . import mirror
-from . import utils
\ No newline at end of file
+### Submodules are imported on first attribute access, so `import cryo_fts` stays cheap ###
+
+import importlib
+
+_SUBMODULES = [
+    'archive', 'batch', 'calibration', 'encoder', 'fresnel', 'laser', 'laser_async', 'laser_old', 'lockin',
+    'metrics', 'mirror', 'motor', 'preview', 'procacq', 'registry', 'ringbuffer', 'simulate', 'spectrum',
+    'stepscan', 'strokes', 'sweep', 'synchronizer', 'trigger', 'utils', 'writer', 'zpd',
+    ]
+__all__ = list(_SUBMODULES)
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        module = importlib.import_module(f'.{name}', __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES))
@@ -0,0 +1,250 @@
+### Memory-mapped scan archive ###
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+from .writer import NpyScanWriter, SIDECAR, FORMAT_VERSION, UNITS
+from .batch import ENC_RES_MM, MAX_TRAVEL_MM
+
+HEADER_TYPES = { # metadata keys with a fixed type; others are kept as stored
+    'velocity': float,
+    'velocity_unit': str,
+    'resolution': float,
+    'length_unit': str,
+    'offset': int,
+    'opd_factor': float,
+    'trigger_step': float,
+    'freq_ghz': float,
+    'instrument': dict,
+    }
+NPZ_COLUMNS = { # legacy step-scan keys -> archive columns
+    'X_V': 'x',
+    'Y_V': 'y',
+    'R_V': 'r',
+    'THETA_deg': 'theta',
+    }
+
+def typed_metadata(metadata):
+    """Cast the HEADER_TYPES keys of a metadata dict to their types (None stays None)."""
+    out = dict(metadata)
+    for key, typ in HEADER_TYPES.items():
+        if out.get(key) is not None:
+            out[key] = typ(out[key])
+    return out
+
+class ScanArchive:
+    def __init__(self, path):
+        """
+        Read-only view of a scan directory written by writer.NpyScanWriter: one raw .npy file per column plus
+        the scan.json sidecar (format version, column dtypes and units, row count and metadata). Columns are
+        np.memmap views, so opening a long scan reads nothing but the headers and slicing copies nothing.
+        Directories written before the sidecar was versioned are read as version 0.
+
+        Inputs:
+            path (str): scan directory
+        """
+        sidecar = os.path.join(path, SIDECAR)
+        if not os.path.isfile(sidecar):
+            raise RuntimeError(f'{path} is not a scan archive (no {SIDECAR}).')
+        with open(sidecar) as f:
+            info = json.load(f)
+        self.path = path
+        self.version = info.get('version', 0)
+        if self.version > FORMAT_VERSION:
+            raise RuntimeError(f'{path} has format version {self.version}; this reader supports up to {FORMAT_VERSION}.')
+        self.rows = info['rows']
+        self.complete = info.get('complete', False)
+        self.created = info.get('created')
+        self.metadata = typed_metadata(info.get('metadata', {}))
+        self.units = {name: info.get('units', {}).get(name, UNITS.get(name, '')) for name in info['columns']}
+        self.columns = {}
+        for name in info['columns']:
+            col = np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+            self.columns[name] = col[:self.rows] # the .npy header can be a flush ahead of the sidecar
+        self._sorted = {}
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, name):
+        if name == 'opd_mm' and name not in self.columns:
+            return self.opd()
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def keys(self):
+        return self.columns.keys()
+
+    def opd(self):
+        """OPD [mm] per row: the opd_mm column, or position_mm times the OPD factor if there is none."""
+        if 'opd_mm' in self.columns:
+            return self.columns['opd_mm']
+        return self.metadata.get('opd_factor', 2.0) * np.asarray(self.columns['position_mm'])
+
+    def _monotonic(self, name, values, chunk=1 << 20):
+        # +1 if the column never decreases, -1 if it never increases, 0 otherwise; checked chunk by chunk once
+        if name not in self._sorted:
+            up = down = True
+            prev = None
+            for i in range(0, len(values), chunk):
+                block = np.asarray(values[i:i + chunk])
+                if prev is not None:
+                    block = np.concatenate([[prev], block])
+                d = np.diff(block)
+                up &= bool((d >= 0).all())
+                down &= bool((d <= 0).all())
+                if not (up or down):
+                    break
+                prev = block[-1]
+            self._sorted[name] = 1 if up else -1 if down else 0
+        return self._sorted[name]
+
+    def _range(self, name, values, lo, hi):
+        lo = -np.inf if lo is None else lo
+        hi = np.inf if hi is None else hi
+        order = self._monotonic(name, values)
+        if order == 1:
+            return slice(np.searchsorted(values, lo, 'left'), np.searchsorted(values, hi, 'right'))
+        if order == -1:
+            n = len(values)
+            rev = values[::-1]
+            return slice(n - np.searchsorted(rev, hi, 'right'), n - np.searchsorted(rev, lo, 'left'))
+        values = np.asarray(values)
+        return np.flatnonzero((values >= lo) & (values <= hi))
+
+    def select(self, index, columns=None):
+        """Rows `index` (a slice gives memmap views, an index array gives copies) of the named (default all) columns."""
+        names = columns or list(self.columns)
+        return {name: self[name][index] for name in names}
+
+    def time_slice(self, t0=None, t1=None, columns=None):
+        """
+        Rows with t0 <= timestamp <= t1.
+
+        Returns: dict of column -> array (zero-copy views, since timestamps are ascending)
+        """
+        return self.select(self._range('timestamp', self.columns['timestamp'], t0, t1), columns)
+
+    def opd_slice(self, opd0=None, opd1=None, columns=None):
+        """
+        Rows with opd0 <= OPD <= opd1. Views when the OPD is monotonic over the scan (single-stroke scans);
+        otherwise (e.g. bidirectional scans) a copy of every matching row.
+
+        Returns: dict of column -> array
+        """
+        return self.select(self._range('opd_mm', self['opd_mm'], opd0, opd1), columns)
+
+    def to_npz(self, path):
+        """Write every column and the metadata (as JSON) to an .npz file."""
+        np.savez(path, metadata=json.dumps(self.metadata), units=json.dumps(self.units),
+                 **{name: np.asarray(col) for name, col in self.columns.items()})
+
+def _write(out_dir, columns, metadata, chunk_rows=1 << 20):
+    with NpyScanWriter(out_dir, {name: col.dtype for name, col in columns.items()}, metadata=metadata,
+                       chunk_rows=chunk_rows, flush_interval=np.inf) as writer:
+        n = len(next(iter(columns.values()))) if columns else 0
+        for i in range(0, n, chunk_rows):
+            writer.write(**{name: col[i:i + chunk_rows] for name, col in columns.items()})
+    return ScanArchive(out_dir)
+
+def from_npz(path, out_dir):
+    """
+    Convert a step-scan .npz (step_scan.py/observe.py) to an archive. Lock-in samples become rows (x, y, r,
+    theta); per-step arrays (ENCODER_POS_mm and the timing keys) are repeated for each of a step's NINT samples
+    and a 'step' column is added. An ENCODER_POS_mm that actually holds raw counts is kept as 'count' and
+    converted to position_mm relative to the first step. Scalars go into the metadata.
+
+    Returns: the new ScanArchive
+    """
+    data = np.load(path, allow_pickle=False)
+    sig = {col: np.asarray(data[key], dtype=float) for key, col in NPZ_COLUMNS.items() if key in data}
+    if not sig:
+        raise RuntimeError(f'{path} has none of {sorted(NPZ_COLUMNS)}.')
+    nrows = len(next(iter(sig.values())))
+    nsteps = int(data['NSTEPS']) if 'NSTEPS' in data else nrows
+    nint = int(data['NINT']) if 'NINT' in data else max(nrows // max(nsteps, 1), 1)
+    columns = dict(sig)
+    metadata = {'source': os.path.abspath(path), 'converted': time.time(), 'nint': nint}
+    per_step = lambda v: np.repeat(v, nint)[:nrows] if len(v) * nint >= nrows and len(v) != nrows else v[:nrows]
+    columns['step'] = per_step(np.arange(nsteps, dtype=np.int64))
+    for key in data.files:
+        if key in NPZ_COLUMNS:
+            continue
+        val = data[key]
+        if val.ndim == 0:
+            metadata[key] = val.item()
+        elif key in ('ENCODER_POS_mm', 'MOTOR_POS_mm'):
+            pos = np.asarray(val, dtype=float)
+            if np.nanmax(np.abs(pos)) > MAX_TRAVEL_MM:
+                columns['count'] = per_step(val.astype(np.int64))
+                metadata.update(offset=int(val[0]), resolution=ENC_RES_MM, length_unit='mm')
+                pos = (pos - pos[0]) * ENC_RES_MM
+            columns['position_mm'] = per_step(pos)
+        elif val.ndim == 1 and len(val) in (nsteps, nrows):
+            columns[key.lower()] = per_step(val)
+        else:
+            metadata[key] = val.tolist()
+    return _write(out_dir, columns, metadata)
+
+def from_csv(path, out_dir, chunk_rows=1 << 20):
+    """
+    Convert a continuous-scan CSV (CsvScanWriter) to an archive, reading it in chunks. Columns are stored as
+    float64 (the CSV does not record dtypes) and the '# key: value' header lines become metadata.
+
+    Returns: the new ScanArchive
+    """
+    import pandas as pd
+    metadata = {'source': os.path.abspath(path), 'converted': time.time()}
+    with open(path) as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            key, _, val = line[1:].partition(':')
+            val = val.strip()
+            try:
+                val = json.loads(val)
+            except ValueError:
+                pass
+            metadata[key.strip()] = val
+    writer = None
+    try:
+        for chunk in pd.read_csv(path, comment='#', chunksize=chunk_rows, dtype=np.float64, float_precision='round_trip'):
+            if writer is None:
+                writer = NpyScanWriter(out_dir, {name: chunk[name].dtype for name in chunk.columns},
+                                       metadata=metadata, chunk_rows=chunk_rows, flush_interval=np.inf)
+            writer.write(**{name: chunk[name].values for name in chunk.columns})
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise RuntimeError(f'{path} has no rows.')
+    return ScanArchive(out_dir)
+
+def convert(path, out_dir=None):
+    """Convert an .npz or .csv scan to an archive next to it (or in out_dir)."""
+    out_dir = out_dir or os.path.splitext(path)[0]
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npz':
+        return from_npz(path, out_dir)
+    if ext == '.csv':
+        return from_csv(path, out_dir)
+    raise ValueError(f'Cannot convert {ext} files.')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert .npz/.csv scans to memory-mapped scan archives.')
+    parser.add_argument('paths', nargs='+', help='Scans to convert')
+    parser.add_argument('--output', help='Directory for the archives (default: next to each scan)', default=None)
+    args = parser.parse_args(argv)
+    for path in args.paths:
+        out_dir = None
+        if args.output:
+            out_dir = os.path.join(args.output, os.path.splitext(os.path.basename(path))[0])
+        archive = convert(path, out_dir)
+        print(f'{path} -> {archive.path} ({len(archive)} rows, columns {", ".join(archive.keys())})')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+### Batch reduction and coadding of a directory of scans ###
+
+import os
+import glob
+import json
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from . import spectrum, zpd
+from .writer import SIDECAR, read_scan
+
+ENC_RES_MM = 0.000244140625 # encoder resolution [mm/count]
+MAX_TRAVEL_MM = 1000 # anything larger in a position column is raw encoder counts
+SCAN_PATTERNS = ('*.npz', '*.csv', '*.h5', '*.hdf5')
+
+def discover_scans(directory):
+    """
+    Find all scans in a directory: step-scan .npz files, continuous-scan .csv/.h5 files and
+    ScanWriter .npy directories.
+    """
+    paths = []
+    for pattern in SCAN_PATTERNS:
+        paths.extend(glob.glob(os.path.join(directory, pattern)))
+    paths.extend(os.path.dirname(p) for p in glob.glob(os.path.join(directory, '*', SIDECAR)))
+    return sorted(paths)
+
+def _counts_to_mm(pos):
+    pos = np.asarray(pos, dtype=float)
+    if np.nanmax(np.abs(pos)) > MAX_TRAVEL_MM: # raw counts mislabelled as mm
+        return (pos - pos[0]) * ENC_RES_MM
+    return pos
+
+def load_scan(path, signal='r'):
+    """
+    Load a scan as mirror position [mm] and detector signal.
+
+    Inputs:
+        path (str): .npz step scan, .csv/.h5 continuous scan, or ScanWriter directory
+        signal (str): lock-in quantity to use, one of 'x', 'y', 'r' (default='r')
+
+    Returns: dict with 'position' [mm], 'signal' and 'metadata'
+    """
+    if path.endswith('.npz'):
+        data = np.load(path)
+        key = f'{signal.upper()}_V'
+        sig = np.asarray(data[key], dtype=float)
+        pos_key = 'ENCODER_POS_mm' if 'ENCODER_POS_mm' in data else 'MOTOR_POS_mm'
+        pos = _counts_to_mm(data[pos_key])
+        # NINT readings per step: average them over the steps actually recorded (fewer than NSTEPS if the
+        # scan stopped early)
+        nint = int(data['NINT']) if 'NINT' in data else sig.size // max(pos.size, 1)
+        if nint > 1 and sig.size == pos.size * nint:
+            sig = spectrum.rebin(sig, nint)
+        meta = {k: data[k].item() for k in ('Date', 'RES_mm', 'NINT', 'NSTEPS') if k in data}
+    else:
+        cols, meta = read_scan(path)
+        pos = _counts_to_mm(cols['position_mm'])
+        sig = np.asarray(cols[signal], dtype=float)
+    n = min(pos.size, sig.size)
+    pos, sig = pos[:n], sig[:n]
+    good = np.isfinite(pos) & np.isfinite(sig)
+    return {'position': pos[good], 'signal': sig[good], 'metadata': meta}
+
+def noise_variance(power, band=(0.8, 1.0)):
+    """Variance of the power spectrum in a fractional band of the Nyquist range, used as the noise estimate."""
+    n = power.size
+    seg = power[int(band[0] * n):max(int(band[1] * n), int(band[0] * n) + 1)]
+    return float(np.var(seg))
+
+def process_scan(path, signal='r', noise_band=(0.8, 1.0), **kwargs):
+    """
+    Load a scan, find its ZPD and compute its spectrum, phase-corrected about that ZPD. A power spectrum alone
+    does not depend on where ZPD is, so the ZPD is only used when phase correcting.
+
+    Inputs:
+        path (str): scan to process
+        signal (str): lock-in quantity to use (default='r')
+        noise_band (tuple): fraction of the Nyquist range used to estimate the noise (default=(0.8, 1.0))
+        **kwargs: passed to spectrum.compute_spectrum (window, method, phase_correction, ...); phase_correction
+            defaults to 'mertz' for method='interp'
+
+    Returns: dict with the scan's 'path', 'frequency' [GHz], 'wavenumber' [1/cm], 'power', 'zpd_mm' and 'variance'
+    """
+    scan = load_scan(path, signal)
+    pos, sig = scan['position'], scan['signal']
+    grid, x = spectrum.resample(pos, sig)
+    zpd_idx = zpd.find_zpd(x)
+    zpd_mm = float(np.interp(zpd_idx, spectrum.sample_index(grid.size), grid))
+    if kwargs.get('method', 'interp') == 'interp':
+        kwargs.setdefault('phase_correction', 'mertz')
+    if kwargs.get('phase_correction') is not None:
+        kwargs.setdefault('zpd', int(round(zpd_idx))) # compute_spectrum resamples onto the same grid
+    res = spectrum.compute_spectrum(pos, sig, **kwargs)
+    return {
+        'path': path,
+        'frequency': res['frequency'],
+        'wavenumber': res['wavenumber'],
+        'power': res['power'],
+        'zpd_mm': zpd_mm,
+        'variance': noise_variance(res['power'], noise_band),
+        }
+
+def _process_one(args):
+    path, kwargs = args
+    try:
+        return process_scan(path, **kwargs)
+    except Exception as e:
+        return {'path': path, 'error': f'{type(e).__name__}: {e}'}
+
+def coadd(results, frequency=None):
+    """
+    Inverse-variance weighted coadd of per-scan power spectra, interpolated onto a common frequency grid.
+
+    Inputs:
+        results (list): outputs of process_scan
+        frequency (numpy.ndarray): common grid [GHz] (if None, the finest-resolution scan's grid, cut to the
+            frequency range every scan covers)
+
+    Returns: dict with 'frequency' [GHz], 'power', 'error' and per-scan 'weights'
+    """
+    if not results:
+        raise ValueError('Nothing to coadd.')
+    if frequency is None:
+        fmax = min(r['frequency'][-1] for r in results)
+        finest = min(results, key=lambda r: r['frequency'][1] - r['frequency'][0])
+        frequency = finest['frequency'][finest['frequency'] <= fmax]
+    weights = np.array([1 / r['variance'] if r['variance'] > 0 else 0.0 for r in results])
+    if not weights.any():
+        weights = np.ones(len(results))
+    stack = np.stack([np.interp(frequency, r['frequency'], r['power']) for r in results])
+    wsum = weights.sum()
+    return {
+        'frequency': frequency,
+        'power': weights @ stack / wsum,
+        'error': np.full(frequency.size, 1 / np.sqrt(wsum)) if wsum else np.full(frequency.size, np.nan),
+        'weights': weights / wsum,
+        }
+
+def align_scans(paths, signal='r', step=None, reference=0):
+    """
+    Align scans to one of them: all are resampled onto a common OPD grid and cross-correlated against the
+    reference in one batch (see zpd.align).
+
+    Inputs:
+        paths (list): scans to align
+        signal (str): lock-in quantity to use (default='r')
+        step (float): common grid step [mm OPD] (if None, the reference scan's median sample spacing)
+        reference (int): index in `paths` of the reference scan (default=0)
+
+    Returns: dict with 'shift_mm' (OPD [mm] by which each scan's ZPD lies beyond the reference's) and
+    'peak' (normalized correlation, a quality measure)
+    """
+    scans = [load_scan(p, signal) for p in paths]
+    order = [reference] + [i for i in range(len(scans)) if i != reference]
+    grid, x = zpd.to_grid([scans[i]['position'] for i in order], [scans[i]['signal'] for i in order], step)
+    res = zpd.align(x)
+    dx = grid[1] - grid[0]
+    shift, peak = np.empty(len(scans)), np.empty(len(scans))
+    shift[order], peak[order] = res['shift'] * dx, res['peak']
+    return {'shift_mm': shift, 'peak': peak}
+
+def process_directory(directory, output=None, workers=None, align=False, **kwargs):
+    """
+    Reduce every scan in a directory in parallel and coadd the results.
+
+    Inputs:
+        directory (str): directory of scans
+        output (str): where to write per-scan spectra and the summary (if None, no files are written)
+        workers (int): number of worker processes (if None, one per core)
+        align (bool): also cross-correlate the scans against the first one and report their shifts (default=False)
+        **kwargs: passed to process_scan
+
+    Returns: (coadded spectrum dict, list of per-scan results, list of failures)
+    """
+    paths = discover_scans(directory)
+    if not paths:
+        raise RuntimeError(f'No scans found in {directory}.')
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        out = list(pool.map(_process_one, [(p, kwargs) for p in paths]))
+    results = [r for r in out if 'error' not in r]
+    failures = [r for r in out if 'error' in r]
+    for f in failures:
+        print(f"Failed to process {f['path']}: {f['error']}")
+    summary = coadd(results)
+    if align and results:
+        shifts = align_scans([r['path'] for r in results], kwargs.get('signal', 'r'))
+        for r, shift, peak in zip(results, shifts['shift_mm'], shifts['peak']):
+            r['shift_mm'], r['align_peak'] = float(shift), float(peak)
+    if output:
+        os.makedirs(output, exist_ok=True)
+        for r in results:
+            name = os.path.splitext(os.path.basename(r['path'].rstrip(os.sep)))[0]
+            np.savez(os.path.join(output, f'{name}_spectrum.npz'),
+                     frequency_GHz=r['frequency'], wavenumber_cm=r['wavenumber'], power=r['power'],
+                     zpd_mm=r['zpd_mm'], variance=r['variance'])
+        np.savez(os.path.join(output, 'summary.npz'),
+                 frequency_GHz=summary['frequency'], power=summary['power'], error=summary['error'],
+                 weights=summary['weights'], scans=np.array([r['path'] for r in results]),
+                 zpd_mm=np.array([r['zpd_mm'] for r in results]))
+        with open(os.path.join(output, 'summary.json'), 'w') as f:
+            json.dump({'scans': [r['path'] for r in results], 'weights': summary['weights'].tolist(),
+                       'shift_mm': [r.get('shift_mm') for r in results],
+                       'failures': failures, 'options': {k: str(v) for k, v in kwargs.items()}}, f, indent=2)
+        print(f'Saved {len(results)} spectra and summary to {output}')
+    return summary, results, failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reduce and coadd a directory of FTS scans.')
+    parser.add_argument('directory', help='Directory of scans (.npz, .csv, .h5 or ScanWriter directories)')
+    parser.add_argument('--output', help='Where to write per-scan spectra and the summary', default=None)
+    parser.add_argument('--workers', help='Number of worker processes (default: one per core)', type=int, default=None)
+    parser.add_argument('--signal', help='Lock-in quantity to transform (x, y or r)', default='r')
+    parser.add_argument('--window', help='Apodization window', default=None)
+    parser.add_argument('--method', help='interp, nufft or direct', default='interp')
+    parser.add_argument('--align', help='Report each scan\'s ZPD shift relative to the first', action='store_true')
+    args = parser.parse_args(argv)
+    output = args.output or os.path.join(args.directory, 'reduced')
+    summary, results, failures = process_directory(args.directory, output, args.workers, args.align, signal=args.signal,
+                                                    window=args.window, method=args.method)
+    print(f'Coadded {len(results)} scans ({len(failures)} failed).')
+
+if __name__ == '__main__':
+    main()
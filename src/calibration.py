@@ -0,0 +1,103 @@
+### Persistent encoder offset calibration ###
+
+import os
+import json
+import time
+from .registry import CONFIG_DIR
+
+CALIBRATION_FILE = os.path.join(CONFIG_DIR, 'calibration.json')
+
+class OffsetCalibration:
+    def __init__(self, path=CALIBRATION_FILE, tolerance=200, max_age=7 * 24 * 3600):
+        """
+        Store of encoder offsets (the count at motor position 0) so a session can skip the travel-to-zero
+        move. An entry records OFFSET, the encoder's identity, the Zaber homed state, the motor position and
+        encoder count it was checked at, and a timestamp. On start it is accepted only if the encoder is the
+        same one, the axis is homed, the entry is not too old, and the current encoder count agrees with the
+        count predicted from the motor's own position.
+
+        Inputs:
+            path (str): JSON calibration file (default=~/.cryo_fts/calibration.json; None to keep the offsets in
+                memory only, e.g. for simulated hardware)
+            tolerance (int): largest disagreement [counts] between predicted and measured count (default=200)
+            max_age (float): age [s] after which an entry is no longer trusted (default=7 days)
+        """
+        self.path = path
+        self.tolerance = tolerance
+        self.max_age = max_age
+        self.entries = self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f'Could not save offset calibration: {e}')
+
+    @staticmethod
+    def encoder_id(encoder):
+        """Identity of the encoder: its USB serial number if known, otherwise the interface's reply to 'v'."""
+        return str(getattr(encoder, 'serial_number', None) or encoder.device)
+
+    def check(self, encoder, motor, resolution):
+        """
+        Validate the stored offset for this encoder without moving: read the encoder count and the motor
+        position and compare the count with OFFSET + position / resolution.
+
+        Inputs:
+            encoder (EncoderController): connected encoder, not transmitting
+            motor (MotorController): initialized motor
+            resolution (float): encoder resolution in motor length units
+
+        Returns: the stored offset if it is still valid, otherwise None
+        """
+        entry = self.entries.get(self.encoder_id(encoder))
+        if entry is None:
+            return None
+        age = time.time() - entry['time']
+        if not entry.get('homed') or not motor.is_homed:
+            print('Offset calibration invalid: axis was not homed.')
+            return None
+        if self.max_age is not None and age > self.max_age:
+            print(f'Offset calibration expired ({age / 3600:.1f} h old).')
+            return None
+        count = encoder.get_count()
+        predicted = entry['offset'] + motor.get_position() / resolution
+        if abs(count - predicted) > self.tolerance:
+            print(f'Offset calibration invalid: encoder reads {count}, expected {predicted:.0f}.')
+            return None
+        return entry['offset']
+
+    def record(self, encoder, motor, offset):
+        """Store a freshly measured offset for this encoder."""
+        self.entries[self.encoder_id(encoder)] = {
+            'offset': int(offset),
+            'encoder': str(encoder.device),
+            'homed': bool(motor.is_homed),
+            'motor_position': float(motor.get_position()),
+            'length_unit': motor.LENGTH_UNITS,
+            'time': time.time(),
+            }
+        self._save()
+
+    def clear(self, encoder=None):
+        """Forget the stored offset of one encoder (or of all of them)."""
+        if encoder is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(self.encoder_id(encoder), None)
+        self._save()
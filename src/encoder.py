@@ -1,35 +1,192 @@
 import os
-import serial
-import serial.tools.list_ports
 import time
 import threading
-import queue
+import numpy as np
+from .ringbuffer import RingBuffer
+from .registry import get_registry
+from . import metrics
+
+ENCODER_DTYPE = [('timestamp', 'f8'), ('count', 'i8')]
+SERIAL_READ = metrics.histogram('cryo_fts_encoder_serial_read_seconds', 'Latency of each serial read in the encoder reader loop')
+SERIAL_BACKLOG = metrics.gauge('cryo_fts_encoder_serial_backlog_bytes', 'Bytes waiting in the serial port at the last read')
+BYTES_DROPPED = metrics.counter('cryo_fts_encoder_bytes_dropped_total', 'Encoder bytes discarded as unparseable')
+RESYNCS = metrics.counter('cryo_fts_encoder_resyncs_total', 'Times the encoder record reader lost and regained framing')
+
+class RecordReader:
+    def __init__(self, record_len=9, capacity=1 << 20):
+        """
+        Bulk decoder for the fixed-length ASCII position records sent by the E201 in continuous transmission.
+        Incoming chunks are copied into a preallocated byte ring, record boundaries are located from the
+        terminator bytes, and every complete record in the chunk is decoded at once.
+
+        Inputs:
+            record_len (int): bytes per record, including the terminator (default=9)
+            capacity (int): size [bytes] of the preallocated byte ring (default=1 MiB)
+        """
+        self.record_len = record_len
+        self.capacity = capacity
+        self._ring = np.empty(capacity, dtype=np.uint8)
+        self._powers = 10 ** np.arange(record_len - 2, -1, -1, dtype=np.int64)
+        self._offsets = np.arange(record_len - 1)
+        self.reset()
+
+    def reset(self):
+        """
+        Discard any pending bytes and zero the statistics.
+        """
+        self._fill = 0 # pending (unterminated) bytes at the front of the ring
+        self._aligned = True # ring[0] follows a terminator (or is the start of the stream)
+        self._last_time = None
+        self.bytes_read = 0
+        self.records = 0
+        self.bytes_dropped = 0
+        self.resyncs = 0
+
+    def get_stats(self):
+        """
+        Get the number of bytes read, records decoded, bytes dropped and resynchronisations so far.
+        """
+        return {
+            'bytes_read': self.bytes_read,
+            'records': self.records,
+            'bytes_dropped': self.bytes_dropped,
+            'resyncs': self.resyncs,
+            }
+
+    def feed(self, data, t=None):
+        """
+        Decode a chunk of raw bytes.
+
+        Inputs:
+            data (bytes): raw bytes read from the encoder
+            t (float): arrival time [s] of the chunk (if None, defaults to time.time())
+
+        Returns: (timestamps, counts) arrays for every complete record in the chunk. Timestamps are interpolated
+        between the arrival time of the previous chunk and this one according to where each record ends.
+        """
+        if t is None:
+            t = time.time()
+        n = len(data)
+        t0 = self._last_time if self._last_time is not None else t
+        self._last_time = t
+        if n == 0:
+            return np.empty(0), np.empty(0, dtype=np.int64)
+        room = self.capacity - self.record_len
+        if n <= room:
+            return self._feed(np.frombuffer(data, dtype=np.uint8), t0, t)
+        # chunk larger than the ring: split it and interpolate arrival times of the pieces
+        data = np.frombuffer(data, dtype=np.uint8)
+        times, counts = [], []
+        for start in range(0, n, room):
+            stop = min(start + room, n)
+            ts, cs = self._feed(data[start:stop], t0 + (t - t0) * start / n, t0 + (t - t0) * stop / n)
+            times.append(ts)
+            counts.append(cs)
+        return np.concatenate(times), np.concatenate(counts)
+
+    def _feed(self, chunk, t0, t1):
+        L = self.record_len
+        n = chunk.size
+        fill = self._fill
+        end = fill + n
+        first = self.bytes_read - fill # stream offset of ring[0]
+        self.bytes_read += n
+        buf = self._ring[:end]
+        buf[fill:] = chunk
+
+        term = (buf == 13) | (buf == 10) # CR / LF
+        ends = np.flatnonzero(term)
+        if ends.size == 0:
+            if end >= L: # no terminator in a full record's worth of bytes; keep only the tail
+                self.bytes_dropped += end - (L - 1)
+                self._ring[:L - 1] = buf[end - (L - 1):]
+                self._fill = L - 1
+                self._aligned = False
+            else:
+                self._fill = end
+            return np.empty(0), np.empty(0, dtype=np.int64)
+
+        last = ends[-1]
+        digit = (buf >= 48) & (buf <= 57)
+        sign = (buf == 32) | (buf == 43) | (buf == 45) # ' ', '+', '-'
+        bad = np.zeros(end + 1, dtype=np.int64)
+        np.cumsum(~(digit | sign), out=bad[1:])
+        starts = ends - (L - 1)
+        ok = starts >= 0
+        ok[ok] = bad[ends[ok]] == bad[starts[ok]]
+        # a record must start right after a terminator, or digits of two corrupt records could be joined
+        ok[ok] = np.where(starts[ok] > 0, term[np.maximum(starts[ok] - 1, 0)], self._aligned)
+        ends, starts = ends[ok], starts[ok]
+
+        # bytes consumed up to the last terminator but not part of a valid record were dropped
+        nrec = ends.size
+        self.bytes_dropped += int(last + 1) - nrec * L
+        if nrec:
+            prev = np.empty(nrec, dtype=np.int64)
+            prev[0] = -1
+            prev[1:] = ends[:-1]
+            self.resyncs += int(np.count_nonzero(starts != prev + 1)) + int(last != ends[-1])
+        else:
+            self.resyncs += 1
+        rem = end - (last + 1)
+        self._aligned = True
+        if rem > L - 1: # more trailing bytes than a record without a terminator; keep only the tail
+            self.bytes_dropped += rem - (L - 1)
+            rem = L - 1
+            self._aligned = False
+        self._fill = rem
+
+        if nrec == 0:
+            self._ring[:rem] = buf[end - rem:]
+            return np.empty(0), np.empty(0, dtype=np.int64)
+
+        chars = buf[starts[:, None] + self._offsets]
+        vals = np.where(chars >= 48, chars - 48, 0).astype(np.int64) @ self._powers
+        neg = (chars == 45).any(axis=1)
+        counts = np.where(neg, -vals, vals)
+        # interpolate timestamps by the stream offset at which each record ends
+        pos = (first + ends + 1) - (self.bytes_read - n)
+        times = t0 + (t1 - t0) * (pos / n)
+        self.records += nrec
+        self._ring[:rem] = buf[end - rem:]
+        return times, counts
 
 class EncoderController:
-    def __init__(self, baudrate=9600, timeout=0.1):
+    def __init__(self, baudrate=9600, timeout=0.1, buffer_size=1 << 18, connection=None, data_buffer=None):
         """
         Instantiate connection to the RLS LA11 encoder via an RLS E201-9S USB encoder interface.
 
         Inputs:
             baudrate (int): number of changes per second to the signal during transmission (default=9600)
             timeout (float): time [s] to wait for response before raising a time-out error (default=0.1)
+            buffer_size (int): number of (timestamp, count) records held in the data buffer (default=262144)
+            connection: open serial-like transport to use instead of searching the ports, e.g. a
+                simulate.FakeE201 (default=None)
+            data_buffer (RingBuffer): ring to publish records into instead of a private one, e.g. one in shared
+                memory (see procacq) (default=None)
         """
         self.port = None
         self.device = None
+        self.serial_number = None # USB serial number of the interface, when known
         self.connection = None
         self.transmitting = False
         self.TRANMISSION_RATE = 1e-5 # seconds (10 us; 100 kHz)
         self.current_position = None
-        self.data_queue = queue.Queue()
+        self.data_buffer = data_buffer if data_buffer is not None else RingBuffer(buffer_size, ENCODER_DTYPE)
+        self._read_cursor = 0
         self._reading_thread = None
         self._stop_thread = threading.Event()
         self.POS_LEN = 9 # bit-length of position data
         self.ENC_RES = 0.000244 # mm
+        self.READ_CHUNK = 1 << 16 # max bytes drained from the port per read
+        self.reader = RecordReader(record_len=self.POS_LEN)
 
-        ports = [p.device for p in serial.tools.list_ports.comports()]
+        if connection is None:
+            import serial # pyserial is only needed for hardware
+        ports = [getattr(connection, 'port', None)] if connection is not None else get_registry().ports('encoder')
         for port in ports:
             try:
-                conn = serial.Serial(port, baudrate=baudrate, timeout=timeout)
+                conn = connection if connection is not None else serial.Serial(port, baudrate=baudrate, timeout=timeout)
                 conn.write(b'v')
                 rsp = conn.readall().decode('utf-8', errors='ignore').strip()
                 if rsp:
@@ -37,6 +194,11 @@ class EncoderController:
                     self.port = port
                     self.connection = conn
                     print(f'Established connection to {self.device} on {self.port}')
+                    if connection is None:
+                        get_registry().remember('encoder', port, str(self.device))
+                        self.serial_number = get_registry().cache.get('encoder', {}).get('serial_number')
+                    else:
+                        self.serial_number = getattr(conn, 'serial_number', None)
                     break
                 else:
                     conn.close()
@@ -54,8 +216,6 @@ class EncoderController:
             ]
         for cmd in cmds:
             self.write(cmd, read=True)
-        self.data_buffer = []
-        self.buffer_lock = threading.Lock()
 
     def close(self):
         """
@@ -112,6 +272,9 @@ class EncoderController:
         """
         if self.transmitting:
             return
+        self.reader.reset()
+        self.data_buffer.clear()
+        self._read_cursor = 0
         self.write('1')  # Start continuous transmission
         self.transmitting = True
         self._stop_thread.clear()
@@ -125,7 +288,7 @@ class EncoderController:
         """
         if not self.transmitting:
             return
-        self.write('0')
+        self.connection.write(b'0') # not self.write(): clearing the buffer first would chase the stream
         time.sleep(0.05)
         self._stop_thread.set()
         if self._reading_thread:
@@ -136,26 +299,44 @@ class EncoderController:
 
     def _read_loop(self):
         """
-        Background reader for position and time data.
+        Background reader for position and time data. Drains all pending bytes per read and decodes them in bulk.
         """
         dat_len = self.POS_LEN
+        records = metrics.RECORDS.labels(device='encoder')
+        errors = metrics.READ_ERRORS.labels(device='encoder')
+        read_latency = SERIAL_READ.labels()
+        backlog = SERIAL_BACKLOG.labels()
         while not self._stop_thread.is_set():
             try:
-                data = self.connection.read(dat_len)
+                waiting = self.connection.in_waiting
+                backlog.set(waiting)
+                n = min(max(waiting, dat_len), self.READ_CHUNK)
+                p0 = time.perf_counter()
+                data = self.connection.read(n)
                 t = time.time()
-                if len(data) == dat_len:
-                    try:
-                        pos = int(data.decode('ascii'))
-                        self.current_position = pos
-                        with self.buffer_lock:
-                            self.data_buffer.append((t, pos))
-                            if len(self.data_buffer) > 1000:
-                                self.data_buffer.pop(0)
-                        self.data_queue.put((t, pos)) # store position with timestamp
-                    except ValueError:
-                        continue
+                dt = time.perf_counter() - p0
+                read_latency.observe(dt)
+                metrics.TRACER.add('encoder.read', t - dt, dt, bytes=len(data))
+                dropped, resyncs = self.reader.bytes_dropped, self.reader.resyncs
+                times, counts = self.reader.feed(data, t)
+                if self.reader.bytes_dropped != dropped or self.reader.resyncs != resyncs:
+                    BYTES_DROPPED.inc(self.reader.bytes_dropped - dropped)
+                    RESYNCS.inc(self.reader.resyncs - resyncs)
+                if counts.size:
+                    self.data_buffer.write(timestamp=times, count=counts)
+                    self.current_position = int(counts[-1])
+                    records.inc(counts.size)
             except Exception as e:
+                errors.inc()
                 print(f'Read loop error: {e}')
+
+    def get_stats(self):
+        """
+        Get reader statistics (bytes read, records decoded, bytes dropped, resyncs and buffer overflows) for the current transmission.
+        """
+        stats = self.reader.get_stats()
+        stats['overflows'] = self.data_buffer.overflows
+        return stats
             
     def get_count(self):
         """
@@ -172,18 +353,16 @@ class EncoderController:
             
     def get_latest(self):
         """
-        Get the latest (timestamp, position) from the queue.
+        Get the latest (timestamp, position) from the buffer.
         """
-        ts, pos = None, None
-        try:
-            while True:
-                ts, pos = self.data_queue.get_nowait()
-        except queue.Empty:
-            pass
-        return (ts, pos) if ts is not None else None
+        latest = self.data_buffer.latest()
+        if latest is None:
+            return None
+        return float(latest['timestamp']), int(latest['count'])
 
     def get_all(self):
-        with self.buffer_lock:
-            data = list(self.data_buffer)
-            self.data_buffer.clear()
-            return data
\ No newline at end of file
+        """
+        Get all (timestamp, count) records received since the last call, as a structured array view.
+        """
+        data, self._read_cursor = self.data_buffer.read_since(self._read_cursor)
+        return data
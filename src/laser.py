@@ -1,11 +1,13 @@
-from toptica.lasersdk.client import Client, SerialConnection
 import time
 
 class TopticaController:
-    def __init__(self, port='COM6', verbose=False):
+    def __init__(self, port='COM6', verbose=False, client=None):
         self.port = port
         self.verbose = verbose
-        self.client = Client(SerialConnection(port))
+        if client is None:
+            from toptica.lasersdk.client import Client, SerialConnection
+            client = Client(SerialConnection(port))
+        self.client = client # e.g. simulate.FakeDLCpro().client()
         self.client.__enter__() # ensure connection to Toptica via USB connection established
         self.dlc = self.client.get('general:system-type')
         self.user_level = self.client.get('ul')
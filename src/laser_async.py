@@ -0,0 +1,271 @@
+### asyncio Toptica DLC pro controller ###
+
+import asyncio
+import time
+import numpy as np
+import astropy.units as u
+from .synchronizer import Synchronizer
+from .calibration import OffsetCalibration
+from .writer import open_writer
+from .mirror import find_stop_index
+
+RES = 0.244140625 * u.um
+LOCKIN_VALUE = 'lockin:lock-in-value'
+STATIONARY_TIMEOUT = 0.5 # [s] without moving after which a scan ends
+STATIONARY_TOLERANCE = 2.5 # [counts] of displacement over the timeout still counted as stationary
+
+class AsyncTopticaController:
+    def __init__(self, ip_address=None, port=None, nclients=3, clients=None, encoder=None, motor=None, calibration=None):
+        """
+        asyncio controller for the Toptica DLC pro. Parameter queries go through a pool of command-line clients,
+        so several can be in flight at once (one client runs one query at a time), and the lock-in value can
+        be streamed from the monitoring line instead of polled. Encoder and motor are the usual blocking
+        controllers; their calls run in worker threads so they overlap with laser I/O.
+
+        Inputs:
+            ip_address (str): DLC pro network address (network connections allow several clients)
+            port (str): serial port, if connecting over USB instead (a single client)
+            nclients (int): command-line clients to open over the network (default=3)
+            clients (list): already-constructed asyncio clients to use instead, e.g. simulate.FakeDLCpro.async_client()
+            encoder (EncoderController): encoder for scans (default=None)
+            motor (MotorController): motor for scans (default=None)
+            calibration (OffsetCalibration): store of encoder offsets (default=OffsetCalibration())
+        """
+        if clients is None and ip_address is None and port is None:
+            raise RuntimeError('Need an ip_address, a port or clients.')
+        self.ip_address = ip_address
+        self.port = port
+        self.nclients = nclients if port is None else 1
+        self.clients = list(clients) if clients is not None else []
+        self._own_clients = clients is None
+        self.encoder = encoder
+        self.motor = motor
+        self.calibration = calibration or OffsetCalibration()
+        self.RESOLUTION = RES.to(motor.LENGTH_UNITS) if motor else RES.to('mm')
+        self.OFFSET = None
+        self.int_time_s = None
+        self._pool = None
+        self._stop_scan = asyncio.Event()
+
+    async def open(self):
+        """Open the client pool."""
+        if self._own_clients:
+            from toptica.lasersdk.asyncio.client import Client, NetworkConnection, SerialConnection
+            if self.port is not None:
+                self.clients = [Client(SerialConnection(self.port))]
+            else:
+                self.clients = [Client(NetworkConnection(self.ip_address)) for _ in range(self.nclients)]
+        for client in self.clients:
+            await client.open()
+        self._pool = asyncio.Queue()
+        for client in self.clients:
+            self._pool.put_nowait(client)
+        print(f'Connected to Toptica with {len(self.clients)} client(s)')
+
+    async def close(self):
+        for client in self.clients:
+            await client.close()
+        self._pool = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def init(self):
+        """Open the clients, initialize encoder and motor, and find the encoder offset."""
+        await self.open()
+        if self.encoder:
+            await asyncio.to_thread(self.encoder.init)
+        if self.motor:
+            await asyncio.to_thread(self.motor.init)
+        if self.encoder and self.motor:
+            await asyncio.to_thread(self.find_offset)
+        return True
+
+    def find_offset(self, use_cache=True):
+        """find the encoder count at motor position 0, reusing the cached offset if it still checks out (blocking)"""
+        if use_cache:
+            offset = self.calibration.check(self.encoder, self.motor, self.RESOLUTION.value)
+            if offset is not None:
+                self.OFFSET = offset
+                return
+        self.motor.move_absolute(0)
+        self.OFFSET = self.encoder.get_count()
+        self.calibration.record(self.encoder, self.motor, self.OFFSET)
+
+    async def _call(self, method, *args):
+        if self._pool is None:
+            raise RuntimeError('Clients not open.')
+        client = await self._pool.get()
+        try:
+            return await getattr(client, method)(*args)
+        finally:
+            self._pool.put_nowait(client)
+
+    async def get(self, name):
+        return await self._call('get', name)
+
+    async def set(self, name, value):
+        return await self._call('set', name, value)
+
+    async def exec(self, name):
+        return await self._call('exec', name)
+
+    async def get_many(self, *names):
+        """Read several parameters concurrently. Returns their values in order."""
+        return await asyncio.gather(*(self.get(name) for name in names))
+
+    async def set_frequency(self, freq_ghz):
+        await self.set('frequency:frequency-set', freq_ghz)
+
+    async def get_frequency(self):
+        return await self.get('frequency:frequency-act')
+
+    async def wait_for_frequency(self, target, tolerance=0.05, timeout=10.0, poll_interval=0.05):
+        """
+        Poll frequency_act until it is within tolerance of `target`.
+
+        Returns: (last frequency_act [GHz], True if converged before the timeout)
+        """
+        t0 = time.time()
+        while True:
+            act = await self.get_frequency()
+            if abs(act - target) <= tolerance:
+                return act, True
+            if time.time() - t0 > timeout:
+                return act, False
+            await asyncio.sleep(poll_interval)
+
+    async def setup_lockin(self, freq_hz, int_time_ms, amp_gain, phase_deg):
+        await asyncio.gather(
+            self.set('lockin:frequency', freq_hz),
+            self.set('lockin:integration-time', int_time_ms),
+            self.set('lockin:amplifier-gain', amp_gain),
+            self.set('lockin:phase', phase_deg))
+        self.int_time_s = int_time_ms / 1000
+
+    async def get_lockin_value(self):
+        """Reset the lock-in, wait one integration time (as configured on the DLC) and read the value."""
+        if self.int_time_s is None:
+            self.int_time_s = float(await self.get('lockin:integration-time')) / 1000
+        await self.exec('lockin:lock-in-reset')
+        await asyncio.sleep(self.int_time_s)
+        return await self.get(LOCKIN_VALUE)
+
+    async def stream_lockin(self, interval_ms=None):
+        """
+        Yield (timestamp [s], lock-in value) as the DLC publishes them on the monitoring line, stamped with the
+        host's time.time() on arrival (not the DLC's clock), so they line up with the encoder. Falls back to
+        reset/integrate/read polling when the connection has no monitoring line.
+
+        Inputs:
+            interval_ms (int): minimum update interval requested from the DLC (if None, the DLC default)
+        """
+        from toptica.lasersdk.asyncio.client import UnavailableError
+        try:
+            subscription = await self.clients[0].subscribe(LOCKIN_VALUE, None, interval_ms)
+        except UnavailableError:
+            print('Monitoring line unavailable; polling the lock-in instead.')
+            subscription = None
+        if subscription is None:
+            while True:
+                value = await self.get_lockin_value()
+                yield time.time(), value
+        try:
+            async for _, value in subscription:
+                # the monitoring line's stamp is UTC on the DLC's own clock (parsed by the SDK into a naive
+                # datetime), so use the host clock the encoder stamps its records with
+                yield time.time(), value
+        finally:
+            await subscription.cancel()
+
+    def stop_scan(self):
+        self._stop_scan.set()
+
+    async def scan_and_collect(self, freq_ghz, velocity, velocity_unit=None, save_to=None, interval_ms=None,
+                               tolerance=0.05, poll_interval=0.01, freq_interval=0.5, **writer_kwargs):
+        """
+        Continuous scan at one frequency. Lock-in values stream from the DLC while the encoder buffer is drained
+        and the frequency re-read in parallel; each lock-in value is given the mirror position interpolated at
+        its timestamp. Ends at the end of travel or on stop_scan().
+
+        Inputs:
+            freq_ghz (float): frequency [GHz]
+            velocity (float): scan velocity
+            velocity_unit (str): units associated with 'velocity' (if None, defaults to motor units)
+            save_to (str): output path for writer.open_writer (if None, nothing is saved)
+            interval_ms (int): lock-in update interval requested from the DLC (default=None)
+            tolerance (float): frequency convergence tolerance [GHz] before the mirror starts (default=0.05)
+            poll_interval (float): time [s] between encoder drains (default=0.01)
+            freq_interval (float): time [s] between frequency_act reads (default=0.5)
+            **writer_kwargs: passed to writer.open_writer
+
+        Returns: dict with 'timestamp', 'position_mm', 'freq_ghz' and 'photocurrent_na' arrays
+        """
+        if not (self.encoder and self.motor):
+            raise RuntimeError('Scans need an encoder and a motor.')
+        self._stop_scan.clear()
+        await self.set_frequency(freq_ghz)
+        freq, _ = await self.wait_for_frequency(freq_ghz, tolerance)
+        sync = Synchronizer(mode='lockin', direction=1 if velocity >= 0 else -1)
+        columns = ['timestamp', 'position_mm', 'freq_ghz', 'photocurrent_na']
+        writer = open_writer(save_to, columns, metadata={'freq_ghz': freq_ghz, 'velocity': velocity}, **writer_kwargs) if save_to else None
+        rows = {c: [] for c in columns}
+        state = {'freq': freq}
+        scale = float(self.RESOLUTION.value)
+        direction = 1 if velocity >= 0 else -1
+        margin = 0.02 * (self.motor.AXIS_MAX - self.motor.AXIS_MIN)
+        pos_end = self.motor.AXIS_MAX - margin if direction > 0 else self.motor.AXIS_MIN + margin
+        stop = {'history': None}
+
+        async def lockin_task():
+            async for t, value in self.stream_lockin(interval_ms):
+                v = float(value[0] if isinstance(value, tuple) else value)
+                sync.push_lockin(timestamp=[t], x=[v], y=[np.nan], r=[abs(v)], theta=[np.nan])
+
+        async def freq_task():
+            while True:
+                await asyncio.sleep(freq_interval)
+                state['freq'] = await self.get_frequency()
+
+        async def encoder_task():
+            while not self._stop_scan.is_set():
+                samples = self.encoder.get_all()
+                if len(samples):
+                    pos = (samples['count'] - self.OFFSET) * scale
+                    # stop at the end of travel in the scan direction, or once the mirror has stalled
+                    stop_idx, stop['history'] = find_stop_index(
+                        samples['timestamp'], direction * pos, direction * pos_end, STATIONARY_TOLERANCE * scale,
+                        STATIONARY_TIMEOUT, stop['history'])
+                    n = len(pos) if stop_idx is None else stop_idx + 1
+                    sync.push_encoder(samples['timestamp'][:n], pos[:n])
+                    out = sync.process()
+                    if len(out['timestamp']):
+                        block = {'timestamp': out['timestamp'], 'position_mm': out['position_mm'],
+                                 'freq_ghz': np.full(len(out['timestamp']), state['freq']), 'photocurrent_na': out['x']}
+                        for c in columns:
+                            rows[c].append(block[c])
+                        if writer:
+                            writer.write(**block)
+                    if stop_idx is not None:
+                        return
+                await asyncio.sleep(poll_interval)
+
+        self.encoder.start_transmission()
+        tasks = []
+        try:
+            await asyncio.to_thread(self.motor.move_velocity, velocity, velocity_unit)
+            tasks = [asyncio.create_task(lockin_task()), asyncio.create_task(freq_task())]
+            await encoder_task()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.to_thread(self.motor.stop)
+            self.encoder.stop_transmission()
+            if writer:
+                writer.close()
+        return {c: np.concatenate(v) if v else np.empty(0) for c, v in rows.items()}
@@ -1,30 +1,32 @@
-from toptica.lasersdk.dlcpro.v2_2_0 import DLCpro, NetworkConnection
 from .encoder import EncoderController
 from .motor import MotorController
+from .writer import open_writer
+from .calibration import OffsetCalibration
 import astropy.units as u
 import threading
 import time 
-import pandas as pd
 from datetime import datetime
 import numpy as np
 
 RES = 0.244140625 * u.um
 
 class TopticaController: 
-    def __init__(self, ip_address = ''): #insert ip address
+    def __init__(self, ip_address = '', dlc = None, motor = None, encoder = None, calibration = None): #insert ip address
         self.ip_address = ip_address
-        self.dlc = None
-        self.motor = MotorController()
-        self.encoder = EncoderController()
+        self.dlc = dlc # pass a DLCpro-like object (e.g. simulate.FakeDLCpro) to skip the network connection
+        self.motor = motor or MotorController()
+        self.encoder = encoder or EncoderController()
         self.RESOLUTION = RES.to(self.motor.LENGTH_UNITS)
         self.OFFSET = None
+        self.calibration = calibration or OffsetCalibration()
         self._scan_thread = None
         self._stop_scan = threading.Event()
-        self.data_store = []
         self._save_filename = None
 
     def init(self):
-        self.dlc = DLCpro(NetworkConnection(self.ip_address))
+        if self.dlc is None:
+            from toptica.lasersdk.dlcpro.v2_2_0 import DLCpro, NetworkConnection
+            self.dlc = DLCpro(NetworkConnection(self.ip_address))
         print(f"Connected to Toptica at {self.ip_address}")
 
         self.encoder.init()
@@ -32,10 +34,18 @@ class TopticaController:
         self.find_offset()
         return True
     
-    def find_offset(self):
+    def find_offset(self, use_cache = True):
+        """find the encoder count at motor position 0, reusing the cached offset if it still checks out"""
+        if use_cache:
+            offset = self.calibration.check(self.encoder, self.motor, self.RESOLUTION.value)
+            if offset is not None:
+                self.OFFSET = offset
+                print(f"Using cached encoder offset {offset}.")
+                return
         self.motor.move_absolute(0)
         cnt0 = self.encoder.get_count()
         self.OFFSET = cnt0
+        self.calibration.record(self.encoder, self.motor, cnt0)
     
     def get_position(self):
         cnt = self.encoder.get_count()
@@ -81,31 +91,39 @@ class TopticaController:
         else:
             self.motor.move_absolute(position, length_unit)
     
-    def scan_and_collect(self, freq_ghz, velocity, velocity_unit = None, sample_rate = 10, lockin_freq_hz = 5000, lockin_int_time_ms = 100, amplifier_gain = 1e6, save_to_csv = None):
-        """start a scan and save results to csv"""
+    def scan_and_collect(self, freq_ghz, velocity, velocity_unit = None, sample_rate = 10, lockin_freq_hz = 5000, lockin_int_time_ms = 100, amplifier_gain = 1e6, save_to = None, **writer_kwargs):
+        """start a scan, streaming results to save_to (.h5, .csv, or a directory of .npy columns)"""
         if self._scan_thread and self._scan_thread.is_alive():
             raise RuntimeError('Scan already in progress.')
         self._stop_scan.clear()
-        self.data_store = []
-        if save_to_csv is None: #automatically save data with timestamped name if name not given
+        if save_to is None: #automatically save data with timestamped name if name not given
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            save_to_csv = f"C:/Users/vnh2/Desktop/FTS/cryo_fts_data/scan_data{timestamp}.csv" # XXX dont like the hard-coding
-        self._save_filename = save_to_csv
-
-        self._scan_thread = threading.Thread(target=self._scan_worker, args=(freq_ghz, velocity, velocity_unit, sample_rate, lockin_freq_hz, lockin_int_time_ms, amplifier_gain), daemon=True)
+            save_to = f"C:/Users/vnh2/Desktop/FTS/cryo_fts_data/scan_data{timestamp}" # XXX dont like the hard-coding
+        self._save_filename = save_to
+        metadata = {
+            'freq_ghz': freq_ghz,
+            'velocity': velocity,
+            'velocity_unit': velocity_unit or self.motor.VELOCITY_UNITS,
+            'lockin_freq_hz': lockin_freq_hz,
+            'lockin_int_time_ms': lockin_int_time_ms,
+            'amplifier_gain': amplifier_gain,
+            'resolution': self.RESOLUTION.value,
+            'length_unit': str(self.RESOLUTION.unit),
+            'offset': self.OFFSET,
+            }
+        writer = open_writer(save_to, ['timestamp', 'position_mm', 'freq_ghz', 'photocurrent_na'], metadata=metadata, **writer_kwargs)
+
+        self._scan_thread = threading.Thread(target=self._scan_worker, args=(freq_ghz, velocity, velocity_unit, sample_rate, lockin_freq_hz, lockin_int_time_ms, amplifier_gain, writer), daemon=True)
         self._scan_thread.start()
 
     def stop_scan(self):
-        """stop scan and save data to csv"""
+        """stop scan and wait for the data to be written"""
         self._stop_scan.set()
         if self._scan_thread and self._scan_thread.is_alive():
             self._scan_thread.join()
-        if self.data_store:
-            df = pd.DataFrame(self.data_store)
-            df.to_csv(self._save_filename, index=False)
             print(f"Saved scan data to {self._save_filename}")
 
-    def _scan_worker(self, freq_ghz, velocity, velocity_unit, sample_rate, lockin_freq_hz, lockin_int_time_ms, amplifier_gain):
+    def _scan_worker(self, freq_ghz, velocity, velocity_unit, sample_rate, lockin_freq_hz, lockin_int_time_ms, amplifier_gain, writer):
         try:
             #self.emission_on()
             #time.sleep(1)
@@ -123,9 +141,7 @@ class TopticaController:
             stationary_count = 0 
             STATIONARY_THRESHOLD = 5
             
-            with open(self._save_filename, 'w') as f:
-                f.write("timestamp,position_mm,frequency_ghz,photocurrent_na\n")
-                
+            with writer:
                 iteration = 0
                 while not self._stop_scan.is_set():
                     iteration += 1
@@ -161,16 +177,14 @@ class TopticaController:
                     photocurrent, valid = self.get_photocurrent()
                     freq_act = self.get_frequency()
 
-                    record = ({
-                        'timestamp': t_enc,
-                        'position_mm': pos,
-                        'freq_ghz': freq_act,
-                        'photocurrent_na': photocurrent})
-                    self.data_store.append(record)
-                    f.write(f"{t_enc},{pos},{freq_act},{photocurrent}\n")
-                    f.flush()
+                    writer.write(
+                        timestamp=[np.nan if t_enc is None else t_enc],
+                        position_mm=[np.nan if pos is None else pos],
+                        freq_ghz=[freq_act],
+                        photocurrent_na=[photocurrent])
                     time.sleep(period)
         finally:
+            writer.close()
             self.motor.stop()
             self.encoder.stop_transmission()
             #self.emission_off()
\ No newline at end of file
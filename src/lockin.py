@@ -1,32 +1,56 @@
 import os
-import serial
 import time
 import threading
-import queue
 import numpy as np
-import serial.tools.list_ports
+from .ringbuffer import RingBuffer
+from .registry import get_registry
+from . import metrics
+
+LOCKIN_DTYPE = [('timestamp', 'f8'), ('x', 'f8'), ('y', 'f8'), ('r', 'f8'), ('theta', 'f8')]
+GPIB_RTT = metrics.histogram('cryo_fts_lockin_gpib_rtt_seconds', 'Round trip of lock-in queries over GPIB', ['command'])
+CAPTURE_OVERFLOWS = metrics.counter('cryo_fts_lockin_capture_overflow_kb_total', 'kB overwritten in the lock-in capture buffer before they were read')
+CAPTURE_CONFIGS = {'X': 0, 'XY': 1, 'RT': 2, 'XYRT': 3} # CAPTURECFG argument
+CAPTURE_MAX_KB = 64 # largest block returned by one CAPTUREGET? query
 
 class LockinController:
-    def __init__(self, gpib_address=8, baudrate=115200, timeout=1.0):
+    def __init__(self, gpib_address=8, baudrate=115200, timeout=1.0, buffer_size=1 << 16, connection=None,
+                 data_buffer=None):
         """
         Instantiate connection to SR865A lock-in amplifier via Prologix GPIB-USB controller.
+
+        Inputs:
+            gpib_address (int): GPIB address of the lock-in (default=8)
+            baudrate (int): baudrate of the Prologix serial connection (default=115200)
+            timeout (float): time [s] to wait for response before raising a time-out error (default=1.0)
+            buffer_size (int): number of (timestamp, x, y, r, theta) records held in the data buffer (default=65536)
+            connection: open serial-like transport to use instead of searching the ports, e.g. a
+                simulate.FakePrologix (default=None)
+            data_buffer (RingBuffer): ring to publish records into instead of a private one, e.g. one in shared
+                memory (see procacq) (default=None)
         """
         self.gpib_address = gpib_address
         self.timeout = timeout
         self.port = None
-        self.device = None
+        self.device = None # the Prologix adapter's version string
+        self.idn = None # the lock-in's own *IDN? reply, read by init() or get_idn()
         self.connection = None
         self.transmitting = False
-        self.data_queue = queue.Queue()
+        self.capturing = False
+        self.capture_rate = None
+        self.capture_overflows = 0 # kB overwritten in the instrument before they were read
+        self.data_buffer = data_buffer if data_buffer is not None else RingBuffer(buffer_size, LOCKIN_DTYPE)
+        self._read_cursor = 0
         self._reading_thread = None
         self._stop_thread = threading.Event()
 
         #find and connect to Prologix controller
-        ports = [p.device for p in serial.tools.list_ports.comports()]
+        if connection is None:
+            import serial # pyserial is only needed for hardware
+        ports = [getattr(connection, 'port', None)] if connection is not None else get_registry().ports('lockin')
 
         for port in ports:
             try:
-                conn = serial.Serial(port, baudrate=baudrate, timeout=timeout)
+                conn = connection if connection is not None else serial.Serial(port, baudrate=baudrate, timeout=timeout)
                 conn.reset_input_buffer()
                 conn.reset_output_buffer()
 
@@ -39,6 +63,8 @@ class LockinController:
                     self.port = port
                     self.device = response
                     print(f'Established connection to {self.device} on {self.port}')
+                    if connection is None:
+                        get_registry().remember('lockin', port, str(self.device))
                     break
                 else:
                     conn.close()
@@ -55,11 +81,9 @@ class LockinController:
         self.write('++eoi 1')
         self.write('++mode 1')
         self.write('OUTX 1')
-        print("Lock-in ID:", self.write('*IDN?', read=True))
+        print("Lock-in ID:", self.get_idn())
         self.write('*CLS')
         self.write('RSRC EXT')
-        self.data_buffer = []
-        self.buffer_lock = threading.Lock()
 
     def close(self):
         """Close connection."""
@@ -80,9 +104,19 @@ class LockinController:
         if isinstance(cmd, str):
             cmd = cmd.encode('ascii')
         self._clear_buffer()
+        p0 = time.perf_counter()
         self.connection.write(cmd + b'\r\n')
         if read:
-            return self.read(timeout=timeout)
+            rsp = self.read(timeout=timeout)
+            self._observe_rtt(cmd, p0)
+            return rsp
+
+    @staticmethod
+    def _observe_rtt(cmd, p0):
+        dt = time.perf_counter() - p0
+        name = cmd.split(maxsplit=1)[0].decode('ascii', errors='replace') if cmd.strip() else ''
+        GPIB_RTT.labels(command=name).observe(dt)
+        metrics.TRACER.add('lockin.query', time.time() - dt, dt, command=name)
 
     def read(self, timeout=2.0):
         """Read from the lockin."""
@@ -91,6 +125,19 @@ class LockinController:
         if not rsp:
             raise TimeoutError('No response from lockin.')
         return rsp.decode('utf-8', errors='ignore').strip()
+
+    def read_binary(self, timeout=2.0):
+        """Read an IEEE 488.2 definite-length binary block (#<n><length><data>) from the lockin."""
+        self.connection.timeout = timeout
+        head = self.connection.read(2)
+        if len(head) < 2 or head[:1] != b'#':
+            raise RuntimeError(f'Invalid binary block header: {head}')
+        ndigits = int(head[1:2])
+        nbytes = int(self.connection.read(ndigits))
+        data = self.connection.read(nbytes)
+        if len(data) < nbytes:
+            raise TimeoutError('Incomplete binary block from lockin.')
+        return data
     
     def get_x_y_r_theta(self):
         """x, y, and r in V. theta in degrees."""
@@ -98,6 +145,11 @@ class LockinController:
         x, y, r, theta = xyrtheta.split(',')
         return float(x), float (y), float(r), float(theta)
     
+    def get_idn(self):
+        """Identity of the lock-in (manufacturer, model, serial number, firmware)."""
+        self.idn = self.write('*IDN?', read=True)
+        return self.idn
+
     def get_freq(self):
         """freq in Hz"""
         freq = self.write('FREQ?', read=True)
@@ -140,6 +192,8 @@ class LockinController:
         """
         if self.transmitting:
             return
+        self.data_buffer.clear()
+        self._read_cursor = 0
         self.transmitting = True
         self._stop_thread.clear()
         self._reading_thread = threading.Thread(target=self._read_loop, args=(sample_rate,), daemon=True)
@@ -148,67 +202,143 @@ class LockinController:
 
     def stop_transmission(self):
         """
-        Disable continuous transmission and stop background reader.
+        Disable continuous transmission (or hardware capture) and stop background reader.
         """
         if not self.transmitting:
             return
         self._stop_thread.set()
         if self._reading_thread:
             self._reading_thread.join(timeout=1.0)
+        if self.capturing:
+            self.write('CAPTURESTOP')
+            self.capturing = False
         self.transmitting = False
         self._clear_buffer()
         print('Continuous transmission stopped.') 
 
+    def start_capture(self, length_kb=256, config='XYRT', rate_divider=0, poll_interval=0.01):
+        """
+        Stream data from the SR865A's internal capture buffer instead of polling SNAPD?. The instrument samples
+        at CAPTURERATEMAX?/2**rate_divider into a circular on-board buffer, which is drained in binary CAPTUREGET?
+        blocks and decoded into the data buffer with timestamps reconstructed from the capture rate.
+
+        Inputs:
+            length_kb (int): size [kB] of the on-board capture buffer (default=256)
+            config (str): quantities captured, one of 'X', 'XY', 'RT', 'XYRT' (default='XYRT')
+            rate_divider (int): capture rate is the maximum rate divided by 2**rate_divider (default=0)
+            poll_interval (float): time [s] to wait when no new complete kB is available (default=0.01)
+        """
+        if self.transmitting:
+            return
+        if config not in CAPTURE_CONFIGS:
+            raise ValueError(f'Capture config must be one of {list(CAPTURE_CONFIGS)}.')
+        self.write(f'CAPTURELEN {length_kb}')
+        self.write(f'CAPTURECFG {CAPTURE_CONFIGS[config]}')
+        self.write(f'CAPTURERATE {rate_divider}')
+        self.capture_rate = float(self.write('CAPTURERATEMAX?', read=True)) / 2**rate_divider
+        self.capture_overflows = 0
+        self.data_buffer.clear()
+        self._read_cursor = 0
+        self.write('CAPTURESTART 1, 0') # continuous, start immediately
+        t0 = time.time()
+        self.capturing = True
+        self.transmitting = True
+        self._stop_thread.clear()
+        self._reading_thread = threading.Thread(target=self._capture_loop, args=(t0, length_kb, config, poll_interval), daemon=True)
+        self._reading_thread.start()
+        print(f'Capture started at {self.capture_rate:.1f} Hz.')
+
+    def _capture_loop(self, t0, length_kb, config, poll_interval):
+        """
+        Background reader for the on-board capture buffer. Only whole kB are transferred, so every block holds
+        an integer number of samples.
+        """
+        nfields = len(config) # one float32 per captured quantity
+        sample_bytes = 4 * nfields
+        read_kb = 0 # kB transferred since CAPTURESTART
+        records = metrics.RECORDS.labels(device='lockin')
+        errors = metrics.READ_ERRORS.labels(device='lockin')
+        while not self._stop_thread.is_set():
+            try:
+                written_kb = int(self.write('CAPTUREBYTES?', read=True)) // 1024
+                lag = written_kb - read_kb
+                if lag > length_kb - 1: # the instrument has wrapped onto unread data
+                    self.capture_overflows += lag - (length_kb - 1)
+                    CAPTURE_OVERFLOWS.inc(lag - (length_kb - 1))
+                    read_kb = written_kb - (length_kb - 1)
+                    lag = length_kb - 1
+                if lag <= 0:
+                    time.sleep(poll_interval)
+                    continue
+                offset = read_kb % length_kb
+                nkb = min(lag, CAPTURE_MAX_KB, length_kb - offset)
+                p0 = time.perf_counter()
+                self.write(f'CAPTUREGET? {offset}, {nkb}')
+                block = self.read_binary()
+                self._observe_rtt(b'CAPTUREGET?', p0)
+                vals = np.frombuffer(block, dtype='<f4').reshape(-1, nfields).astype(np.float64)
+                first = read_kb * 1024 // sample_bytes
+                timestamps = t0 + (first + np.arange(len(vals))) / self.capture_rate
+                self.data_buffer.write(timestamp=timestamps, **self._capture_columns(vals, config))
+                records.inc(len(vals))
+                read_kb += nkb
+            except Exception as e:
+                errors.inc()
+                print(f'Capture loop error: {e}')
+
+    @staticmethod
+    def _capture_columns(vals, config):
+        """Fill x, y, r and theta from the captured quantities, deriving what can be derived."""
+        nan = np.full(len(vals), np.nan)
+        if config == 'X':
+            return {'x': vals[:, 0], 'y': nan, 'r': nan, 'theta': nan}
+        if config == 'RT':
+            r, theta = vals[:, 0], vals[:, 1]
+            return {'x': r * np.cos(np.radians(theta)), 'y': r * np.sin(np.radians(theta)), 'r': r, 'theta': theta}
+        x, y = vals[:, 0], vals[:, 1]
+        if config == 'XY':
+            return {'x': x, 'y': y, 'r': np.hypot(x, y), 'theta': np.degrees(np.arctan2(y, x))}
+        return {'x': x, 'y': y, 'r': vals[:, 2], 'theta': vals[:, 3]}
+
     def _read_loop(self, sample_rate):
         """
         Background reader for lockin data.
         """
         period = 1.0/sample_rate
+        records = metrics.RECORDS.labels(device='lockin')
+        errors = metrics.READ_ERRORS.labels(device='lockin')
         while not self._stop_thread.is_set():
             try:
                 #get x, y, r, and theta data
                 x, y, r, theta = self.get_x_y_r_theta()
                 timestamp = time.time()
-                self.data_queue.put({
-                    'timestamp': timestamp,
-                    'x': x,
-                    'y': y,
-                    'r': r,
-                    'theta': theta})
-                with self.buffer_lock:
-                    self.data_buffer.append({
-                        'timestamp': timestamp,
-                        'x': x,
-                        'y': y,
-                        'r': r,
-                        'theta': theta
-                    })
-                    if len(self.data_buffer) > 1000:
-                        self.data_buffer.pop(0)
-                        
+                self.data_buffer.write(timestamp=[timestamp], x=[x], y=[y], r=[r], theta=[theta])
+                records.inc()
                 time.sleep(period)
             except Exception as e:
+                errors.inc()
                 print(f'Read loop error: {e}') 
     
     def get_closest_time(self, target_time):
         """get the lock-in reading closest to target time"""
         all_data = self.get_all()
-        if not all_data:
+        if not len(all_data):
             return None
-        else:
-            closest = min(all_data, key= lambda d: abs(d['timestamp'] - target_time))
-            return closest
+        t = all_data['timestamp']
+        j = min(np.searchsorted(t, target_time), len(t) - 1)
+        if j > 0 and abs(t[j - 1] - target_time) <= abs(t[j] - target_time):
+            j -= 1
+        return all_data[j]
     
     def get_latest(self):
-        """Get the latest (x, y, r, theta) from the queue."""
-        latest = None
-        try:
-            while True:
-                latest = self.data_queue.get_nowait()
-        except queue.Empty:
-            pass
-        return latest
+        """Get the latest (timestamp, x, y, r, theta) record from the buffer."""
+        return self.data_buffer.latest()
 
     def get_all(self):
-        with self.buffer_lock:
-            return list(self.data_buffer)
\ No newline at end of file
+        """Get a view of all records held in the buffer."""
+        return self.data_buffer.snapshot()
+
+    def get_new(self):
+        """Get a view of the records received since the last call."""
+        data, self._read_cursor = self.data_buffer.read_since(self._read_cursor)
+        return data
@@ -0,0 +1,370 @@
+### Counters, gauges and histograms for the acquisition path, exposed in Prometheus text format, and scan traces ###
+
+import os
+import json
+import time
+import bisect
+import threading
+import contextlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0) # [s]
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Value:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last is the +Inf bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextlib.contextmanager
+    def time(self):
+        """Observe the wall time [s] spent in the with-block."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0)
+
+class Metric:
+    TYPE = None
+
+    def __init__(self, name, help, labelnames=()):
+        """
+        A metric family: one value per combination of label values, created on first use. A family is left
+        out of the exposition until it has a value, so a process only reports the devices it actually runs.
+        Updates are not locked; each value is expected to be updated from one thread at a time.
+
+        Inputs:
+            name (str): metric name, e.g. 'cryo_fts_records_total'
+            help (str): one-line description
+            labelnames (list): names of the labels (default=(), a single unlabelled value)
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _new(self):
+        return _Value()
+
+    def labels(self, **labels):
+        """The value for these label values."""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        value = self._values.get(key)
+        if value is None:
+            with self._lock:
+                value = self._values.setdefault(key, self._new())
+        return value
+
+    def _unlabelled(self):
+        if self.labelnames:
+            raise RuntimeError(f'{self.name} needs labels {list(self.labelnames)}.')
+        return self.labels()
+
+    def state(self):
+        """Picklable description and values of the family, for merging across processes (see Registry.collect)."""
+        return {'type': self.TYPE, 'help': self.help, 'labelnames': self.labelnames,
+                'values': {key: self._dump(value) for key, value in list(self._values.items())}}
+
+    @staticmethod
+    def _dump(value):
+        return value.value
+
+    def snapshot(self):
+        """dict of label values (a tuple) -> current value."""
+        return {key: value.value for key, value in list(self._values.items())}
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount=1):
+        self._unlabelled().inc(amount)
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def set(self, value):
+        self._unlabelled().set(value)
+
+    def inc(self, amount=1):
+        self._unlabelled().inc(amount)
+
+    def dec(self, amount=1):
+        self._unlabelled().dec(amount)
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._unlabelled().observe(value)
+
+    def time(self):
+        return self._unlabelled().time()
+
+    def state(self):
+        return dict(super().state(), buckets=self.buckets)
+
+    @staticmethod
+    def _dump(value):
+        return list(value.counts), value.sum, value.count
+
+    def snapshot(self):
+        """dict of label values -> {'count', 'sum', 'buckets': {upper bound: cumulative count}}."""
+        out = {}
+        for key, (counts, total, count) in self.state()['values'].items():
+            out[key] = {'count': count, 'sum': total,
+                        'buckets': dict(zip(self.buckets + (float('inf'),), _cumsum(counts)))}
+        return out
+
+def _cumsum(counts):
+    out, total = [], 0
+    for n in counts:
+        total += n
+        out.append(total)
+    return out
+
+def _labelstr(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+def render(states):
+    """
+    Prometheus text exposition of metric families.
+
+    Inputs:
+        states (dict): metric name -> Metric.state()
+
+    Returns: str
+    """
+    lines = []
+    for name, st in states.items():
+        if not st['values']:
+            continue
+        lines += [f'# HELP {name} {_escape(st["help"])}', f'# TYPE {name} {st["type"]}']
+        labelnames = st['labelnames']
+        for key, value in sorted(st['values'].items()):
+            if st['type'] != 'histogram':
+                lines.append(f'{name}{_labelstr(labelnames, key)} {_format(value)}')
+                continue
+            counts, total, count = value
+            for le, n in zip(tuple(st['buckets']) + (float('inf'),), _cumsum(counts)):
+                lines.append(f'{name}_bucket{_labelstr(labelnames, key, [("le", _format(le))])} {n}')
+            lines.append(f'{name}_sum{_labelstr(labelnames, key)} {_format(total)}')
+            lines.append(f'{name}_count{_labelstr(labelnames, key)} {count}')
+    return '\n'.join(lines) + '\n' if lines else ''
+
+class Registry:
+    def __init__(self):
+        """
+        The metric families of a process, plus collectors that contribute the families of other processes
+        (e.g. the reader processes of procacq).
+        """
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise RuntimeError(f'Metric {name} is already registered as a different {metric.TYPE}.')
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        """Get or create a Counter."""
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        """Get or create a Gauge."""
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        """Get or create a Histogram."""
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def get(self, name):
+        return self._metrics[name]
+
+    def add_collector(self, collector):
+        """Add a callable returning more metric states (name -> Metric.state()), e.g. from another process."""
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def state(self):
+        """name -> Metric.state() of this process's families."""
+        return {name: metric.state() for name, metric in list(self._metrics.items())}
+
+    def collect(self):
+        """
+        States of this process's families merged with those of the collectors. Values of a family are merged
+        by label; where a collector reports the same labels, its value wins.
+        """
+        states = self.state()
+        for collector in list(self._collectors):
+            try:
+                extra = collector()
+            except Exception as e:
+                print(f'Metrics collector error: {e}')
+                continue
+            for name, st in extra.items():
+                if name in states:
+                    states[name]['values'].update(st['values'])
+                else:
+                    states[name] = st
+        return states
+
+    def snapshot(self):
+        """dict of metric name -> Metric.snapshot(), for this process only."""
+        return {name: metric.snapshot() for name, metric in list(self._metrics.items()) if metric._values}
+
+    def expose(self):
+        """All metrics (including collectors) in the Prometheus text exposition format."""
+        return render(self.collect())
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+# shared by the device readers; the device label tells them apart
+RECORDS = counter('cryo_fts_records_total', 'Records published to the data buffer', ['device'])
+READ_ERRORS = counter('cryo_fts_read_errors_total', 'Exceptions caught in the background reader loop', ['device'])
+BACKLOG = gauge('cryo_fts_buffer_backlog_records', 'Unread records in the data buffer at the last drain', ['device'])
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path in ('/', '/metrics'):
+            body = self.registry.expose().encode()
+            ctype = 'text/plain; version=0.0.4; charset=utf-8'
+        elif path == '/metrics.json':
+            states = {name: dict(st, values={','.join(key): v for key, v in st['values'].items()})
+                      for name, st in self.registry.collect().items() if st['values']}
+            body = json.dumps(states, default=str).encode()
+            ctype = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port=9100, host='127.0.0.1', registry=None):
+    """
+    Serve the metrics over HTTP from a background thread: /metrics in Prometheus text format and
+    /metrics.json as the raw states (histograms as per-bucket counts, sum and count). Call shutdown() on the returned server to stop it.
+
+    Inputs:
+        port (int): TCP port; 0 picks a free one (see server.server_address) (default=9100)
+        host (str): interface to bind (default='127.0.0.1', local only)
+        registry (Registry): metrics to serve (default=REGISTRY)
+
+    Returns: the running http.server.ThreadingHTTPServer
+    """
+    handler = type('Handler', (_Handler,), {'registry': registry or REGISTRY})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    print(f'Serving metrics on http://{server.server_address[0]}:{server.server_address[1]}/metrics')
+    return server
+
+class Tracer:
+    def __init__(self, maxlen=1 << 20):
+        """
+        Timeline of spans (name, start, duration, thread, arguments) recorded while enabled, dumped in the
+        Chrome trace event format (open in chrome://tracing or ui.perfetto.dev). Recording is a no-op while
+        disabled, so the instrumented code can leave its calls in place.
+
+        Inputs:
+            maxlen (int): spans kept; the oldest are dropped beyond this (default=1 << 20)
+        """
+        self.enabled = False
+        self._events = deque(maxlen=maxlen)
+
+    def start(self):
+        """Forget previous spans and start recording."""
+        self._events.clear()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def add(self, name, t0, duration, **args):
+        """Record a span that started at time.time() t0 and lasted `duration` [s]."""
+        if self.enabled:
+            self._events.append((name, t0, duration, threading.get_ident(), args))
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        """Record the with-block as a span."""
+        if not self.enabled:
+            yield
+            return
+        t0 = time.time()
+        p0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, t0, time.perf_counter() - p0, **args)
+
+    def dump(self, path):
+        """Write the recorded spans to a JSON trace file."""
+        pid = os.getpid()
+        events = [{'name': name, 'ph': 'X', 'ts': t0 * 1e6, 'dur': dur * 1e6, 'pid': pid, 'tid': tid, 'args': args}
+                  for name, t0, dur, tid, args in list(self._events)]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+        print(f'Wrote {len(events)} trace events to {path}')
+
+TRACER = Tracer()
@@ -1,38 +1,115 @@
 from .encoder import EncoderController
 from .motor import MotorController
-# from .lockin import LockinController
+from .lockin import LockinController
+from .procacq import ProcessEncoder, ProcessLockin
+from .synchronizer import Synchronizer, SYNC_COLUMNS
+from .stepscan import StepScanner
+from .trigger import OPDTrigger, TRIGGER_COLUMNS
+from .strokes import StrokeTracker, STROKE_COLUMNS
+from .writer import open_writer
+from .calibration import OffsetCalibration
+from . import metrics
 import astropy.units as u
 import threading
 import time 
-import pandas as pd
+import numpy as np
 from datetime import datetime
 
 RES = 0.244140625 * u.um
+BLOCK_LATENCY = metrics.histogram('cryo_fts_scan_block_seconds', 'Time to merge and write one drained block of a scan')
+
+def find_stop_index(t, pos, pos_max, tolerance, timeout, history=None):
+    """
+    Find where a continuous scan should stop within a block of encoder samples, either because the mirror
+    reached the end of travel or because it has moved no more than `tolerance` over the last `timeout` seconds.
+    Comparing positions a timeout apart, rather than consecutive samples, keeps slow scans (a count or less
+    between samples) going and lets a mirror dithering by a count at rest stop.
+
+    Inputs:
+        t (numpy.ndarray): sample timestamps [s]
+        pos (numpy.ndarray): sample positions
+        pos_max (float): position at which the scan ends
+        tolerance (float): largest displacement over `timeout` still counted as stationary
+        timeout (float): time [s] the mirror must be stationary before stopping
+        history (tuple): (timestamps, positions) carried over from the previous block (None at the start of a scan)
+
+    Returns: (index, history) where index is the sample at which to stop (inclusive; None to keep going) and
+    history carries the samples still needed to the next block.
+    """
+    if history is not None:
+        t_all = np.concatenate([history[0], t])
+        pos_all = np.concatenate([history[1], pos])
+    else:
+        t_all, pos_all = np.asarray(t, dtype=float), np.asarray(pos, dtype=float)
+    n = pos.size
+    if n == 0:
+        return None, history
+    # for each sample, the latest sample at least `timeout` older
+    j = np.searchsorted(t_all, t - timeout, side='right') - 1
+    stationary = (j >= 0) & (np.abs(pos - pos_all[np.maximum(j, 0)]) <= tolerance)
+    stop = (pos >= pos_max) | stationary
+    index = int(np.argmax(stop)) if stop.any() else None
+    end = t_all.size - n + (n - 1 if index is None else index)
+    first = max(int(np.searchsorted(t_all, t_all[end] - timeout, side='right')) - 1, 0)
+    return index, (t_all[first:end + 1], pos_all[first:end + 1])
 
 class MirrorController:
-    def __init__(self):
-        # self.lockin = LockinController(gpib_address=8)
-        self.encoder = EncoderController()
-        self.motor = MotorController()
+    def __init__(self, use_lockin=False, gpib_address=8, encoder=None, motor=None, lockin=None, calibration=None,
+                 processes=False):
+        """
+        Instantiate the mirror stage: encoder, motor and (optionally) the SR865A lock-in.
+
+        Inputs:
+            use_lockin (bool): connect to the lock-in and merge its data into scans (default=False)
+            gpib_address (int): GPIB address of the lock-in (default=8)
+            encoder (EncoderController): already-constructed encoder to use, e.g. on a simulated transport (default=None)
+            motor (MotorController): already-constructed motor to use (default=None)
+            lockin (LockinController): already-constructed lock-in to use; implies use_lockin (default=None)
+            calibration (OffsetCalibration): store of encoder offsets (default=OffsetCalibration())
+            processes (bool): run the encoder and lock-in readers that are not supplied in their own processes,
+                publishing into shared memory (see procacq), so that capture keeps up while this process is busy
+                (default=False)
+        """
+        if lockin is None and use_lockin:
+            lockin = ProcessLockin(gpib_address=gpib_address) if processes else LockinController(gpib_address=gpib_address)
+        self.lockin = lockin
+        self.encoder = encoder or (ProcessEncoder() if processes else EncoderController())
+        self.motor = motor or MotorController()
         self.RESOLUTION = RES.to(self.motor.LENGTH_UNITS)
+        self._scale = float(self.RESOLUTION.value) # plain float for converting counts in bulk
         self.OFFSET = None
+        self.calibration = calibration or OffsetCalibration()
         self._scan_thread = None
         self._stop_scan = threading.Event()
-        self.data_store = []
         self._save_filename = None
 
     def init(self):
-        # self.lockin.init()
+        if self.lockin:
+            self.lockin.init()
         self.encoder.init()
         self.motor.init()
         self.find_offset()
         self.encoder.start_transmission()
         return True
     
-    def find_offset(self):
+    def find_offset(self, use_cache=True):
+        """
+        Find the encoder count at motor position 0. A cached offset that still agrees with the current encoder
+        and motor readings is used without moving; otherwise the motor is driven to 0 and the result cached.
+
+        Inputs:
+            use_cache (bool): try the cached offset first (default=True)
+        """
+        if use_cache:
+            offset = self.calibration.check(self.encoder, self.motor, self._scale)
+            if offset is not None:
+                self.OFFSET = offset
+                print(f'Using cached encoder offset {offset}.')
+                return
         self.motor.move_absolute(0)
         cnt0 = self.encoder.get_count()
         self.OFFSET = cnt0
+        self.calibration.record(self.encoder, self.motor, cnt0)
 
     def get_position(self):
         cnt = self.encoder.get_count()
@@ -43,7 +120,8 @@ class MirrorController:
         self.stop_scan()
         self.encoder.close()
         self.motor.close()
-        # self.lockin.close()
+        if self.lockin:
+            self.lockin.close()
 
     def move_absolute(self, position, length_unit=None, async_move=False):
         if async_move:
@@ -59,93 +137,258 @@ class MirrorController:
         else:
             self.motor.move_relative(position, length_unit)
 
-    def scan_and_collect(self, velocity, velocity_unit=None, poll_interval=0.001, save_to_csv=None):
-        """start a scan and save results to csv"""
+    def step_scan(self, positions, length_unit=None, nsamps=50, **kwargs):
+        """
+        Step through `positions`, settling on the encoder and integrating the lock-in at each one.
+
+        Inputs:
+            positions (array-like): motor positions to visit
+            length_unit (str): units associated with 'positions' (if None, defaults to motor units)
+            nsamps (int): lock-in readings per step (default=50)
+            **kwargs: options passed to StepScanner (settle_tolerance, settle_time, settle_timeout, capture,
+                rate_divider)
+
+        Returns: StepScanner.run() results, plus 'position_mm' from the encoder
+        """
+        if not self.lockin:
+            raise RuntimeError('Step scans need the lock-in; use MirrorController(use_lockin=True).')
+        res = StepScanner(self.motor, self.encoder, self.lockin, nsamps=nsamps, **kwargs).run(positions, length_unit)
+        res['position_mm'] = (res['counts'] - self.OFFSET) * self._scale
+        return res
+
+    def scan_and_collect(self, velocity, velocity_unit=None, poll_interval=0.001, save_to=None,
+                         lockin_rate=20, lockin_capture=False, sync_mode='lockin', preview=None, trigger_step=None,
+                         strokes=1, trace=None, **writer_kwargs):
+        """
+        Start a scan, streaming results to disk as they arrive. With a lock-in attached, the encoder and lock-in
+        streams are merged by timestamp into an OPD-indexed interferogram; otherwise raw encoder positions are saved.
+
+        Inputs:
+            velocity (float): scan velocity
+            velocity_unit (str): units associated with 'velocity' (if None, defaults to motor units)
+            poll_interval (float): time [s] to wait between drains of the encoder buffer (default=0.001)
+            save_to (str): output path; .h5 for HDF5, .csv for CSV, otherwise a directory of .npy columns
+            lockin_rate (float): lock-in polling rate [Hz] when not using hardware capture (default=20)
+            lockin_capture (bool): stream the lock-in's on-board capture buffer instead of polling (default=False)
+            sync_mode (str): 'lockin' to sample position at lock-in times, 'encoder' for the reverse (default='lockin')
+            preview (RollingSpectrum): live spectrum estimator fed with every merged block (lock-in only; default=None)
+            trigger_step (float): if given, read the lock-in each time the OPD crosses a grid of this step [mm]
+                instead of on a timer (see trigger.OPDTrigger; lock-in only, adds a 'target_opd_mm' column)
+            strokes (int): strokes to scan, reversing at each end of the track and recording through the
+                turnarounds; each row gets 'stroke' and 'direction' columns (see strokes.split_strokes).
+                None scans back and forth until stop_scan() (default=1, a single stroke)
+            trace (str): if given, record a timeline of the scan (reads, merges, flushes, motor commands) in this
+                process and write it here as a Chrome trace JSON file when the scan ends (see metrics.Tracer)
+            **writer_kwargs: passed to writer.open_writer (flush_interval, chunk_rows, compression)
+        """
         if self._scan_thread and self._scan_thread.is_alive():
             raise RuntimeError('Scan already in progress.')
         self._stop_scan.clear()
-        self.data_store = []
-        if save_to_csv is None: #automatically save data with timestamped name if name not given
+        if save_to is None: #automatically save data with timestamped name if name not given
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            save_to_csv = f"C:/Users/vnh2/Desktop/FTS/cryo_fts_data/scan_data{timestamp}.csv" # XXX dont like the hard-coding
-        self._save_filename = save_to_csv
+            save_to = f"C:/Users/vnh2/Desktop/FTS/cryo_fts_data/scan_data{timestamp}" # XXX dont like the hard-coding
+        self._save_filename = save_to
+        metadata = {
+            'velocity': velocity,
+            'velocity_unit': velocity_unit or self.motor.VELOCITY_UNITS,
+            'resolution': self.RESOLUTION.value,
+            'length_unit': str(self.RESOLUTION.unit),
+            'offset': self.OFFSET,
+            'instrument': self.instrument_settings(),
+            }
+        direction = 1 if velocity >= 0 else -1
+        if (preview is not None or trigger_step) and not self.lockin:
+            raise RuntimeError('Spectrum previews and triggered scans need the lock-in; use MirrorController(use_lockin=True).')
+        if preview is not None:
+            preview.reset(direction=direction)
+        if trigger_step and strokes != 1:
+            raise RuntimeError('Triggered scans are single-stroke.')
+        if trigger_step:
+            metadata['trigger_step'] = trigger_step
+            writer = open_writer(save_to, TRIGGER_COLUMNS, metadata=metadata, **writer_kwargs)
+            trigger = OPDTrigger(trigger_step, direction=direction)
+            target, args = self._triggered_worker, (velocity, velocity_unit, writer, poll_interval, trigger, preview)
+        else:
+            columns = {name: 'f8' for name in (SYNC_COLUMNS if self.lockin else ['timestamp', 'position_mm'])}
+            tracker = None
+            if strokes != 1:
+                metadata['strokes'] = strokes
+                columns.update(STROKE_COLUMNS)
+                tracker = StrokeTracker(direction)
+            writer = open_writer(save_to, columns, metadata=metadata, **writer_kwargs)
+            # both directions are kept when scanning back and forth
+            sync = Synchronizer(mode=sync_mode, direction=direction, monotonic=tracker is None) if self.lockin else None
+            target, args = self._scan_worker, (velocity, velocity_unit, writer, poll_interval, sync, lockin_rate, lockin_capture, preview, tracker, strokes)
 
-        self._scan_thread = threading.Thread(target=self._scan_worker, args=(velocity, velocity_unit, poll_interval), daemon=True)
+        if trace:
+            metrics.TRACER.start()
+        self._scan_thread = threading.Thread(target=self._run_traced, args=(target, args, trace), daemon=True)
         self._scan_thread.start()
 
+    def _run_traced(self, target, args, trace):
+        try:
+            target(*args)
+        finally:
+            if trace:
+                metrics.TRACER.stop()
+                metrics.TRACER.dump(trace)
+
+    def get_metrics(self):
+        """
+        Current acquisition metrics of this process (see metrics.Registry.snapshot); metrics.serve() exposes
+        them, with those of any reader processes, over HTTP.
+        """
+        return metrics.REGISTRY.snapshot()
+
+    def instrument_settings(self):
+        """Devices in use and the lock-in settings, for scan metadata."""
+        settings = {'encoder': str(self.encoder.device), 'encoder_port': str(self.encoder.port)}
+        if self.lockin:
+            settings.update({
+                'lockin': str(self.lockin.idn or self.lockin.get_idn()),
+                'lockin_adapter': str(self.lockin.device),
+                'lockin_freq_hz': self.lockin.get_freq(),
+                'lockin_amp_v': self.lockin.get_amp(),
+                'lockin_timeconstant': self.lockin.get_timeconstant(),
+                'lockin_sensitivity': self.lockin.get_sens(),
+                })
+        return settings
+
     def stop_scan(self):
-        """stop scan and save data to csv"""
+        """stop scan and wait for the data to be written"""
         self._stop_scan.set()
         if self._scan_thread and self._scan_thread.is_alive():
             self._scan_thread.join()
-        if self.data_store:
-            df = pd.DataFrame(self.data_store)
-            if 'position' in df.columns:
-                df['position_mm'] = df['position'].apply(lambda p: p.to(u.mm).value if p is not None else None)
-            df.to_csv(self._save_filename, index=False)
             print(f"Saved scan data to {self._save_filename}")
 
-    def _scan_worker(self, velocity, velocity_unit, poll_interval=None):
+    def _scan_worker(self, velocity, velocity_unit, writer, poll_interval=None, sync=None, lockin_rate=20, lockin_capture=False, preview=None, tracker=None, strokes=1):
         try:
             if poll_interval is None:
-                poll_interval = self.encoder.TRANSMISSION_RATE
+                poll_interval = self.encoder.TRANMISSION_RATE
             self.encoder.start_transmission()
+            if sync:
+                if lockin_capture:
+                    self.lockin.start_capture()
+                else:
+                    self.lockin.start_transmission(sample_rate=lockin_rate)
             self.motor.move_velocity(velocity, velocity_unit)
-            # lockin_rate = max(int(sample_rate * 2), 20)
-            # self.lockin.start_transmission(sample_rate=lockin_rate)
-            # period = 1 / sample_rate
 
-            last_pos = None
-            stationary_start = None
+            history = None
             STATIONARY_TIMEOUT = 0.5
-            STATIONARY_TOLERANCE = self.encoder.ENC_RES * 1.5
+            STATIONARY_TOLERANCE = self.encoder.ENC_RES * 2.5 # displacement over the timeout; allows ±1 count of dither
+            margin = 0.02 * (self.motor.AXIS_MAX - self.motor.AXIS_MIN)
+            lo, hi = self.motor.AXIS_MIN + margin, self.motor.AXIS_MAX - margin
+            preview_stroke = 0
+            backlog = metrics.BACKLOG.labels(device='encoder')
+            block_latency = BLOCK_LATENCY.labels()
             
-            with open(self._save_filename, 'w') as f:
-                f.write("timestamp,position_mm\n") #,x,y,r,theta\n")
+            with writer:
                 while not self._stop_scan.is_set():
                     samples = self.encoder.get_all()
-                    if not samples:
+                    backlog.set(len(samples))
+                    if not len(samples):
                         time.sleep(poll_interval)
                         continue
 
-                    should_stop = False
-                    for t_enc, cnt in samples:
-                        pos = (cnt - self.OFFSET) * self.RESOLUTION
-                        pos_value = pos.value
-
-                        if pos_value >= self.motor.AXIS_MAX * 0.98: #if scan reaches the end, stop
-                            should_stop = True
-                        
-                        if last_pos is not None: #if encoder stops moving for a while, stop
-                            pos_diff = abs(pos_value - last_pos)
-                            if pos_diff <= STATIONARY_TOLERANCE:
-                                if stationary_start is None:
-                                    stationary_start = t_enc
-                                elif t_enc - stationary_start >= STATIONARY_TIMEOUT:
-                                    should_stop = True
+                    t0 = time.time()
+                    p0 = time.perf_counter()
+                    t_enc = samples['timestamp']
+                    positions = (samples['count'] - self.OFFSET) * self._scale
+                    # stop if scan reaches the end, or if encoder stops moving for a while
+                    stop_idx, history = find_stop_index(
+                        t_enc, positions, self.motor.AXIS_MAX * 0.98 if tracker is None else np.inf,
+                        STATIONARY_TOLERANCE, STATIONARY_TIMEOUT, history)
+                    if tracker and tracker.reversing:
+                        stop_idx = None # the mirror passes back through its earlier positions at a turnaround
+                    should_stop = stop_idx is not None
+                    n = len(positions) if stop_idx is None else stop_idx + 1
+                    if tracker:
+                        if tracker.update(t_enc[:n], positions[:n]):
+                            history = None # only compare with samples taken after the turnaround
+                        end = tracker.at_end(t_enc[:n], positions[:n], lo, hi)
+                        if not tracker.reversing and end.any():
+                            if strokes is not None and tracker.stroke + 1 >= strokes:
+                                should_stop = True
+                                n = int(np.argmax(end)) + 1
                             else:
-                                stationary_start = None
-                        last_pos = pos_value
-
-                        record = ({
-                            'timestamp': t_enc,
-                            'position_mm': pos_value,
-                            # 'x': x,
-                            # 'y': y,
-                            # 'r': r,
-                            # 'theta': theta
-                            })
-                        self.data_store.append(record)
-                        f.write(f"{t_enc},{pos_value}\n") #,{x},{y},{r},{theta}\n")
-
-                        if should_stop:
-                            break
-
-                    f.flush()
+                                tracker.reverse()
+                                self.motor.move_velocity(-tracker.direction * abs(velocity), velocity_unit)
+                    if sync:
+                        sync.push_encoder(t_enc[:n], positions[:n])
+                        lockin_new = self.lockin.get_new()
+                        metrics.BACKLOG.labels(device='lockin').set(len(lockin_new))
+                        sync.push_lockin(lockin_new)
+                        rows = sync.process()
+                    else:
+                        rows = {'timestamp': t_enc[:n], 'position_mm': positions[:n]}
+                    if tracker:
+                        rows = tracker.push(rows, flush=should_stop)
+                    writer.write(**rows)
+                    if preview is not None:
+                        if tracker and len(rows['stroke']) and rows['stroke'][-1] != preview_stroke:
+                            # start a new preview for each stroke
+                            first = np.searchsorted(rows['stroke'], rows['stroke'][-1])
+                            preview.push({name: v[:first] for name, v in rows.items()})
+                            preview_stroke = int(rows['stroke'][-1])
+                            preview.reset(direction=int(rows['direction'][-1]))
+                            rows = {name: v[first:] for name, v in rows.items()}
+                        preview.push(rows)
+                    dt = time.perf_counter() - p0
+                    block_latency.observe(dt)
+                    metrics.TRACER.add('scan.block', t0, dt, samples=len(samples), rows=len(rows['timestamp']))
                     if should_stop:
                         break
                     time.sleep(poll_interval)
+                if tracker:
+                    writer.write(**tracker.push({name: np.empty(0) for name in writer.columns if name not in STROKE_COLUMNS}, flush=True))
+        finally:
+            writer.close()
+            self.motor.stop()
+            self.encoder.stop_transmission()
+            if sync:
+                self.lockin.stop_transmission()
+
+    def _triggered_worker(self, velocity, velocity_unit, writer, poll_interval, trigger, preview=None):
+        try:
+            self.encoder.start_transmission()
+            self.motor.move_velocity(velocity, velocity_unit)
+
+            history = None
+            STATIONARY_TIMEOUT = 0.5
+            STATIONARY_TOLERANCE = self.encoder.ENC_RES * 2.5
+
+            with writer:
+                should_stop = False
+                backlog = metrics.BACKLOG.labels(device='encoder')
+                while not (should_stop or self._stop_scan.is_set()):
+                    samples = self.encoder.get_all()
+                    backlog.set(len(samples))
+                    if len(samples):
+                        t_enc = samples['timestamp']
+                        positions = (samples['count'] - self.OFFSET) * self._scale
+                        stop_idx, history = find_stop_index(
+                            t_enc, positions, self.motor.AXIS_MAX * 0.98, STATIONARY_TOLERANCE, STATIONARY_TIMEOUT,
+                            history)
+                        should_stop = stop_idx is not None
+                        n = len(positions) if stop_idx is None else stop_idx + 1
+                        trigger.update(t_enc[:n], positions[:n])
+                    wait = trigger.time_to_fire(time.time())
+                    if wait is not None and wait <= 0:
+                        t0 = time.time()
+                        vals = self.lockin.get_x_y_r_theta()
+                        trigger.record(t0, time.time(), *vals)
+                    out = trigger.resolve() if len(samples) else None
+                    if out is not None and len(out['timestamp']):
+                        writer.write(**out)
+                        if preview is not None:
+                            preview.push(out)
+                    if wait is None or wait > 0:
+                        time.sleep(poll_interval if wait is None else min(poll_interval, wait))
+                out = trigger.resolve(flush=True)
+                writer.write(**out)
+            stats = trigger.get_stats()
+            print(f"Triggered {stats['fired']} lock-in reads ({stats['missed']} grid points missed).")
         finally:
+            writer.close()
             self.motor.stop()
             self.encoder.stop_transmission()
-            # self.lockin.stop_transmission()
\ No newline at end of file
@@ -1,17 +1,19 @@
-from zaber_motion.ascii import Connection
 import astropy.units as u
-import serial
-import serial.tools.list_ports
+from .registry import get_registry
+from . import metrics
 
+COMMAND_LATENCY = metrics.histogram('cryo_fts_motor_command_seconds', 'Time for the motor to accept (or, when waiting, finish) a command', ['command'])
 
 class MotorController:
-    def __init__(self, length_units='mm', velocity_units='mm/s'):
+    def __init__(self, length_units='mm', velocity_units='mm/s', connection=None):
         """
         Instantiate connection to the Zaber mirror motor.
         
         Inputs:
             length_units (str): units to measure lengths in the system (default='mm')
             velcocity_units (str): units to measure velocities in the system (default='mm/s')
+            connection: open Zaber-like connection to use instead of searching the ports, e.g. a
+                simulate.FakeZaberConnection (default=None)
         """
         self.LENGTH_UNITS = length_units
         self.VELOCITY_UNITS = velocity_units
@@ -20,10 +22,12 @@ class MotorController:
         self.axis = None
         self.is_homed = False
 
-        ports = [p.device for p in serial.tools.list_ports.comports()]
+        if connection is None:
+            from zaber_motion.ascii import Connection # the Zaber SDK is only needed for hardware
+        ports = [getattr(connection, 'port', None)] if connection is not None else get_registry().ports('motor')
         for port in ports:
             try:
-                conn = Connection.open_serial_port(port, direct=True)
+                conn = connection if connection is not None else Connection.open_serial_port(port, direct=True)
                 dev_list = conn.detect_devices()
                 if not dev_list:
                     conn.close()
@@ -31,6 +35,8 @@ class MotorController:
                 self.port = conn
                 self.device = dev_list[0]
                 print(f'Established connection to {self.device} on {self.port}')
+                if connection is None:
+                    get_registry().remember('motor', port, str(self.device))
                 break
             except Exception:
                 continue
@@ -66,32 +72,44 @@ class MotorController:
         """
         self._check_axis_status()
         if not self.is_homed:
-            self.axis.home()
+            with COMMAND_LATENCY.labels(command='home').time(), metrics.TRACER.span('motor.home'):
+                self.axis.home()
             self.is_homed = True
 
-    def move_absolute(self, position, length_unit=None):
+    def move_absolute(self, position, length_unit=None, wait=True):
         """
         Move the motor to an absolute position along the track.
         
         Inputs:
             position (float): where to move the motor to
             length_unit (str): units associated with 'position' (if None, defaults to globally defined units)
+            wait (bool): block until the move finishes; otherwise return once the command is accepted (default=True)
         """
         self._check_axis_status()
         unit = length_unit or self.LENGTH_UNITS
-        self.axis.move_absolute(position, unit)
+        with COMMAND_LATENCY.labels(command='move_absolute').time(), metrics.TRACER.span('motor.move_absolute', wait=wait):
+            self.axis.move_absolute(position, unit, wait_until_idle=wait)
 
-    def move_relative(self, position, length_unit=None):
+    def move_relative(self, position, length_unit=None, wait=True):
         """
         Move the motor to position relative to the current motor position.
         
         Inputs:
             position (float): how far to move relative to current position
             length_unit (str): units associated with 'position' (if None, defaults to globally defined units)
+            wait (bool): block until the move finishes; otherwise return once the command is accepted (default=True)
         """
         self._check_axis_status()
         unit = length_unit or self.LENGTH_UNITS
-        self.axis.move_relative(position, unit)
+        with COMMAND_LATENCY.labels(command='move_relative').time(), metrics.TRACER.span('motor.move_relative', wait=wait):
+            self.axis.move_relative(position, unit, wait_until_idle=wait)
+
+    def wait_until_idle(self):
+        """
+        Block until the current move finishes.
+        """
+        self._check_axis_status()
+        self.axis.wait_until_idle()
 
     def _check_axis_status(self):
         """
@@ -112,7 +130,8 @@ class MotorController:
         """
         self._check_axis_status()
         unit = length_unit or self.LENGTH_UNITS
-        return self.axis.get_position(unit)
+        with COMMAND_LATENCY.labels(command='get_position').time():
+            return self.axis.get_position(unit)
 
     def scan_track(self, velocity=10.0, velocity_unit=None):
         """
@@ -137,11 +156,13 @@ class MotorController:
         self._check_axis_status()
         unit = velocity_unit or self.VELOCITY_UNITS
         assert velocity * u.Unit(unit) < (self.MAXSPEED * u.Unit(self.VELOCITY_UNITS)).to(unit), 'Velocity requested larger than motor maxspeed.'
-        self.axis.move_velocity(velocity, unit)
+        with COMMAND_LATENCY.labels(command='move_velocity').time(), metrics.TRACER.span('motor.move_velocity'):
+            self.axis.move_velocity(velocity, unit)
 
     def stop(self):
         """
         Stop current axis processes.
         """
         self._check_axis_status()
-        self.axis.stop()
\ No newline at end of file
+        with COMMAND_LATENCY.labels(command='stop').time(), metrics.TRACER.span('motor.stop'):
+            self.axis.stop()
\ No newline at end of file
@@ -0,0 +1,245 @@
+### Live spectrum preview for continuous scans ###
+
+import json
+import time
+import socket
+import numpy as np
+from .spectrum import C_CM_GHZ, get_window
+
+class RollingSpectrum:
+    def __init__(self, max_wavenumber=20.0, step_mm=None, nbins=512, update_every=256, mode='growing',
+                 window_len=2048, window=None, signal='r', direction=1, callback=None, address=None):
+        """
+        Incremental spectrum of an interferogram that is still being recorded. Incoming (OPD, signal) blocks are
+        bin-averaged onto a uniform OPD grid, and each new grid point updates the transform in O(nbins) instead
+        of re-transforming the record. Every `update_every` new grid points the spectrum is published to
+        `callback` and/or sent as a UDP datagram to `address` (see receive()).
+
+        Two estimators:
+            'growing': incremental DFT of the whole record so far at fixed wavenumber bins 0..max_wavenumber,
+                with the running mean removed; resolution improves as the scan proceeds
+            'sliding': sliding DFT over the last window_len grid points (refreshed exactly by an FFT once per
+                window to stop rounding drift); shows the spectrum of the most recent stretch of OPD
+
+        Inputs:
+            max_wavenumber (float): highest wavenumber [1/cm] of interest (default=20)
+            step_mm (float): OPD grid step [mm] (if None, half the Nyquist step for max_wavenumber)
+            nbins (int): wavenumber bins in 'growing' mode (default=512)
+            update_every (int): new grid points between published spectra (default=256)
+            mode (str): 'growing' or 'sliding' (default='growing')
+            window_len (int): grid points in the sliding window (default=2048)
+            window (str): apodization window for 'sliding' mode, see spectrum.WINDOWS (default=None)
+            signal (str): lock-in quantity to preview when fed SYNC_COLUMNS blocks (default='r')
+            direction (int): +1 if OPD increases during the scan, -1 if it decreases (default=1)
+            callback (callable): called with each published spectrum dict (default=None)
+            address (tuple): (host, port) to send each spectrum to over UDP (default=None)
+        """
+        if mode not in ('growing', 'sliding'):
+            raise ValueError("Mode must be 'growing' or 'sliding'.")
+        self.max_wavenumber = max_wavenumber
+        self.step = step_mm or 10 / (4 * max_wavenumber) # OPD [mm]; 1/cm -> 1/mm is /10
+        self.nbins = nbins
+        self.update_every = update_every
+        self.mode = mode
+        self.window_len = window_len
+        self.window = window
+        self.signal = signal
+        self.callback = callback
+        self.address = address
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if address else None
+        self.latest = None
+        self.reset(direction)
+
+    def reset(self, direction=None):
+        """Start a new record (optionally with a new scan direction)."""
+        if direction is not None:
+            self.direction = 1 if direction >= 0 else -1
+        self.nsamples = 0 # grid points so far
+        self.published = 0
+        self._since = 0
+        self._g0 = None # OPD of grid cell 0 (in the direction of travel)
+        self._cell = 0 # open (not yet complete) cell
+        self._sum = 0.0
+        self._count = 0
+        self._last = None # last completed grid value
+        self._opd_max = None
+        if self.mode == 'growing':
+            self.wavenumber = np.linspace(0, self.max_wavenumber, self.nbins)
+            self._k = self.wavenumber / 10 # 1/mm
+            self._X = np.zeros(self.nbins, dtype=complex) # sum of x e^{-2 pi i k opd}
+            self._S = np.zeros(self.nbins, dtype=complex) # sum of e^{-2 pi i k opd}, to remove the mean
+            self._xsum = 0.0
+        else:
+            L = self.window_len
+            self.wavenumber = 10 * np.fft.rfftfreq(L, self.step)
+            self._W = np.exp(2j * np.pi * np.arange(L // 2 + 1) / L)
+            self._win = np.zeros(L)
+            self._X = np.zeros(L // 2 + 1, dtype=complex)
+            self._since_refresh = 0
+
+    def push(self, opd, signal=None):
+        """
+        Add a block of samples.
+
+        Inputs:
+            opd (array-like or dict): OPD [mm] of each sample, or a Synchronizer.process() dict
+            signal (array-like): detector signal (ignored if `opd` is a dict)
+
+        Returns: the newly published spectrum, or None if none was due
+        """
+        if isinstance(opd, dict):
+            opd, signal = opd['opd_mm'], opd[self.signal]
+        grid = self._resample(np.asarray(opd, dtype=float), np.asarray(signal, dtype=float))
+        if not grid.size:
+            return None
+        if self.mode == 'growing':
+            self._update_growing(grid)
+        else:
+            self._update_sliding(grid)
+        self.nsamples += grid.size
+        self._since += grid.size
+        if self._since >= self.update_every:
+            self._since = 0
+            return self.publish()
+        return None
+
+    def _resample(self, opd, sig):
+        """Bin-average onto the uniform grid, emitting completed cells (empty cells are interpolated)."""
+        good = np.isfinite(opd) & np.isfinite(sig)
+        u, sig = self.direction * opd[good], sig[good]
+        if not u.size:
+            return np.empty(0)
+        if self._g0 is None:
+            self._g0 = u[0]
+        cells = np.floor((u - self._g0) / self.step).astype(np.int64)
+        keep = cells >= self._cell # anything behind the open cell arrived too late
+        cells, sig = cells[keep] - self._cell, sig[keep]
+        if not cells.size:
+            return np.empty(0)
+        top = int(cells.max())
+        sums = np.bincount(cells, weights=sig, minlength=top + 1)
+        counts = np.bincount(cells, minlength=top + 1).astype(float)
+        sums[0] += self._sum
+        counts[0] += self._count
+        self._sum, self._count = sums[top], counts[top]
+        self._cell += top
+        self._opd_max = self.direction * (self._g0 + self._cell * self.step)
+        if top == 0:
+            return np.empty(0)
+        sums, counts = sums[:top], counts[:top]
+        filled = counts > 0
+        values = np.divide(sums, counts, out=np.zeros(top), where=filled)
+        if not filled.all():
+            idx = np.arange(top)
+            known_i, known_v = idx[filled], values[filled]
+            if self._last is not None:
+                known_i, known_v = np.concatenate([[-1], known_i]), np.concatenate([[self._last], known_v])
+            if known_i.size:
+                values = np.interp(idx, known_i, known_v)
+        self._last = values[-1]
+        return values
+
+    def _grid_opd(self, start, n):
+        return self.direction * (self._g0 + (start + np.arange(n) + 0.5) * self.step)
+
+    def _update_growing(self, x):
+        opd = self._grid_opd(self.nsamples, x.size)
+        phase = np.exp(-2j * np.pi * np.outer(self._k, opd))
+        self._X += phase @ x
+        self._S += phase.sum(axis=1)
+        self._xsum += x.sum()
+
+    def _update_sliding(self, x):
+        L = self.window_len
+        m = x.size
+        if m >= L or self._since_refresh + m >= L:
+            self._win = np.concatenate([self._win, x])[-L:]
+            self._X = np.fft.rfft(self._win)
+            self._since_refresh = 0
+            return
+        old = self._win[:m]
+        d = x - old
+        k = np.arange(L // 2 + 1)
+        # X(n+m) = W^{km} X(n) + sum_j d_j W^{k(m-j+1)}
+        self._X = self._W ** m * self._X + np.exp(2j * np.pi * np.outer(k, m - np.arange(m)) / L) @ d
+        self._win = np.concatenate([self._win[m:], x])
+        self._since_refresh += m
+
+    def spectrum(self):
+        """
+        Current spectrum estimate.
+
+        Returns: dict with 'wavenumber' [1/cm], 'frequency' [GHz], 'power', 'nsamples', 'opd_max' [mm] and 'time'
+        """
+        if self.mode == 'growing':
+            n = max(self.nsamples, 1)
+            amp = (self._X - (self._xsum / n) * self._S) / n
+        elif self.window:
+            L = self.window_len
+            valid = self._win if self.nsamples >= L else self._win[L - self.nsamples:]
+            seg = (valid - valid.mean()) * get_window(self.window, valid.size)
+            amp = np.fft.rfft(seg, L) / max(valid.size, 1)
+        else:
+            amp = self._X / max(min(self.nsamples, self.window_len), 1)
+            amp[0] = 0 # DC
+        return {
+            'wavenumber': self.wavenumber,
+            'frequency': C_CM_GHZ * self.wavenumber,
+            'power': np.abs(amp) ** 2,
+            'nsamples': self.nsamples,
+            'opd_max': self._opd_max,
+            'time': time.time(),
+            }
+
+    def publish(self):
+        """Compute the spectrum and hand it to the callback and/or socket."""
+        spec = self.spectrum()
+        self.latest = spec
+        self.published += 1
+        if self.callback:
+            self.callback(spec)
+        if self._sock:
+            try:
+                self._sock.sendto(encode(spec), self.address)
+            except OSError as e:
+                print(f'Preview send failed: {e}')
+        return spec
+
+    def close(self):
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+def encode(spec):
+    """Pack a spectrum into one datagram: a JSON header line followed by float32 power."""
+    w = spec['wavenumber']
+    header = {'nsamples': int(spec['nsamples']), 'opd_max': spec['opd_max'], 'time': spec['time'],
+              'wavenumber0': float(w[0]), 'dwavenumber': float(w[1] - w[0]) if w.size > 1 else 0.0, 'nbins': int(w.size)}
+    return json.dumps(header).encode() + b'\n' + np.asarray(spec['power'], dtype='<f4').tobytes()
+
+def decode(data):
+    """Inverse of encode()."""
+    head, _, body = data.partition(b'\n')
+    spec = json.loads(head)
+    spec['wavenumber'] = spec['wavenumber0'] + spec['dwavenumber'] * np.arange(spec['nbins'])
+    spec['frequency'] = C_CM_GHZ * spec['wavenumber']
+    spec['power'] = np.frombuffer(body, dtype='<f4')
+    return spec
+
+def receive(port, host='127.0.0.1', timeout=None):
+    """
+    Yield spectra published by a RollingSpectrum with address=(host, port), e.g. from a plotting process.
+    Stops when no datagram arrives within `timeout` seconds (if None, waits forever).
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((host, port))
+    sock.settimeout(timeout)
+    try:
+        while True:
+            try:
+                data, _ = sock.recvfrom(1 << 16)
+            except socket.timeout:
+                return
+            yield decode(data)
+    finally:
+        sock.close()
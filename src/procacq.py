@@ -0,0 +1,196 @@
+### Device readers in separate processes, publishing into shared-memory rings ###
+
+import signal
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from .ringbuffer import RingBuffer
+from . import metrics
+from .encoder import EncoderController, ENCODER_DTYPE
+from .lockin import LockinController, LOCKIN_DTYPE
+
+DEVICES = { # kind -> (controller class, record dtype, attributes mirrored into the parent after every call)
+    'encoder': (EncoderController, ENCODER_DTYPE,
+                ['device', 'port', 'serial_number', 'transmitting', 'current_position', 'ENC_RES', 'TRANMISSION_RATE',
+                 'POS_LEN']),
+    'lockin': (LockinController, LOCKIN_DTYPE,
+               ['device', 'idn', 'port', 'gpib_address', 'transmitting', 'capturing', 'capture_rate', 'capture_overflows']),
+    }
+
+def _state(kind, device):
+    return {name: getattr(device, name, None) for name in DEVICES[kind][2]}
+
+def _serve(kind, kwargs, shm_name, capacity, conn):
+    """
+    Reader process: construct the controller on a ring in the shared memory block, then run commands
+    (method name, args, kwargs) from the pipe until 'exit' or the parent goes away; '__metrics__' returns
+    this process's metric states. Every reply is (status, result or error message, mirrored attributes).
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl-C is for the parent, which stops the reader cleanly
+    cls, dtype, _ = DEVICES[kind]
+    shm = shared_memory.SharedMemory(name=shm_name)
+    ring = RingBuffer(capacity, dtype, buffer=shm.buf)
+    device = None
+    try:
+        device = cls(data_buffer=ring, **kwargs)
+        conn.send(('ok', None, _state(kind, device)))
+        while True:
+            try:
+                name, args, kw = conn.recv()
+            except EOFError:
+                break
+            if name == 'exit':
+                break
+            try:
+                if name == '__metrics__':
+                    result = metrics.REGISTRY.state()
+                else:
+                    result = getattr(device, name)(*args, **kw)
+                conn.send(('ok', result, _state(kind, device)))
+            except Exception as e:
+                conn.send(('error', f'{type(e).__name__}: {e}', _state(kind, device)))
+    except Exception as e:
+        conn.send(('error', f'{type(e).__name__}: {e}', {}))
+    finally:
+        if device is not None:
+            try:
+                device.stop_transmission()
+            except Exception:
+                pass
+        del ring
+        shm.close()
+        conn.close()
+
+class ProcessReader:
+    KIND = None
+
+    def __init__(self, buffer_size=1 << 18, context=None, start_timeout=30.0, **kwargs):
+        """
+        A device controller running in its own process, so that its reader loop never waits on this process's
+        GIL. The reader writes into a RingBuffer in shared memory; get_all()/get_new()/get_latest() read that
+        ring here without copies or messages. Any other method or attribute is forwarded over a pipe to the
+        controller in the reader process, so this can be used in place of the controller. The reader's metrics
+        are included in this process's metrics.REGISTRY exposition.
+
+        Inputs:
+            buffer_size (int): capacity [records] of the shared ring (default=1 << 18)
+            context (str): multiprocessing start method (if None, 'fork' where available, else 'spawn'). 'fork'
+                lets the reader inherit simulated transports and does not re-import the calling script, but should
+                only be used before the process starts threads; 'spawn' needs an `if __name__ == '__main__'` guard
+                in scripts
+            start_timeout (float): time [s] to wait for the controller to connect (default=30.0)
+            **kwargs: passed to the controller constructor in the reader process (must be picklable with 'spawn')
+        """
+        _, dtype, _ = DEVICES[self.KIND]
+        if context is None:
+            context = 'fork' if 'fork' in mp.get_all_start_methods() else 'spawn'
+        ctx = mp.get_context(context)
+        self._shm = shared_memory.SharedMemory(create=True, size=RingBuffer.nbytes(buffer_size, dtype))
+        self.data_buffer = RingBuffer(buffer_size, dtype, buffer=self._shm.buf)
+        self.data_buffer.clear()
+        self._read_cursor = 0
+        self._lock = threading.Lock()
+        self._conn, child = ctx.Pipe()
+        self._process = ctx.Process(target=_serve, args=(self.KIND, kwargs, self._shm.name, buffer_size, child),
+                                    name=f'{self.KIND}-reader', daemon=True)
+        self._process.start()
+        child.close()
+        try:
+            if not self._conn.poll(start_timeout):
+                raise RuntimeError(f'{self.KIND} reader did not start within {start_timeout} s.')
+            self._reply()
+        except RuntimeError:
+            self._release()
+            raise
+        metrics.REGISTRY.add_collector(self.metrics_state)
+
+    def _reply(self):
+        try:
+            status, result, state = self._conn.recv()
+        except EOFError:
+            raise RuntimeError(f'{self.KIND} reader process exited.')
+        self.__dict__.update(state)
+        if status != 'ok':
+            raise RuntimeError(f'{self.KIND} reader: {result}')
+        return result
+
+    def call(self, name, *args, **kwargs):
+        """Run a controller method in the reader process and return its result."""
+        with self._lock:
+            if not self._process.is_alive():
+                raise RuntimeError(f'{self.KIND} reader process is not running.')
+            self._conn.send((name, args, kwargs))
+            return self._reply()
+
+    def metrics_state(self):
+        """Metric states (see metrics.Registry.state) of the reader process."""
+        return self.call('__metrics__')
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+
+    def start_transmission(self, *args, **kwargs):
+        self.call('start_transmission', *args, **kwargs) # the reader clears the shared ring first
+        self.data_buffer.overflows = 0
+        self._read_cursor = 0
+
+    def close(self):
+        """Close the device, stop the reader process and release the shared memory."""
+        metrics.REGISTRY.remove_collector(self.metrics_state)
+        if self._process.is_alive():
+            try:
+                self.call('close')
+            except RuntimeError as e:
+                print(f'{e}')
+            with self._lock:
+                self._conn.send(('exit', (), {}))
+        self._release()
+
+    def _release(self):
+        self._process.join(timeout=5.0)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._conn.close()
+        self.data_buffer = None
+        try:
+            self._shm.close()
+        except BufferError: # views of the ring are still held; the mapping goes when they do
+            pass
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+class ProcessEncoder(ProcessReader):
+    """EncoderController in a reader process (see ProcessReader)."""
+    KIND = 'encoder'
+
+    get_latest = EncoderController.get_latest
+    get_all = EncoderController.get_all
+
+    def get_count(self):
+        if self.transmitting:
+            latest = self.data_buffer.latest()
+            return None if latest is None else int(latest['count'])
+        return self.call('get_count')
+
+    def get_stats(self):
+        stats = self.call('get_stats')
+        stats['overflows'] = self.data_buffer.overflows # counted by the consumer, i.e. here
+        return stats
+
+class ProcessLockin(ProcessReader):
+    """LockinController in a reader process (see ProcessReader)."""
+    KIND = 'lockin'
+
+    get_latest = LockinController.get_latest
+    get_all = LockinController.get_all
+    get_new = LockinController.get_new
+    get_closest_time = LockinController.get_closest_time
+
+    def start_capture(self, *args, **kwargs):
+        self.call('start_capture', *args, **kwargs)
+        self.data_buffer.overflows = 0
+        self._read_cursor = 0
@@ -0,0 +1,187 @@
+### Shared serial-port discovery for the instrument controllers ###
+
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# CRYO_FTS_CONFIG_DIR moves the device cache and offset calibration, e.g. to a scratch directory for simulations
+CONFIG_DIR = os.environ.get('CRYO_FTS_CONFIG_DIR') or os.path.join(os.path.expanduser('~'), '.cryo_fts')
+CACHE_FILE = os.path.join(CONFIG_DIR, 'devices.json')
+
+def comports():
+    """Serial ports present (pyserial is imported on first use, so simulated setups do not need it)."""
+    import serial.tools.list_ports
+    return serial.tools.list_ports.comports()
+
+def probe_encoder(port, timeout=0.2):
+    """Identify an RLS E201 interface on `port` (replies to 'v' with its model)."""
+    import serial
+    with serial.Serial(port, baudrate=9600, timeout=timeout) as conn:
+        conn.reset_input_buffer()
+        conn.write(b'v')
+        rsp = conn.readline().decode('utf-8', errors='ignore').strip()
+    return rsp or None
+
+def probe_prologix(port, timeout=0.2):
+    """Identify a Prologix GPIB-USB controller on `port` (replies to ++ver)."""
+    import serial
+    with serial.Serial(port, baudrate=115200, timeout=timeout) as conn:
+        conn.reset_input_buffer()
+        conn.write(b'++ver\r\n')
+        rsp = conn.readline().decode('utf-8', errors='ignore').strip()
+    return rsp if 'Prologix' in rsp else None
+
+def probe_zaber(port):
+    """Identify a Zaber device chain on `port`."""
+    from zaber_motion.ascii import Connection
+    conn = Connection.open_serial_port(port, direct=True)
+    try:
+        devices = conn.detect_devices()
+        return str(devices[0]) if devices else None
+    finally:
+        conn.close()
+
+PROBES = {
+    'encoder': probe_encoder,
+    'lockin': probe_prologix,
+    'motor': probe_zaber,
+    }
+
+class DeviceRegistry:
+    def __init__(self, cache_path=CACHE_FILE, probes=None, max_workers=8):
+        """
+        Port -> instrument mapping shared by the controllers. Devices are remembered by USB VID/PID/serial number
+        in a local cache, so the next start tries the cached port first (following the device if its port name
+        changed) and only probes every port when that fails. Full probes run all ports concurrently, once per
+        process, and identify every instrument at the same time.
+
+        Inputs:
+            cache_path (str): JSON cache file (default=~/.cryo_fts/devices.json; None to disable the cache)
+            probes (dict): kind -> probe(port) returning an identity string or None (default=PROBES)
+            max_workers (int): ports probed at once (default=8)
+        """
+        self.cache_path = cache_path
+        self.probes = dict(PROBES if probes is None else probes)
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._found = None # result of the full probe, once run
+        self._in_use = set() # ports held by connected controllers; never probed
+        self.cache = self._load()
+
+    def _load(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp = self.cache_path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.cache, f, indent=2)
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            print(f'Could not save device cache: {e}')
+
+    @staticmethod
+    def _identity(info):
+        return {'vid': info.vid, 'pid': info.pid, 'serial_number': info.serial_number}
+
+    def cached_port(self, kind):
+        """
+        Port the cached device of this kind is attached to now, matched by VID/PID/serial number when the
+        device reported them, otherwise by port name. None if it is not cached or not plugged in.
+        """
+        entry = self.cache.get(kind)
+        if not entry:
+            return None
+        ports = comports()
+        if entry.get('serial_number'):
+            for p in ports:
+                if self._identity(p) == {k: entry.get(k) for k in ('vid', 'pid', 'serial_number')}:
+                    return p.device
+            return None
+        return entry['port'] if any(p.device == entry['port'] for p in ports) else None
+
+    def ports(self, kind):
+        """
+        Candidate ports for a device, best first: the cached port, then the port found by a full probe.
+        Stop iterating once connected; the full probe only runs if the cached port is missing or rejected.
+        """
+        cached = self.cached_port(kind)
+        if cached:
+            yield cached
+        found = self.probe_all().get(kind)
+        if found and found != cached:
+            yield found
+
+    def _probe_port(self, port, kinds):
+        for kind in kinds:
+            try:
+                device = self.probes[kind](port)
+            except Exception:
+                device = None
+            if device:
+                return kind, device
+        return None
+
+    def probe_all(self):
+        """
+        Probe every port concurrently for every known kind of device (once per process; later calls return
+        the first result). Found devices are cached.
+
+        Returns: dict of kind -> port
+        """
+        with self._lock:
+            if self._found is not None:
+                return self._found
+            infos = [p for p in comports() if p.device not in self._in_use]
+            t0 = time.time()
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(infos)))) as pool:
+                results = list(pool.map(lambda p: self._probe_port(p.device, list(self.probes)), infos))
+            self._found = {}
+            for info, res in zip(infos, results):
+                if res and res[0] not in self._found:
+                    self._found[res[0]] = info.device
+                    self._store(res[0], info, res[1])
+            self._save()
+            print(f'Probed {len(infos)} ports in {time.time() - t0:.2f} s: {self._found}')
+            return self._found
+
+    def _store(self, kind, info, device):
+        self.cache[kind] = {'port': info.device, **self._identity(info), 'device': device, 'time': time.time()}
+
+    def remember(self, kind, port, device):
+        """Record that `device` answered as `kind` on `port` and is now connected there."""
+        self._in_use.add(port)
+        info = next((p for p in comports() if p.device == port), None)
+        entry = self.cache.get(kind, {})
+        if info is None or (entry.get('port') == port and entry.get('device') == device):
+            return
+        self._store(kind, info, device)
+        self._save()
+
+    def forget(self, kind=None):
+        """Drop one kind (or everything) from the cache."""
+        if kind is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(kind, None)
+        self._save()
+
+_registry = None
+
+def get_registry():
+    """The process-wide registry shared by all controllers."""
+    global _registry
+    if _registry is None:
+        _registry = DeviceRegistry()
+    return _registry
@@ -0,0 +1,133 @@
+import numpy as np
+
+HEADER_BYTES = 64 # head counter (int64) at the start of an external buffer, padded to a cache line
+
+class RingBuffer:
+    def __init__(self, capacity, dtype, buffer=None):
+        """
+        Lock-free single-producer/single-consumer ring buffer backed by a preallocated structured NumPy array.
+
+        The storage is mirrored (every record is written twice, `capacity` apart) so that any window of up to
+        `capacity` records is contiguous and can be returned as a view without copying. The producer only ever
+        advances `head` after the records are in place, so a consumer on another thread never sees partial writes.
+        Views are valid until the producer wraps around onto them; copy them if they need to be kept.
+
+        Inputs:
+            capacity (int): number of records held before the oldest are overwritten
+            dtype (numpy.dtype or list): structured dtype of a record, e.g. [('timestamp', 'f8'), ('count', 'i8')]
+            buffer (buffer): memory of at least RingBuffer.nbytes(capacity, dtype) bytes to hold the head counter
+                and records, e.g. a multiprocessing.shared_memory.SharedMemory().buf so that a producer and a
+                consumer in different processes share one ring (if None, private memory is allocated)
+        """
+        self.capacity = int(capacity)
+        if self.capacity <= 0:
+            raise ValueError('Capacity must be positive.')
+        self.dtype = np.dtype(dtype)
+        if buffer is None:
+            self._meta = np.zeros(1, dtype=np.int64)
+            self._data = np.zeros(2 * self.capacity, dtype=self.dtype)
+        else:
+            if len(buffer) < self.nbytes(self.capacity, self.dtype):
+                raise ValueError('Buffer too small for the ring.')
+            self._meta = np.ndarray(1, dtype=np.int64, buffer=buffer)
+            self._data = np.ndarray(2 * self.capacity, dtype=self.dtype, buffer=buffer, offset=HEADER_BYTES)
+        self.overflows = 0 # records overwritten before the consumer read them
+
+    @staticmethod
+    def nbytes(capacity, dtype):
+        """Size [bytes] of the external buffer needed for a ring of `capacity` records."""
+        return HEADER_BYTES + 2 * int(capacity) * np.dtype(dtype).itemsize
+
+    @property
+    def head(self):
+        """Total number of records ever written."""
+        return int(self._meta[0])
+
+    @head.setter
+    def head(self, value):
+        self._meta[0] = value
+
+    def __len__(self):
+        return min(self.head, self.capacity)
+
+    def clear(self):
+        """
+        Forget all records and reset the counters.
+        """
+        self.head = 0
+        self.overflows = 0
+
+    def write(self, block=None, **columns):
+        """
+        Append a block of records (producer side).
+
+        Inputs:
+            block (numpy.ndarray): structured array with this buffer's dtype
+            **columns (array-like): alternatively, one array per field name
+
+        Returns: number of records written
+        """
+        if block is None:
+            n = len(next(iter(columns.values())))
+        else:
+            n = len(block)
+        if n == 0:
+            return 0
+        cap = self.capacity
+        skip = max(n - cap, 0) # block larger than the buffer; only the newest records survive
+        start = (self.head + skip) % cap
+        first = min(n - skip, cap - start)
+        rest = n - skip - first
+        data = self._data
+        if block is not None:
+            items = [(None, block[skip:])]
+        else:
+            items = [(name, np.asarray(col)[skip:]) for name, col in columns.items()]
+        for name, vals in items:
+            dst = data if name is None else data[name]
+            dst[start:start + first] = vals[:first]
+            dst[start + cap:start + cap + first] = vals[:first]
+            if rest:
+                dst[:rest] = vals[first:]
+                dst[cap:cap + rest] = vals[first:]
+        self.head += n
+        return n
+
+    def read_since(self, cursor):
+        """
+        Get all records written since `cursor` (consumer side).
+
+        Inputs:
+            cursor (int): value of `head` returned by the previous call (0 to read from the start)
+
+        Returns: (view, cursor) where view is a structured array view of the new records and cursor is the
+        value to pass to the next call. Records lost to overflow are added to `overflows`.
+        """
+        head = self.head
+        lost = head - self.capacity - cursor
+        if lost > 0:
+            self.overflows += lost
+            cursor += lost
+        start = cursor % self.capacity
+        return self._data[start:start + head - cursor], head
+
+    def latest(self):
+        """
+        Get the most recently written record (None if empty).
+        """
+        head = self.head
+        if head == 0:
+            return None
+        return self._data[(head - 1) % self.capacity]
+
+    def snapshot(self, n=None):
+        """
+        Get a view of the most recent records.
+
+        Inputs:
+            n (int): number of records (if None, defaults to everything held in the buffer)
+        """
+        head = self.head
+        count = min(head, self.capacity) if n is None else min(n, head, self.capacity)
+        start = (head - count) % self.capacity
+        return self._data[start:start + count]
@@ -0,0 +1,779 @@
+### Simulated instruments for running scans without hardware ###
+
+import mmap
+import time
+import asyncio
+import threading
+import multiprocessing as mp
+from datetime import datetime, timezone
+from functools import lru_cache
+import numpy as np
+import astropy.units as u
+from .calibration import OffsetCalibration
+
+C_CM_GHZ = 29.9792458 # speed of light [GHz cm]
+ENC_RES_MM = 0.000244140625 # encoder resolution [mm/count]
+FWHM_TO_ENVELOPE = np.pi / (2 * np.sqrt(np.log(2))) # Gaussian line FWHM [1/cm] -> interferogram envelope
+
+@lru_cache(maxsize=None)
+def _factor(unit, base):
+    return float(u.Unit(unit).to(base))
+
+def _to_base(value, unit, base):
+    return value if unit is None else value * _factor(str(unit), base)
+
+def _from_base(value, unit, base):
+    return value if unit is None else value / _factor(str(unit), base)
+
+class Source:
+    def __init__(self, wavenumber=(5.0,), amplitude=(1.0,), width=(3.0,), dc=None, noise=0.0, seed=None):
+        """
+        Source spectrum made of Gaussian bands, seen through the interferometer as an interferogram.
+
+        Inputs:
+            wavenumber (array-like): band centres [1/cm]
+            amplitude (array-like): band amplitudes (the interferogram at ZPD is their sum above the DC level)
+            width (array-like): band FWHMs [1/cm]; 0 for a monochromatic line (default=(3.0,))
+            dc (float): constant detector level (if None, defaults to the summed amplitude)
+            noise (float): rms of white noise added to every sample (default=0.0)
+            seed (int): random seed for the noise (default=None)
+        """
+        self.wavenumber, self.amplitude, self.width = np.broadcast_arrays(
+            np.atleast_1d(np.asarray(wavenumber, dtype=float)),
+            np.atleast_1d(np.asarray(amplitude, dtype=float)),
+            np.atleast_1d(np.asarray(width, dtype=float)))
+        self.dc = float(self.amplitude.sum()) if dc is None else dc
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_spectrum(cls, wavenumber, power, **kwargs):
+        """Build a source from a sampled spectrum, one narrow band per bin."""
+        wavenumber = np.asarray(wavenumber, dtype=float)
+        dk = np.gradient(wavenumber) if wavenumber.size > 1 else np.zeros(1)
+        return cls(wavenumber, np.asarray(power, dtype=float) * np.abs(dk), np.abs(dk), **kwargs)
+
+    def interferogram(self, opd_mm, block=65536):
+        """
+        Evaluate the interferogram at optical path differences [mm].
+        """
+        opd = np.atleast_1d(np.asarray(opd_mm, dtype=float))
+        out = np.full(opd.shape, self.dc)
+        k = self.wavenumber / 10 # 1/mm
+        env = FWHM_TO_ENVELOPE * self.width / 10
+        for i in range(0, opd.size, block):
+            x = opd[i:i + block, None]
+            out[i:i + block] += (self.amplitude * np.cos(2 * np.pi * k * x) * np.exp(-(env * x) ** 2)).sum(axis=1)
+        if self.noise:
+            out += self.rng.normal(0, self.noise, out.shape)
+        return out
+
+class Stage:
+    MAX_SEGMENTS = 64 # move profiles kept; older ones are only needed to evaluate times long past
+
+    def __init__(self, limit_min=0.0, limit_max=300.0, max_speed=50.0, accel=200.0, position=0.0, homed=False):
+        """
+        Linear stage that moves with trapezoidal velocity profiles. Shared by the simulated motor, which commands
+        it, and the simulated encoder and detectors, which sample it. Stops are immediate. The move profiles are
+        kept in anonymous shared memory, so readers forked from this process (see procacq) follow moves commanded
+        here.
+
+        Inputs:
+            limit_min, limit_max (float): travel limits [mm] (default=0, 300)
+            max_speed (float): top speed [mm/s] (default=50)
+            accel (float): acceleration [mm/s^2] (default=200)
+            position (float): starting position [mm] (default=0)
+            homed (bool): whether the axis starts homed (default=False)
+        """
+        self.limit_min = limit_min
+        self.limit_max = limit_max
+        self.max_speed = max_speed
+        self.accel = accel
+        self.homed = homed
+        self._lock = mp.Lock()
+        self._shared = mmap.mmap(-1, 8 * (1 + 5 * self.MAX_SEGMENTS))
+        table = np.frombuffer(self._shared, dtype=float)
+        self._count = table[:1] # segments in use
+        self._segments = table[1:].reshape(self.MAX_SEGMENTS, 5) # rows of (t0, x0, x1, speed, accel), oldest first
+        self._segments[0] = (-np.inf, position, position, max_speed, accel)
+        self._count[0] = 1
+
+    @staticmethod
+    def _profile(seg):
+        t0, x0, x1, v, a = seg
+        d = abs(x1 - x0)
+        ta = v / a
+        if a * ta * ta >= d: # never reaches top speed
+            ta = np.sqrt(d / a)
+            v = a * ta
+        tc = (d - a * ta * ta) / v if v > 0 else 0.0
+        return d, ta, tc, 2 * ta + tc, v
+
+    def _evaluate(self, seg, t):
+        t0, x0, x1, _, a = seg
+        if x1 == x0:
+            return np.full(np.shape(t), float(x0))
+        d, ta, tc, T, v = self._profile(seg)
+        dt = np.clip(t - t0, 0, T)
+        dist = np.where(dt < ta, 0.5 * a * dt**2,
+                        np.where(dt < ta + tc, 0.5 * a * ta**2 + v * (dt - ta), d - 0.5 * a * (T - dt)**2))
+        return x0 + np.sign(x1 - x0) * dist
+
+    def position(self, t=None):
+        """
+        Position [mm] at time(s) t (if None, now). Arrays are evaluated in bulk.
+        """
+        scalar = t is None or np.ndim(t) == 0
+        t = np.atleast_1d(time.time() if t is None else np.asarray(t, dtype=float))
+        with self._lock:
+            segments = self._segments[:int(self._count[0])].copy()
+        starts = segments[:, 0]
+        which = np.searchsorted(starts, t, side='right') - 1
+        out = np.empty(t.shape)
+        for i in np.unique(which):
+            sel = which == i
+            out[sel] = self._evaluate(segments[max(i, 0)], t[sel])
+        return float(out[0]) if scalar else out
+
+    def end_time(self):
+        """Time at which the current move finishes."""
+        with self._lock:
+            seg = tuple(self._segments[int(self._count[0]) - 1])
+        return seg[0] + self._profile(seg)[3] if seg[1] != seg[2] else seg[0]
+
+    def is_busy(self):
+        return time.time() < self.end_time()
+
+    def _command(self, target, speed):
+        now = time.time()
+        x0 = self.position(now)
+        target = float(np.clip(target, self.limit_min, self.limit_max))
+        speed = min(abs(speed or self.max_speed), self.max_speed)
+        with self._lock:
+            n = int(self._count[0])
+            if n == self.MAX_SEGMENTS:
+                self._segments[:-1] = self._segments[1:].copy()
+                n -= 1
+            self._segments[n] = (now, x0, target, speed, self.accel)
+            self._count[0] = n + 1
+
+    def move_to(self, position, speed=None):
+        """Start a move to an absolute position [mm] at up to `speed` [mm/s]."""
+        self._command(position, speed)
+
+    def move_velocity(self, velocity):
+        """Move at `velocity` [mm/s] until the travel limit."""
+        self._command(self.limit_max if velocity >= 0 else self.limit_min, velocity)
+
+    def stop(self):
+        """Stop where the stage is now."""
+        self._command(self.position(), None)
+
+    def wait_until_idle(self):
+        remaining = self.end_time() - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+
+class _Transport:
+    """Base for serial-like fakes: a response buffer with pyserial's read/readline/in_waiting semantics."""
+    def __init__(self, port, timeout=1.0):
+        self.port = port
+        self.timeout = timeout
+        self.is_open = True
+        self._out = bytearray()
+        self._lock = threading.RLock()
+
+    def _generate(self, now):
+        pass
+
+    def _ready_in(self, nbytes):
+        return None # time [s] until nbytes more are available, None if they never will be
+
+    @property
+    def in_waiting(self):
+        with self._lock:
+            self._generate(time.time())
+            return len(self._out)
+
+    def read(self, size=1):
+        deadline = time.time() + (self.timeout or 0)
+        while True:
+            with self._lock:
+                self._generate(time.time())
+                if len(self._out) >= size:
+                    break
+                wait = self._ready_in(size - len(self._out))
+            remaining = deadline - time.time()
+            if wait is None or remaining <= 0:
+                break
+            time.sleep(min(max(wait, 1e-4), remaining))
+        with self._lock:
+            data = bytes(self._out[:size])
+            del self._out[:size]
+        return data
+
+    def readline(self):
+        deadline = time.time() + (self.timeout or 0)
+        while True:
+            with self._lock:
+                self._generate(time.time())
+                j = self._out.find(b'\n')
+                if j >= 0:
+                    data = bytes(self._out[:j + 1])
+                    del self._out[:j + 1]
+                    return data
+            if time.time() >= deadline:
+                with self._lock:
+                    data = bytes(self._out)
+                    self._out.clear()
+                return data
+            time.sleep(1e-3)
+
+    def readall(self):
+        with self._lock:
+            self._generate(time.time())
+            data = bytes(self._out)
+            self._out.clear()
+        return data
+
+    def reset_input_buffer(self):
+        with self._lock:
+            self._out.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+class FakeE201(_Transport):
+    def __init__(self, stage, rate=10000, corruption=0.0, zero=10_000_000, noise_counts=0.0, buffer_bytes=1 << 22,
+                 seed=None, port='SIM-E201'):
+        """
+        Simulated RLS E201-9S encoder interface. Answers 'v', '?' and 'B26' and, after '1', streams 9-byte
+        count records of the stage position at `rate` records/s until '0'.
+
+        Inputs:
+            stage (Stage): stage being measured
+            rate (float): records per second in continuous transmission (default=10000)
+            corruption (float): probability that a record has a byte dropped or garbled (default=0.0)
+            zero (int): count reported at 0 mm (default=10000000)
+            noise_counts (float): rms position noise [counts] (default=0.0)
+            buffer_bytes (int): size of the host's receive buffer; older bytes are lost beyond it (default=4 MiB)
+            seed (int): random seed for noise and corruption (default=None)
+            port (str): reported port name (default='SIM-E201')
+        """
+        super().__init__(port, timeout=0.1)
+        self.serial_number = 'SIM-E201-0001'
+        self.stage = stage
+        self.rate = rate
+        self.corruption = corruption
+        self.zero = zero
+        self.noise_counts = noise_counts
+        self.buffer_bytes = buffer_bytes
+        self.rng = np.random.default_rng(seed)
+        self.streaming = False
+        self.records_sent = 0
+        self.records_corrupted = 0
+        self.bytes_overrun = 0 # bytes lost to receive-buffer overflow
+        self._t_next = None
+        self._powers = 10 ** np.arange(7, -1, -1, dtype=np.int64)
+
+    def counts(self, t=None):
+        """Encoder count(s) at time(s) t."""
+        c = self.stage.position(t) / ENC_RES_MM
+        if self.noise_counts:
+            c = c + self.rng.normal(0, self.noise_counts, np.shape(c))
+        return np.rint(c).astype(np.int64) + self.zero
+
+    def records(self, counts):
+        """Encode counts as 8 ASCII digits + CR, corrupting a fraction of them."""
+        counts = np.clip(np.atleast_1d(counts), 0, 10**8 - 1)
+        rec = np.empty((counts.size, 9), dtype=np.uint8)
+        rec[:, :8] = (counts[:, None] // self._powers) % 10 + 48
+        rec[:, 8] = 13
+        keep = None
+        if self.corruption:
+            bad = np.flatnonzero(self.rng.random(counts.size) < self.corruption)
+            self.records_corrupted += bad.size
+            pos = self.rng.integers(0, 9, bad.size)
+            garble = self.rng.random(bad.size) < 0.5
+            rec[bad[garble], pos[garble]] = ord('x')
+            keep = np.ones(rec.shape, dtype=bool)
+            keep[bad[~garble], pos[~garble]] = False
+        return rec[keep] if keep is not None else rec.ravel()
+
+    def _generate(self, now):
+        if not self.streaming or now < self._t_next:
+            return
+        n = int((now - self._t_next) * self.rate) + 1
+        t = self._t_next + np.arange(n) / self.rate
+        self._t_next += n / self.rate
+        self._out += self.records(self.counts(t)).tobytes()
+        self.records_sent += n
+        excess = len(self._out) - self.buffer_bytes
+        if excess > 0:
+            del self._out[:excess]
+            self.bytes_overrun += excess
+
+    def _ready_in(self, nbytes):
+        if not self.streaming:
+            return None
+        return max(self._t_next - time.time(), 0) + (nbytes // 9) / self.rate
+
+    def write(self, data):
+        now = time.time()
+        with self._lock:
+            self._generate(now)
+            if data.startswith(b'B'):
+                self._out += data.strip() + b'\r\n'
+                return len(data)
+            for c in data.decode('ascii', errors='ignore'):
+                if c == 'v':
+                    self._out += b'E201-9S (simulated)\r\n'
+                elif c == '?':
+                    self._out += b'%08d\r\n' % int(self.counts(now))
+                elif c == '1' and not self.streaming:
+                    self.streaming = True
+                    self._t_next = now
+                elif c == '0':
+                    self.streaming = False
+        return len(data)
+
+class FakeSR865A(_Transport):
+    def __init__(self, stage, source=None, opd_factor=2.0, noise=0.0, capture_rate_max=78125.0, seed=None,
+                 port='SIM-PROLOGIX'):
+        """
+        Simulated Prologix GPIB-USB controller with an SR865A lock-in behind it, detecting `source` through the
+        interferometer formed by `stage`. Answers ++ver, *IDN?, SNAPD?, the FREQ/SLVL/OFLT/SCAL settings and
+        the CAPTURE* commands, with the capture buffer filled at the capture rate from CAPTURESTART on.
+
+        Inputs:
+            stage (Stage): moving mirror stage
+            source (Source): source spectrum (if None, defaults to Source())
+            opd_factor (float): optical path difference per unit mirror displacement (default=2.0)
+            noise (float): rms noise [V] on x and y (default=0.0)
+            capture_rate_max (float): reply to CAPTURERATEMAX? [Hz] (default=78125)
+            seed (int): random seed for the noise (default=None)
+            port (str): reported port name (default='SIM-PROLOGIX')
+        """
+        super().__init__(port, timeout=1.0)
+        self.stage = stage
+        self.source = source or Source()
+        self.opd_factor = opd_factor
+        self.noise = noise
+        self.capture_rate_max = capture_rate_max
+        self.rng = np.random.default_rng(seed)
+        self.settings = {'FREQ': 1000.0, 'SLVL': 1.0, 'OFLT': 9.0, 'SCAL': 0.0}
+        self.capture_len_kb = 256
+        self.capture_cfg = 3
+        self.capture_divider = 0
+        self._capture_t0 = None
+        self._capture_stop = None
+
+    def signal(self, t):
+        """(x, y, r, theta) at time(s) t."""
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        x = self.source.interferogram(self.opd_factor * self.stage.position(t))
+        y = np.zeros_like(x)
+        if self.noise:
+            x = x + self.rng.normal(0, self.noise, x.shape)
+            y = y + self.rng.normal(0, self.noise, y.shape)
+        return x, y, np.hypot(x, y), np.degrees(np.arctan2(y, x))
+
+    @property
+    def capture_rate(self):
+        return self.capture_rate_max / 2**self.capture_divider
+
+    @property
+    def _sample_bytes(self):
+        return 4 * (1, 2, 2, 4)[self.capture_cfg]
+
+    def capture_bytes(self, now=None):
+        """Bytes written to the capture buffer since CAPTURESTART."""
+        if self._capture_t0 is None:
+            return 0
+        end = self._capture_stop or (time.time() if now is None else now)
+        return int((end - self._capture_t0) * self.capture_rate) * self._sample_bytes
+
+    def capture_get(self, offset_kb, nkb):
+        """Contents of nkb kB of the circular capture buffer starting at offset_kb, as little-endian float32."""
+        length = self.capture_len_kb
+        written_kb = self.capture_bytes() // 1024
+        start_kb = offset_kb + length * ((written_kb - 1 - offset_kb) // length) # most recent pass over offset
+        first = start_kb * 1024 // self._sample_bytes
+        n = nkb * 1024 // self._sample_bytes
+        x, y, r, theta = self.signal(self._capture_t0 + (first + np.arange(n)) / self.capture_rate)
+        cols = ((x,), (x, y), (r, theta), (x, y, r, theta))[self.capture_cfg]
+        return np.column_stack(cols).astype('<f4').tobytes()
+
+    def _query(self, cmd):
+        name, _, arg = cmd.partition(' ')
+        name = name.upper()
+        if name == '++VER':
+            return 'Prologix GPIB-USB Controller version 6.107 (simulated)'
+        if name == '*IDN?':
+            return 'Stanford_Research_Systems,SR865A,s/n000000,v1.51 (simulated)'
+        if name == 'SNAPD?':
+            x, y, r, theta = (float(v[0]) for v in self.signal(time.time()))
+            return f'{x:.6e},{y:.6e},{r:.6e},{theta:.4f}'
+        if name.endswith('?') and name[:-1] in self.settings:
+            return f'{self.settings[name[:-1]]:g}'
+        if name in self.settings:
+            self.settings[name] = float(arg)
+        elif name == 'CAPTURELEN':
+            self.capture_len_kb = int(arg)
+        elif name == 'CAPTURECFG':
+            self.capture_cfg = int(arg)
+        elif name == 'CAPTURERATE':
+            self.capture_divider = int(arg)
+        elif name == 'CAPTURERATEMAX?':
+            return f'{self.capture_rate_max:g}'
+        elif name == 'CAPTURESTART':
+            self._capture_t0 = time.time()
+            self._capture_stop = None
+        elif name == 'CAPTURESTOP':
+            self._capture_stop = time.time()
+        elif name == 'CAPTUREBYTES?':
+            return str(self.capture_bytes())
+        elif name == 'CAPTUREGET?':
+            offset, nkb = (int(v) for v in arg.split(','))
+            data = self.capture_get(offset, nkb)
+            size = str(len(data)).encode()
+            return b'#' + str(len(size)).encode() + size + data
+        return None # commands without a reply (++addr, OUTX, *CLS, ...)
+
+    def write(self, data):
+        for line in data.decode('ascii', errors='ignore').replace('\r', '\n').split('\n'):
+            if not line.strip():
+                continue
+            rsp = self._query(line.strip())
+            if rsp is None:
+                continue
+            with self._lock:
+                self._out += rsp if isinstance(rsp, bytes) else rsp.encode() + b'\n'
+        return len(data)
+
+class _Settings:
+    def __init__(self, values):
+        self._values = values # name -> (getter, base unit)
+
+    def get(self, name, unit=None):
+        getter, base = self._values[name]
+        return _from_base(getter(), unit, base)
+
+class FakeZaberAxis:
+    def __init__(self, stage):
+        """Simulated Zaber axis; lengths and velocities accept astropy unit strings ('mm', 'um', 'mm/s', ...)."""
+        self.stage = stage
+        self.settings = _Settings({
+            'limit.min': (lambda: stage.limit_min, u.mm),
+            'limit.max': (lambda: stage.limit_max, u.mm),
+            'maxspeed': (lambda: stage.max_speed, u.mm / u.s),
+            })
+
+    def is_homed(self):
+        return self.stage.homed
+
+    def home(self, wait_until_idle=True):
+        self.stage.move_to(self.stage.limit_min)
+        self.stage.homed = True
+        if wait_until_idle:
+            self.stage.wait_until_idle()
+
+    def move_absolute(self, position, unit=None, wait_until_idle=True, velocity=0, velocity_unit=None):
+        self.stage.move_to(_to_base(position, unit, u.mm), _to_base(velocity, velocity_unit, u.mm / u.s) or None)
+        if wait_until_idle:
+            self.stage.wait_until_idle()
+
+    def move_relative(self, position, unit=None, wait_until_idle=True, velocity=0, velocity_unit=None):
+        self.move_absolute(self.stage.position() + _to_base(position, unit, u.mm), None, wait_until_idle,
+                           velocity, velocity_unit)
+
+    def move_velocity(self, velocity, unit=None):
+        self.stage.move_velocity(_to_base(velocity, unit, u.mm / u.s))
+
+    def stop(self, wait_until_idle=True):
+        self.stage.stop()
+
+    def get_position(self, unit=None):
+        return _from_base(self.stage.position(), unit, u.mm)
+
+    def is_busy(self):
+        return self.stage.is_busy()
+
+    def wait_until_idle(self, throw_error_on_fault=True):
+        self.stage.wait_until_idle()
+
+class FakeZaberDevice:
+    def __init__(self, stage):
+        self.axis = FakeZaberAxis(stage)
+        self.settings = self.axis.settings
+
+    def get_axis(self, axis_number):
+        return self.axis
+
+    def __repr__(self):
+        return 'Device 1 X-LRQ (simulated)'
+
+class FakeZaberConnection:
+    def __init__(self, stage, port='SIM-ZABER'):
+        """Simulated Zaber serial connection with one single-axis device on `stage`."""
+        self.port = port
+        self.device = FakeZaberDevice(stage)
+
+    def detect_devices(self):
+        return [self.device]
+
+    def close(self):
+        pass
+
+    def __repr__(self):
+        return f'Connection {self.port} (simulated)'
+
+class _Param:
+    def __init__(self, value=None, getter=None, setter=None):
+        self.value = value
+        self._getter = getter
+        self._setter = setter
+
+    def get(self):
+        return self._getter() if self._getter else self.value
+
+    def set(self, value):
+        self.value = value
+        if self._setter:
+            self._setter(value)
+
+class _Node:
+    def __init__(self, **children):
+        self.__dict__.update(children)
+
+class FakeDLCpro:
+    def __init__(self, stage, amplitude=100.0, frequency=100.0, tau=0.5, noise=0.0, opd_factor=2.0, clock_offset=1.7,
+                 seed=None):
+        """
+        Simulated Toptica DLC pro driving a THz photomixer pair, with the receiver looking through the
+        interferometer formed by `stage`. The actual frequency relaxes exponentially towards the set frequency,
+        and lock_in_value is the photocurrent [nA] averaged since the last lock_in_reset().
+
+        Inputs:
+            stage (Stage): moving mirror stage
+            amplitude (float): photocurrent amplitude [nA] (default=100)
+            frequency (float): initial frequency [GHz] (default=100)
+            tau (float): frequency settling time constant [s] (default=0.5)
+            noise (float): rms photocurrent noise [nA] per reading (default=0.0)
+            opd_factor (float): optical path difference per unit mirror displacement (default=2.0)
+            clock_offset (float): how far [s] the DLC's clock, which stamps the monitoring line, runs ahead of the
+                host's (default=1.7)
+            seed (int): random seed for the noise (default=None)
+        """
+        self.stage = stage
+        self.amplitude = amplitude
+        self.clock_offset = clock_offset
+        self.tau = tau
+        self.noise = noise
+        self.opd_factor = opd_factor
+        self.rng = np.random.default_rng(seed)
+        self._f_from = self._f_set = frequency
+        self._t_set = time.time()
+        self._t_reset = time.time()
+        self.frequency = _Node(frequency_set=_Param(frequency, getter=lambda: self._f_set, setter=self._set_frequency),
+                               frequency_act=_Param(getter=self.frequency_act))
+        self.lockin = _Node(frequency=_Param(5000.0), integration_time=_Param(100.0), amplifier_gain=_Param(1e6),
+                            phase=_Param(0.0), lock_in_value=_Param(getter=lambda: (self.lock_in_value(), True)),
+                            lock_in_reset=self._reset)
+        self.laser_operation = _Node(emission=_Param(False))
+
+    def _set_frequency(self, freq_ghz):
+        now = time.time()
+        self._f_from = self.frequency_act(now)
+        self._f_set, self._t_set = freq_ghz, now
+
+    def frequency_act(self, t=None):
+        t = time.time() if t is None else t
+        return self._f_set + (self._f_from - self._f_set) * np.exp(-(t - self._t_set) / self.tau)
+
+    def _reset(self):
+        self._t_reset = time.time()
+
+    def photocurrent(self, t):
+        """Instantaneous photocurrent [nA] at time(s) t."""
+        k = self.frequency_act(t) / C_CM_GHZ / 10 # 1/mm
+        return self.amplitude * np.cos(2 * np.pi * k * self.opd_factor * self.stage.position(t))
+
+    def lock_in_value(self):
+        now = time.time()
+        val = float(np.mean(self.photocurrent(np.linspace(min(self._t_reset, now), now, 32))))
+        return val + (self.rng.normal(0, self.noise) if self.noise else 0.0)
+
+    def client(self):
+        """A toptica.lasersdk.client.Client-like view of this laser (as used by laser.TopticaController)."""
+        return FakeClient(self)
+
+    def async_client(self, latency=0.0, monitoring=True):
+        """A toptica.lasersdk.asyncio.client.Client-like view of this laser (as used by laser_async)."""
+        return FakeAsyncClient(self, latency, monitoring)
+
+    def close(self):
+        pass
+
+class FakeClient:
+    def __init__(self, dlc):
+        self.dlc = dlc
+        self._params = {
+            'general:system-type': _Param('DLC smart (simulated)'),
+            'ul': _Param(3),
+            'frequency:frequency-set': dlc.frequency.frequency_set,
+            'frequency:frequency-act': dlc.frequency.frequency_act,
+            'lockin:frequency': dlc.lockin.frequency,
+            'lockin:integration-time': dlc.lockin.integration_time,
+            'lockin:amplifier-gain': dlc.lockin.amplifier_gain,
+            'lockin:phase': dlc.lockin.phase,
+            'lockin:lock-in-value': _Param(getter=dlc.lock_in_value),
+            }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, name, *types):
+        return self._params[name].get()
+
+    def set(self, name, value):
+        self._params[name].set(value)
+        return 0
+
+    def exec(self, name, *args, **kwargs):
+        if name == 'lockin:lock-in-reset':
+            self.dlc.lockin.lock_in_reset()
+
+    def close(self):
+        pass
+
+class FakeAsyncClient:
+    def __init__(self, dlc, latency=0.0, monitoring=True):
+        """
+        Like FakeClient, but with coroutine methods. Each command takes `latency` seconds and, like the real
+        command line, only one command may be in flight per client. subscribe() publishes the lock-in value
+        every `interval` ms unless `monitoring` is False, in which case it raises UnavailableError.
+        """
+        self._sync = FakeClient(dlc)
+        self.dlc = dlc
+        self.latency = latency
+        self.monitoring = monitoring
+        self.is_open = False
+        self._busy = False
+
+    async def open(self):
+        self.is_open = True
+
+    async def close(self):
+        self.is_open = False
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _command(self, method, *args):
+        if self._busy:
+            raise RuntimeError('readuntil() called while another coroutine is already waiting for incoming data')
+        self._busy = True
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return getattr(self._sync, method)(*args)
+        finally:
+            self._busy = False
+
+    async def get(self, name, *types):
+        return await self._command('get', name)
+
+    async def set(self, name, value):
+        return await self._command('set', name, value)
+
+    async def exec(self, name, *args, **kwargs):
+        return await self._command('exec', name)
+
+    async def subscribe(self, param_name, param_type=None, interval=None, threshold=None):
+        if not self.monitoring:
+            from toptica.lasersdk.asyncio.client import UnavailableError
+            raise UnavailableError('The monitoring line of the client connection is not available.')
+        return FakeSubscription(self._sync._params[param_name], self.dlc, (interval or 100) / 1000)
+
+class FakeSubscription:
+    def __init__(self, param, dlc, interval):
+        self.param = param
+        self.dlc = dlc
+        self.interval = interval
+        self.cancelled = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.cancelled:
+            raise StopAsyncIteration
+        self.dlc.lockin.lock_in_reset()
+        await asyncio.sleep(self.interval)
+        # like the SDK's parse of the monitoring line: the DLC's UTC time as a naive datetime
+        stamp = datetime.fromtimestamp(time.time() + self.dlc.clock_offset, timezone.utc).replace(tzinfo=None)
+        return stamp, self.param.get()
+
+    async def cancel(self):
+        self.cancelled = True
+
+class SimulatedBench:
+    def __init__(self, source=None, stage=None, encoder_rate=10000, corruption=0.0, lockin_noise=0.0, seed=None):
+        """
+        A complete simulated FTS: one stage shared by a fake Zaber axis, E201 encoder interface, Prologix/SR865A
+        lock-in and DLC pro, so whole scans run end to end without hardware. Controllers built here keep their
+        encoder offsets in memory (self.calibration) rather than in the user's calibration file.
+
+        Inputs:
+            source (Source): source spectrum seen by the lock-in (if None, defaults to Source())
+            stage (Stage): mirror stage (if None, defaults to Stage())
+            encoder_rate (float): encoder records per second (default=10000)
+            corruption (float): fraction of encoder records corrupted (default=0.0)
+            lockin_noise (float): rms lock-in noise [V] (default=0.0)
+            seed (int): random seed (default=None)
+        """
+        self.stage = stage or Stage()
+        self.source = source or Source(seed=seed)
+        self.e201 = FakeE201(self.stage, rate=encoder_rate, corruption=corruption, seed=seed)
+        self.sr865a = FakeSR865A(self.stage, self.source, noise=lockin_noise, seed=seed)
+        self.zaber = FakeZaberConnection(self.stage)
+        self.dlc = FakeDLCpro(self.stage, seed=seed)
+        self.calibration = OffsetCalibration(path=None)
+
+    def encoder(self, **kwargs):
+        from .encoder import EncoderController
+        return EncoderController(connection=self.e201, **kwargs)
+
+    def lockin(self, **kwargs):
+        from .lockin import LockinController
+        return LockinController(connection=self.sr865a, **kwargs)
+
+    def motor(self, **kwargs):
+        from .motor import MotorController
+        return MotorController(connection=self.zaber, **kwargs)
+
+    def mirror(self, use_lockin=True):
+        """MirrorController on the simulated encoder, motor and (optionally) lock-in."""
+        from .mirror import MirrorController
+        return MirrorController(encoder=self.encoder(), motor=self.motor(), lockin=self.lockin() if use_lockin else None,
+                                calibration=self.calibration)
+
+    def toptica(self):
+        """laser_old.TopticaController on the simulated DLC pro, encoder and motor."""
+        from .laser_old import TopticaController
+        return TopticaController(ip_address='simulated', dlc=self.dlc, motor=self.motor(), encoder=self.encoder(),
+                                 calibration=self.calibration)
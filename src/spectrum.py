@@ -0,0 +1,304 @@
+### Interferogram-to-spectrum engine ###
+
+import functools
+import numpy as np
+
+C_CM_GHZ = 29.9792458 # speed of light [GHz cm]; frequency [GHz] = C_CM_GHZ * wavenumber [1/cm]
+WINDOWS = {
+    None: np.ones,
+    'boxcar': np.ones,
+    'hann': np.hanning,
+    'hamming': np.hamming,
+    'blackman': np.blackman,
+    'bartlett': np.bartlett,
+    }
+
+def _to_mm(x):
+    """Strip units from an astropy Quantity (converting to mm); plain arrays are assumed to be in mm."""
+    if hasattr(x, 'unit'):
+        return np.asarray(x.to_value('mm'), dtype=float)
+    return np.asarray(x, dtype=float)
+
+def _value(x):
+    return np.asarray(getattr(x, 'value', x), dtype=float)
+
+@functools.lru_cache(maxsize=None)
+def next_fast_len(n):
+    """Smallest 2**a * 3**b * 5**c >= n, the lengths pocketfft transforms fastest."""
+    best = 1 << max(int(n - 1).bit_length(), 0)
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            m = p35
+            while m < n:
+                m *= 2
+            best = min(best, m)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+@functools.lru_cache(maxsize=256)
+def get_window(name, n):
+    """Apodization window of length n (cached, read-only)."""
+    if name not in WINDOWS:
+        raise ValueError(f'Unknown window: {name}. Choose from {list(WINDOWS)}.')
+    w = WINDOWS[name](n)
+    w.flags.writeable = False
+    return w
+
+class FFTPlan:
+    def __init__(self, n, nfft, window=None):
+        """
+        Everything about a transform that depends only on its length: the apodization window, the padded
+        FFT length and the frequency axis in cycles per sample. Plans are cached by get_plan(), so reprocessing
+        many scans of the same length reuses them.
+
+        Inputs:
+            n (int): number of interferogram samples
+            nfft (int): transform length after zero-padding
+            window (str): apodization window name (see WINDOWS)
+        """
+        self.n = n
+        self.nfft = nfft
+        self.window_name = window
+        self.window = get_window(window, n)
+        self.freq = np.fft.rfftfreq(nfft)
+        self.freq.flags.writeable = False
+
+    def window_about(self, zpd):
+        """
+        The apodization window centred on sample `zpd` rather than on the middle of the record: 1 at ZPD,
+        symmetric about it and tapering to the end of the longer side. Used for one-sided interferograms.
+        """
+        half = max(zpd, self.n - 1 - zpd)
+        return get_window(self.window_name, 2 * half + 1)[half - zpd:half - zpd + self.n]
+
+    def execute(self, x):
+        """Apodize, zero-pad and transform x."""
+        return np.fft.rfft(x * self.window, n=self.nfft)
+
+@functools.lru_cache(maxsize=256)
+def get_plan(n, pad=True, oversample=1, window=None):
+    """
+    Get the (cached) FFTPlan for an n-sample interferogram.
+
+    Inputs:
+        n (int): number of samples
+        pad (bool): zero-pad to a fast FFT length (default=True)
+        oversample (int): zero-pad to at least oversample * n (default=1)
+        window (str): apodization window name (default=None)
+    """
+    nfft = n * oversample
+    if pad:
+        nfft = next_fast_len(nfft)
+    return FFTPlan(n, nfft, window)
+
+@functools.lru_cache(maxsize=256)
+def sample_index(n):
+    """0, 1, ..., n-1 as floats (cached, read-only), used to build uniform grids."""
+    idx = np.arange(n, dtype=float)
+    idx.flags.writeable = False
+    return idx
+
+def clear_cache():
+    """Drop all cached plans, windows and grids."""
+    get_plan.cache_clear()
+    get_window.cache_clear()
+    sample_index.cache_clear()
+
+def rebin(signal, nsamp):
+    """Average consecutive groups of nsamp readings, e.g. the NINT lock-in samples taken at each step."""
+    signal = _value(signal)
+    return signal[:signal.size - signal.size % nsamp].reshape(-1, nsamp).mean(axis=1)
+
+def resample(opd, signal, n=None):
+    """
+    Linearly resample an interferogram onto a uniform OPD grid spanning the data.
+
+    Returns: (uniform opd, resampled signal)
+    """
+    order = np.argsort(opd, kind='stable')
+    opd, signal = opd[order], signal[order]
+    n = opd.size if n is None else n
+    step = (opd[-1] - opd[0]) / (n - 1)
+    grid = opd[0] + step * sample_index(n)
+    return grid, np.interp(grid, opd, signal)
+
+def low_resolution_phase(x, zpd, nphase):
+    """
+    Phase spectrum from the short double-sided part of the interferogram around ZPD.
+
+    Returns: (frequency [cycles/sample], phase, half-width m actually used)
+    """
+    m = min(nphase, zpd, x.size - zpd - 1)
+    if m < 2:
+        raise ValueError('Not enough samples on both sides of ZPD for phase correction.')
+    seg = x[zpd - m:zpd + m] * get_window('hann', 2 * m)
+    low = np.fft.rfft(np.roll(seg, -m)) # ZPD to index 0
+    return np.fft.rfftfreq(2 * m), np.unwrap(np.angle(low)), m
+
+def phase_correct(x, zpd, plan, method='mertz', nphase=256):
+    """
+    Phase-correct an interferogram sampled on a uniform grid.
+
+    Inputs:
+        x (numpy.ndarray): interferogram
+        zpd (int): index of zero path difference
+        plan (FFTPlan): transform plan for len(x)
+        method (str): 'mertz' (multiply by the low-resolution phase) or 'forman' (convolve with its kernel)
+        nphase (int): half-width [samples] of the double-sided region used for the phase (default=256)
+
+    Returns: (real spectrum, phase)
+    """
+    freq_low, phase_low, m = low_resolution_phase(x, zpd, nphase)
+    phase = np.interp(plan.freq, freq_low, phase_low)
+    window = plan.window_about(zpd)
+    # ramp the double-sided part so each OPD is counted once (used by both methods)
+    ramp = np.ones(x.size)
+    ramp[:zpd - m] = 0
+    ramp[zpd - m:zpd + m] = np.linspace(0, 2, 2 * m) # Mertz ramp: 0 at -m, 1 at ZPD, 2 at +m
+    ramp[zpd + m:] = 2
+    if method == 'mertz':
+        y = np.zeros(plan.nfft)
+        y[:x.size] = x * ramp * window
+        y = np.roll(y, -zpd) # ZPD to index 0
+        return (np.fft.rfft(y) * np.exp(-1j * phase)).real, phase
+    if method == 'forman':
+        # convolving with the inverse transform of exp(-i phase) symmetrises the interferogram about ZPD; the
+        # kernel has odd length (lags -m .. m, lag 0 at index m) so that mode='same' does not shift the result
+        h = np.fft.irfft(np.exp(-1j * phase_low), n=2 * m)
+        kernel = h[np.arange(-m, m + 1) % (2 * m)] * get_window('hann', 2 * m + 1)
+        y = np.convolve(x, kernel, mode='same')
+        z = np.zeros(plan.nfft)
+        z[:x.size] = y * ramp * window
+        return np.fft.rfft(np.roll(z, -zpd)).real, phase
+    raise ValueError("Phase correction must be 'mertz', 'forman' or None.")
+
+def nudft(x, y, freq, block=4096):
+    """
+    Exact non-uniform discrete Fourier transform, F(f) = sum_j y_j exp(-2 pi i f x_j). O(N*M); kept as the
+    reference for nufft().
+
+    Inputs:
+        x (numpy.ndarray): sample positions
+        y (numpy.ndarray): sample values
+        freq (numpy.ndarray): frequencies (in cycles per unit of x) to evaluate
+        block (int): number of frequencies evaluated per pass, to bound memory (default=4096)
+    """
+    out = np.empty(freq.size, dtype=complex)
+    for start in range(0, freq.size, block):
+        f = freq[start:start + block]
+        out[start:start + block] = np.exp(-2j * np.pi * np.outer(f, x)) @ y
+    return out
+
+def nufft(theta, c, nmodes, nspread=12, ratio=2):
+    """
+    Type-1 non-uniform FFT by Gaussian gridding (Greengard & Lee 2004): F[k] = sum_j c_j exp(-i k theta_j)
+    for k = 0 .. nmodes-1, in O(N log N). Each sample is spread onto an oversampled uniform grid with a
+    Gaussian kernel, the grid is FFT'd, and the kernel's transform is divided back out.
+
+    Inputs:
+        theta (numpy.ndarray): sample phases in [0, 2 pi)
+        c (numpy.ndarray): sample values (real or complex)
+        nmodes (int): number of non-negative modes wanted
+        nspread (int): kernel half-width [grid points]; 12 gives ~1e-12 relative accuracy (default=12)
+        ratio (int): grid oversampling ratio (default=2)
+    """
+    m = 2 * nmodes # modes -nmodes .. nmodes-1, of which the non-negative half is returned
+    mr = max(ratio * m, 2 * nspread)
+    tau = np.pi * nspread / (m**2 * ratio * (ratio - 0.5))
+    h = 2 * np.pi / mr
+    base = np.floor(theta / h).astype(np.int64)
+    frac = theta - base * h
+    grid = np.zeros(mr, dtype=complex)
+    for off in range(-nspread + 1, nspread + 1):
+        w = np.exp(-(frac - off * h)**2 / (4 * tau))
+        idx = (base + off) % mr
+        grid.real += np.bincount(idx, weights=w * c.real, minlength=mr)
+        if np.iscomplexobj(c):
+            grid.imag += np.bincount(idx, weights=w * c.imag, minlength=mr)
+    k = np.arange(nmodes)
+    return np.fft.fft(grid)[k] / mr * np.sqrt(np.pi / tau) * np.exp(tau * k**2)
+
+def _nonuniform_spectrum(opd, x, window, oversample, method):
+    """Transform a non-uniformly sampled interferogram directly, without resampling."""
+    order = np.argsort(opd, kind='stable')
+    opd, x = opd[order], x[order]
+    n = opd.size
+    span = opd[-1] - opd[0]
+    if window is not None: # evaluate the window at each sample's fractional position along the record
+        x = x * np.interp((opd - opd[0]) / span * (n - 1), sample_index(n), get_window(window, n))
+    period = oversample * n * span / (n - 1) # frequency spacing 1/period, as for the uniform FFT
+    nmodes = oversample * n // 2 + 1
+    if method == 'direct':
+        spec = nudft(opd - opd[0], x, sample_index(nmodes) / period)
+    else:
+        spec = nufft(2 * np.pi * (opd - opd[0]) / period, x, nmodes)
+    return opd, x, sample_index(nmodes) / period, spec
+
+def compute_spectrum(position, signal, opd_factor=2.0, window=None, pad=True, oversample=1,
+                     phase_correction=None, zpd=None, nphase=256, subtract_mean=True, method='interp'):
+    """
+    Turn raw mirror positions and detector readings into a spectrum.
+
+    Inputs:
+        position (array-like or Quantity): mirror position of each sample (plain arrays are in mm)
+        signal (array-like or Quantity): detector reading of each sample
+        opd_factor (float): optical path difference per unit mirror displacement (default=2.0)
+        window (str): apodization window, one of WINDOWS (default=None)
+        pad (bool): zero-pad to a fast FFT length (default=True)
+        oversample (int): zero-pad to at least oversample * n points (default=1)
+        phase_correction (str): None, 'mertz' or 'forman' (default=None)
+        zpd (int): index of ZPD on the resampled grid for phase correction (if None, the largest excursion)
+        nphase (int): half-width of the double-sided region used for phase correction (default=256)
+        subtract_mean (bool): remove the DC level before transforming (default=True)
+        method (str): 'interp' to resample linearly onto a uniform grid and FFT, 'nufft' to transform the
+            measured non-uniform samples directly in O(N log N), or 'direct' for the exact O(N*M) sum (default='interp')
+
+    Returns: dict with 'opd' [mm] and 'interferogram' (uniformly resampled for 'interp', sorted samples
+    otherwise), 'wavenumber' [1/cm], 'frequency' [GHz], 'spectrum' (complex, or real if phase corrected),
+    'power' and 'phase'
+    """
+    opd = opd_factor * _to_mm(position)
+    signal = _value(signal)
+    if method in ('nufft', 'direct'):
+        if phase_correction is not None:
+            raise ValueError("Phase correction requires method='interp'.")
+        if subtract_mean:
+            signal = signal - signal.mean()
+        opd, x, freq, spec = _nonuniform_spectrum(opd, signal, window, oversample, method)
+        wavenumber = freq * 10 # 1/mm -> 1/cm
+        return {
+            'opd': opd,
+            'interferogram': x,
+            'wavenumber': wavenumber,
+            'frequency': C_CM_GHZ * wavenumber,
+            'spectrum': spec,
+            'power': np.abs(spec)**2,
+            'phase': np.angle(spec),
+            }
+    if method != 'interp':
+        raise ValueError("Method must be 'interp', 'nufft' or 'direct'.")
+    opd, x = resample(opd, signal)
+    if subtract_mean:
+        x = x - x.mean()
+    dx = opd[1] - opd[0]
+    plan = get_plan(x.size, pad, oversample, window)
+    wavenumber = plan.freq / dx * 10 # 1/mm -> 1/cm
+    if phase_correction is None:
+        spec = plan.execute(x)
+        phase = np.angle(spec)
+    else:
+        if zpd is None:
+            zpd = int(np.argmax(np.abs(x)))
+        spec, phase = phase_correct(x, zpd, plan, phase_correction, nphase)
+    return {
+        'opd': opd,
+        'interferogram': x,
+        'wavenumber': wavenumber,
+        'frequency': C_CM_GHZ * wavenumber,
+        'spectrum': spec,
+        'power': np.abs(spec)**2,
+        'phase': phase,
+        }
@@ -0,0 +1,189 @@
+import time
+import numpy as np
+
+TIMING_KEYS = ('move_s', 'settle_s', 'integrate_s', 'overhead_s', 'total_s')
+
+class StepScanner:
+    def __init__(self, motor, encoder, lockin, nsamps=50, settle_tolerance=2, settle_time=0.05, settle_timeout=2.0,
+                 poll_interval=0.005, capture=False, rate_divider=6):
+        """
+        Step-and-integrate scan engine. Each step waits for the motor to go idle, then for the encoder to settle
+        (|Δcount| <= settle_tolerance for settle_time seconds of encoder timestamps) instead of sleeping a fixed
+        time, and integrates the lock-in before the next move is issued.
+
+        SNAPD? readings sample the lock-in output as it is read, so with capture=False all nsamps of them are
+        taken with the mirror at rest and only the progress report overlaps the next move. With capture=True the
+        lock-in records into its on-board capture buffer: the mirror dwells for nsamps capture samples, the
+        next move is issued at once, and the samples are transferred and reduced while it travels.
+
+        Inputs:
+            motor (MotorController): initialized motor
+            encoder (EncoderController): initialized encoder
+            lockin (LockinController): initialized lock-in
+            nsamps (int): lock-in readings per step (default=50)
+            settle_tolerance (int): largest count change between reads still counted as settled (default=2)
+            settle_time (float): time [s] the count must hold still to count as settled (default=0.05)
+            settle_timeout (float): time [s] after which a step is accepted unsettled (default=2.0)
+            poll_interval (float): time [s] between encoder reads while settling (default=0.005)
+            capture (bool): integrate from the lock-in's capture buffer, overlapping the transfer with the next
+                move (default=False)
+            rate_divider (int): capture rate is the lock-in's maximum divided by 2**rate_divider (default=6)
+        """
+        self.motor = motor
+        self.encoder = encoder
+        self.lockin = lockin
+        self.nsamps = nsamps
+        self.settle_tolerance = settle_tolerance
+        self.settle_time = settle_time
+        self.settle_timeout = settle_timeout
+        self.poll_interval = poll_interval
+        self.capture = capture
+        self.rate_divider = rate_divider
+
+    def read_encoder(self):
+        """
+        (timestamp, count) of the newest encoder record while it transmits, else the time now and a queried count.
+        """
+        if getattr(self.encoder, 'transmitting', False):
+            latest = self.encoder.get_latest()
+            if latest is not None:
+                return latest
+        return time.time(), self.encoder.get_count()
+
+    def settle(self):
+        """
+        Wait for the encoder count to stay within settle_tolerance of a reference count for settle_time seconds,
+        measured on the encoder timestamps, so repeated reads of the same record cannot settle a step early.
+
+        Returns: (final count, True if settled before the timeout)
+        """
+        t0 = time.time()
+        t_ref, ref = self.read_encoder()
+        cnt = ref
+        while True:
+            t, cnt = self.read_encoder()
+            if abs(cnt - ref) > self.settle_tolerance:
+                t_ref, ref = t, cnt
+            elif t - t_ref >= self.settle_time:
+                return cnt, True
+            if time.time() - t0 > self.settle_timeout:
+                return cnt, False
+            time.sleep(self.poll_interval)
+
+    def integrate(self):
+        """
+        Take nsamps lock-in readings.
+
+        Returns: (nsamps, 4) array of x, y, r, theta
+        """
+        return np.array([self.lockin.get_x_y_r_theta() for _ in range(self.nsamps)])
+
+    def dwell(self):
+        """
+        Hold the mirror still for nsamps capture samples.
+
+        Returns: (start, end) times [s] of the dwell
+        """
+        t0 = time.time()
+        time.sleep(self.nsamps / self.lockin.capture_rate)
+        return t0, time.time()
+
+    def collect(self, t0, t1, timeout=2.0):
+        """
+        Captured lock-in samples taken between t0 and t1, waiting up to `timeout` for them to be transferred.
+
+        Returns: (nsamps, 4) array of x, y, r, theta (NaN where fewer samples fell in the window)
+        """
+        blocks = []
+        t_limit = time.time() + timeout
+        while True:
+            new = self.lockin.get_new()
+            if len(new):
+                blocks.append(np.array(new)) # copied out of the ring
+                if blocks[-1]['timestamp'][-1] >= t1:
+                    break
+            if time.time() > t_limit:
+                break
+            time.sleep(self.poll_interval)
+        out = np.full((self.nsamps, 4), np.nan)
+        if blocks:
+            rec = np.concatenate(blocks)
+            rec = rec[(rec['timestamp'] >= t0) & (rec['timestamp'] < t1)][:self.nsamps]
+            out[:len(rec)] = np.column_stack([rec[f] for f in ('x', 'y', 'r', 'theta')])
+        return out
+
+    def run(self, positions, length_unit=None, verbose=True):
+        """
+        Step through `positions`, integrating at each one.
+
+        Inputs:
+            positions (array-like): motor positions to visit
+            length_unit (str): units associated with 'positions' (if None, defaults to motor units)
+            verbose (bool): print progress and the timing summary (default=True)
+
+        Returns: dict with 'positions', 'counts', 'settled', 'data' (nsteps, nsamps, 4) and per-step timing
+        arrays 'move_s', 'settle_s', 'integrate_s', 'overhead_s' (the work done after the next move was
+        issued, i.e. while it travels) and 'total_s'
+        """
+        positions = np.asarray(positions, dtype=float)
+        nsteps = positions.size
+        counts = np.zeros(nsteps, dtype=np.int64)
+        settled = np.zeros(nsteps, dtype=bool)
+        data = np.full((nsteps, self.nsamps, 4), np.nan)
+        timing = {key: np.zeros(nsteps) for key in TIMING_KEYS}
+        if nsteps == 0:
+            return {'positions': positions, 'counts': counts, 'settled': settled, 'data': data, **timing}
+
+        if self.capture:
+            self.lockin.start_capture(rate_divider=self.rate_divider)
+        try:
+            self.motor.move_absolute(positions[0], length_unit, wait=False)
+            t_issue = t_prev = time.time()
+            for n in range(nsteps):
+                window = None
+                try:
+                    self.motor.wait_until_idle()
+                    t_idle = time.time()
+                    counts[n], settled[n] = self.settle()
+                    t_settled = time.time()
+                    if self.capture:
+                        window = self.dwell()
+                    else:
+                        data[n] = self.integrate()
+                    t_done = time.time()
+                except Exception as e:
+                    print(f'FAILURE OCCURRED at step {n}: {e}')
+                    t_idle = t_settled = t_done = time.time()
+                if n + 1 < nsteps:
+                    self.motor.move_absolute(positions[n + 1], length_unit, wait=False)
+                t_next_issue = time.time()
+                if window is not None: # the captured samples come over while the motor travels
+                    try:
+                        data[n] = self.collect(*window)
+                    except Exception as e:
+                        print(f'FAILURE OCCURRED at step {n}: {e}')
+                timing['move_s'][n] = t_idle - t_issue
+                timing['settle_s'][n] = t_settled - t_idle
+                timing['integrate_s'][n] = t_done - t_settled
+                timing['total_s'][n] = t_done - t_prev
+                if verbose:
+                    print(f'Count: {n + 1}/{nsteps} | Position: {counts[n]}')
+                timing['overhead_s'][n] = time.time() - t_next_issue
+                t_issue, t_prev = t_next_issue, t_done
+        finally:
+            if self.capture:
+                self.lockin.stop_transmission()
+        if verbose:
+            self.report(timing)
+        return {'positions': positions, 'counts': counts, 'settled': settled, 'data': data, **timing}
+
+    @staticmethod
+    def report(timing):
+        """Print where the scan time went. Overhead runs while the next move is under way, so it is not dead time."""
+        total = timing['total_s'].sum()
+        if total <= 0:
+            return
+        for key in TIMING_KEYS[:-1]:
+            t = timing[key].sum()
+            print(f'{key[:-2]:>10}: {t:8.2f} s ({100 * t / total:5.1f}%), {1e3 * np.mean(timing[key]):7.1f} ms/step')
+        print(f'{"total":>10}: {total:8.2f} s')
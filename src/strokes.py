@@ -0,0 +1,126 @@
+### Stroke tagging for bidirectional scans ###
+
+import numpy as np
+
+STROKE_COLUMNS = {'stroke': 'i4', 'direction': 'i1'}
+
+class StrokeTracker:
+    def __init__(self, direction=1, hysteresis=0.002):
+        """
+        Tags samples of a back-and-forth scan with their stroke index and direction. The boundary between two
+        strokes is the time of the position extremum at the turnaround, confirmed once the mirror has come back
+        from it by more than `hysteresis`. Rows are held back until their stroke is certain, i.e. while a
+        turnaround is pending only rows up to the extremum so far are released.
+
+        Inputs:
+            direction (int): direction of the first stroke, +1 or -1 (default=1)
+            hysteresis (float): travel [mm] back from the extremum that confirms a turnaround (default=0.002)
+        """
+        self.hysteresis = hysteresis
+        self.reset(direction)
+
+    def reset(self, direction=1):
+        self.first_direction = 1 if direction >= 0 else -1
+        self.direction = self.first_direction
+        self.stroke = 0
+        self.turns = [] # turnaround times [s]
+        self.reversing = False
+        self._ext = None # (position * direction, time) of the extremum so far while reversing
+        self._t_reverse = -np.inf
+        self._last_t = -np.inf
+        self._pending = None
+
+    @property
+    def last_turn(self):
+        return self.turns[-1] if self.turns else -np.inf
+
+    def reverse(self):
+        """Note that the motor has been commanded to reverse."""
+        self.reversing = True
+        self._ext = None
+        self._t_reverse = self._last_t
+
+    def update(self, t, position):
+        """
+        Add a block of encoder samples.
+
+        Returns: True if a turnaround was confirmed in this block
+        """
+        t = np.asarray(t, dtype=float)
+        if not t.size:
+            return False
+        self._last_t = t[-1]
+        if not self.reversing:
+            return False
+        u = self.direction * np.asarray(position, dtype=float)
+        i = int(np.argmax(u))
+        start = 0
+        if self._ext is None or u[i] > self._ext[0]:
+            self._ext = (u[i], t[i])
+            start = i
+        if (u[start:] < self._ext[0] - self.hysteresis).any():
+            self.turns.append(self._ext[1])
+            self.stroke += 1
+            self.direction = -self.direction
+            self.reversing = False
+            self._ext = None
+            return True
+        return False
+
+    def at_end(self, t, position, lo, hi):
+        """Mask of samples at or beyond the end of travel in the current direction, after the last turnaround."""
+        end = position >= hi if self.direction > 0 else position <= lo
+        return end & (t > self.last_turn)
+
+    def tag(self, t):
+        """Stroke index and direction of samples at times t (all before the pending turnaround, if any)."""
+        stroke = np.searchsorted(self.turns, t, side='left').astype(np.int32)
+        direction = np.where(stroke % 2 == 0, self.first_direction, -self.first_direction).astype(np.int8)
+        return stroke, direction
+
+    def push(self, rows, flush=False):
+        """
+        Add a block of rows (a dict of columns with 'timestamp') and release those whose stroke is known.
+
+        Inputs:
+            rows (dict): column -> array
+            flush (bool): release everything, tagging rows after a pending turnaround with the current stroke
+
+        Returns: dict of the released rows, with 'stroke' and 'direction' columns added
+        """
+        if self._pending is None:
+            self._pending = {name: np.asarray(v) for name, v in rows.items()}
+        else:
+            self._pending = {name: np.concatenate([self._pending[name], rows[name]]) for name in self._pending}
+        t = self._pending['timestamp']
+        if flush:
+            n = t.size
+        else:
+            safe = (self._ext[1] if self._ext is not None else self._t_reverse) if self.reversing else self._last_t
+            n = int(np.searchsorted(t, safe, side='right'))
+        out = {name: v[:n] for name, v in self._pending.items()}
+        self._pending = {name: v[n:] for name, v in self._pending.items()}
+        out['stroke'], out['direction'] = self.tag(out['timestamp'])
+        return out
+
+def split_strokes(columns, direction=None):
+    """
+    Split a bidirectional scan into its strokes.
+
+    Inputs:
+        columns (dict or ScanArchive): scan columns including 'stroke' and 'direction'
+        direction (int): only yield strokes in this direction, +1 (forward) or -1 (reverse) (default=None, both)
+
+    Yields: (stroke index, direction, dict of column -> array for that stroke); arrays are slices of the input
+    """
+    stroke = np.asarray(columns['stroke'])
+    if not stroke.size:
+        return
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(stroke)) + 1, [stroke.size]])
+    names = list(columns.keys())
+    dirs = columns['direction']
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        d = int(dirs[a])
+        if direction is not None and d != direction:
+            continue
+        yield int(stroke[a]), d, {name: columns[name][a:b] for name in names}
@@ -0,0 +1,169 @@
+### Multi-frequency Toptica sweeps over mirror positions ###
+
+import time
+import numpy as np
+from .writer import open_writer
+
+SWEEP_COLUMNS = ['timestamp', 'freq_set_ghz', 'freq_act_ghz', 'position_mm', 'photocurrent_na',
+                 'photocurrent_std', 'settle_s', 'move_s']
+
+def serpentine(outer, inner):
+    """
+    Visit every (outer, inner) pair, reversing the inner order on alternate rows so each row starts where the
+    previous one ended.
+
+    Returns: (outer values, inner values) in visiting order
+    """
+    outer, inner = np.asarray(outer, dtype=float), np.asarray(inner, dtype=float)
+    rows = [inner if i % 2 == 0 else inner[::-1] for i in range(outer.size)]
+    return np.repeat(outer, inner.size), np.concatenate(rows) if rows else np.empty(0)
+
+class SweepScheduler:
+    def __init__(self, toptica, tolerance=0.05, stable_reads=2, settle_timeout=10.0, poll_interval=0.05,
+                 freq_settle_s=1.0, step_move_s=0.2):
+        """
+        Frequency x mirror-position sweeps with laser_old.TopticaController. The frequency is polled until it
+        has converged instead of sleeping a fixed time, the next frequency settles while the mirror moves, and
+        the sweep order is planned so neither the laser nor the mirror travels further than it has to.
+
+        Inputs:
+            toptica (laser_old.TopticaController): initialized controller
+            tolerance (float): |frequency_act - frequency_set| [GHz] counted as converged (default=0.05)
+            stable_reads (int): consecutive converged reads required (default=2)
+            settle_timeout (float): time [s] after which a frequency is accepted unconverged (default=10)
+            poll_interval (float): time [s] between frequency_act reads (default=0.05)
+            freq_settle_s (float): rough time [s] for a frequency change, used only to plan the order (default=1.0)
+            step_move_s (float): rough time [s] for one mirror step, used only to plan the order (default=0.2)
+        """
+        self.toptica = toptica
+        self.tolerance = tolerance
+        self.stable_reads = stable_reads
+        self.settle_timeout = settle_timeout
+        self.poll_interval = poll_interval
+        self.freq_settle_s = freq_settle_s
+        self.step_move_s = step_move_s
+
+    def wait_for_frequency(self, target, t0=None):
+        """
+        Poll frequency_act until it is within tolerance of `target` for stable_reads reads.
+
+        Returns: (last frequency_act [GHz], True if converged before the timeout)
+        """
+        t0 = time.time() if t0 is None else t0
+        steady = 0
+        while True:
+            act = self.toptica.get_frequency()
+            steady = steady + 1 if abs(act - target) <= self.tolerance else 0
+            if steady >= self.stable_reads:
+                return act, True
+            if time.time() - t0 > self.settle_timeout:
+                return act, False
+            time.sleep(self.poll_interval)
+
+    def plan(self, frequencies, positions, nesting='auto'):
+        """
+        Order the sweep. Frequencies are visited in ascending order (small steps settle fastest) and the
+        inner loop runs serpentine. With nesting='frequency' each frequency gets a full mirror pass; with
+        'position' each mirror position gets a full frequency pass; 'auto' picks the one with the smaller
+        estimated time from freq_settle_s and step_move_s.
+
+        Returns: (frequencies, positions) in visiting order
+        """
+        freqs = np.sort(np.asarray(frequencies, dtype=float))
+        pos = np.asarray(positions, dtype=float)
+        nesting = self.resolve_nesting(freqs, pos, nesting)
+        if nesting == 'frequency':
+            return serpentine(freqs, pos)
+        if nesting == 'position':
+            p, f = serpentine(pos, freqs)
+            return f, p
+        raise ValueError("Nesting must be 'frequency', 'position' or 'auto'.")
+
+    def resolve_nesting(self, freqs, positions, nesting='auto'):
+        """The nesting plan() uses: `nesting` itself, or for 'auto' the one with the smaller estimate()."""
+        if nesting != 'auto':
+            return nesting
+        return 'frequency' if self.estimate(freqs, positions, 'frequency') <= self.estimate(freqs, positions, 'position') else 'position'
+
+    def estimate(self, freqs, positions, nesting):
+        """
+        Rough sweep time [s] from freq_settle_s per frequency change and step_move_s per mirror step. With a
+        serpentine inner loop the outer variable changes on its own at each row boundary.
+        """
+        nf, npos = len(freqs), len(positions)
+        fs, ms = self.freq_settle_s, self.step_move_s
+        if nesting == 'frequency':
+            return nf * fs + nf * max(npos - 1, 0) * ms
+        return fs + npos * max(nf - 1, 0) * fs + max(npos - 1, 0) * ms
+
+    def run(self, frequencies, positions, length_unit=None, nsamps=1, nesting='auto', save_to=None, verbose=True,
+            **writer_kwargs):
+        """
+        Run a sweep. At each point the frequency and mirror are commanded together, the mirror move and the
+        frequency settling proceed in parallel, and then nsamps lock-in integrations are taken. The frequency is
+        read once per point after settling rather than once per sample.
+
+        Inputs:
+            frequencies (array-like): frequencies [GHz]
+            positions (array-like): mirror positions
+            length_unit (str): units associated with 'positions' (if None, defaults to motor units)
+            nsamps (int): lock-in integrations per point (default=1)
+            nesting (str): 'frequency', 'position' or 'auto', see plan() (default='auto')
+            save_to (str): stream rows to this path via writer.open_writer (default=None)
+            verbose (bool): print progress and the time summary (default=True)
+            **writer_kwargs: passed to writer.open_writer
+
+        Returns: dict of SWEEP_COLUMNS -> arrays, plus 'settled', 'total_s' and the 'nesting' used
+        """
+        top = self.toptica
+        nesting = self.resolve_nesting(frequencies, positions, nesting)
+        freqs, pos = self.plan(frequencies, positions, nesting)
+        n = freqs.size
+        out = {c: np.full(n, np.nan) for c in SWEEP_COLUMNS}
+        settled = np.zeros(n, dtype=bool)
+        int_s = float(top.dlc.lockin.integration_time.get()) / 1000
+        writer = open_writer(save_to, SWEEP_COLUMNS, metadata={'nsamps': nsamps, 'nesting': nesting}, **writer_kwargs) if save_to else None
+        t_start = time.time()
+        try:
+            for i in range(n):
+                t0 = time.time()
+                changed = i == 0 or freqs[i] != freqs[i - 1]
+                if changed:
+                    top.set_frequency(freqs[i])
+                if i == 0 or pos[i] != pos[i - 1]:
+                    top.motor.move_absolute(pos[i], length_unit, wait=False)
+                top.motor.wait_until_idle()
+                t_moved = time.time()
+                act, settled[i] = self.wait_for_frequency(freqs[i], t0) if changed else (out['freq_act_ghz'][i - 1], settled[i - 1])
+                t_settled = time.time()
+                vals = np.empty(nsamps)
+                for k in range(nsamps):
+                    top.reset_lockin()
+                    time.sleep(int_s)
+                    vals[k], _ = top.get_photocurrent()
+                cnt = top.encoder.get_count()
+                row = {
+                    'timestamp': t_settled,
+                    'freq_set_ghz': freqs[i],
+                    'freq_act_ghz': act,
+                    'position_mm': (cnt - top.OFFSET) * top.RESOLUTION.value,
+                    'photocurrent_na': vals.mean(),
+                    'photocurrent_std': vals.std(),
+                    'settle_s': t_settled - t0,
+                    'move_s': t_moved - t0,
+                    }
+                for c, v in row.items():
+                    out[c][i] = v
+                if writer:
+                    writer.write(**{c: [v] for c, v in row.items()})
+                if verbose:
+                    print(f'{i + 1}/{n} | {freqs[i]:.3f} GHz (act {act:.3f}) | {row["position_mm"]:.4f} mm | {row["photocurrent_na"]:.4g} nA')
+        finally:
+            if writer:
+                writer.close()
+        out['settled'] = settled
+        out['total_s'] = time.time() - t_start
+        out['nesting'] = nesting
+        if verbose:
+            print(f'Sweep of {n} points took {out["total_s"]:.1f} s ({np.count_nonzero(~settled)} unconverged).')
+        return out
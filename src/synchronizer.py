@@ -0,0 +1,150 @@
+import numpy as np
+
+LOCKIN_FIELDS = ('x', 'y', 'r', 'theta')
+SYNC_COLUMNS = ['timestamp', 'position_mm', 'opd_mm', 'x', 'y', 'r', 'theta']
+
+def interp_sorted(tq, t, v):
+    """
+    Linearly interpolate v(t) at the query times tq, with t sorted ascending. Uses a binary search
+    (np.searchsorted) so a block of m queries against n samples costs O(m log n).
+    """
+    j = np.clip(np.searchsorted(t, tq, side='right'), 1, len(t) - 1)
+    t0, t1 = t[j - 1], t[j]
+    dt = t1 - t0
+    w = np.divide(tq - t0, dt, out=np.zeros(len(tq)), where=dt != 0)
+    return v[j - 1] + w * (v[j] - v[j - 1])
+
+class Synchronizer:
+    def __init__(self, mode='lockin', opd_factor=2.0, monotonic=True, direction=1, history=5.0):
+        """
+        Streaming merge of encoder (t, position) blocks and lock-in (t, x, y, r, theta) blocks into an
+        OPD-indexed interferogram.
+
+        Inputs:
+            mode (str): 'lockin' to interpolate position at each lock-in timestamp, or 'encoder' to interpolate
+                the lock-in signal at each encoder sample (default='lockin')
+            opd_factor (float): optical path difference per unit mirror displacement (default=2.0)
+            monotonic (bool): only emit samples whose OPD advances (or holds) in `direction`; others are counted
+                in `dropped` (default=True)
+            direction (int): +1 for increasing OPD, -1 for decreasing (default=1)
+            history (float): time span [s] of each stream kept while waiting for the other one, so memory stays
+                bounded if a stream stalls; unmerged samples older than this are dropped (default=5.0)
+        """
+        if mode not in ('lockin', 'encoder'):
+            raise ValueError("Mode must be 'lockin' or 'encoder'.")
+        self.mode = mode
+        self.opd_factor = opd_factor
+        self.monotonic = monotonic
+        self.direction = direction
+        self.history = history
+        self.reset()
+
+    def reset(self):
+        """
+        Discard all pending samples and counters.
+        """
+        self._enc_t = np.empty(0)
+        self._enc_pos = np.empty(0)
+        self._lock_t = np.empty(0)
+        self._lock = {f: np.empty(0) for f in LOCKIN_FIELDS}
+        self._last_opd = None
+        self.emitted = 0
+        self.dropped = 0 # samples outside the other stream's time span or out of OPD order
+
+    def push_encoder(self, t, position):
+        """
+        Add a block of encoder samples.
+
+        Inputs:
+            t (array-like): timestamps [s], ascending
+            position (array-like): mirror positions
+        """
+        self._enc_t = np.concatenate([self._enc_t, np.asarray(t, dtype=float)])
+        self._enc_pos = np.concatenate([self._enc_pos, np.asarray(position, dtype=float)])
+
+    def push_lockin(self, block=None, **columns):
+        """
+        Add a block of lock-in samples, either a structured array with timestamp/x/y/r/theta fields or one
+        array per field as keyword arguments.
+        """
+        if block is not None:
+            columns = {name: block[name] for name in ('timestamp',) + LOCKIN_FIELDS}
+        self._lock_t = np.concatenate([self._lock_t, np.asarray(columns['timestamp'], dtype=float)])
+        for f in LOCKIN_FIELDS:
+            self._lock[f] = np.concatenate([self._lock[f], np.asarray(columns[f], dtype=float)])
+
+    def process(self):
+        """
+        Merge everything that can be resolved so far. Samples of the interpolated stream are resolvable once
+        the other stream has data on both sides of them; later ones wait for the next call.
+
+        Returns: dict of SYNC_COLUMNS -> arrays for the newly merged samples
+        """
+        self._bound_history()
+        if self.mode == 'lockin':
+            src_t, ref_t = self._lock_t, self._enc_t
+        else:
+            src_t, ref_t = self._enc_t, self._lock_t
+        if len(ref_t) < 2 or len(src_t) == 0:
+            return self._empty()
+        early = np.searchsorted(src_t, ref_t[0], side='left') # before the other stream started
+        ready = np.searchsorted(src_t, ref_t[-1], side='right')
+        self.dropped += early
+        tq = src_t[early:ready]
+        if self.mode == 'lockin':
+            out = {f: self._lock[f][early:ready] for f in LOCKIN_FIELDS}
+            out['position_mm'] = interp_sorted(tq, self._enc_t, self._enc_pos)
+        else:
+            out = {f: interp_sorted(tq, self._lock_t, self._lock[f]) for f in LOCKIN_FIELDS}
+            out['position_mm'] = self._enc_pos[early:ready]
+        out['timestamp'] = tq
+        out['opd_mm'] = self.opd_factor * out['position_mm']
+        self._consume(ready, tq)
+        if self.monotonic and len(tq):
+            out = self._keep_monotonic(out)
+        self.emitted += len(out['timestamp'])
+        return {name: out[name] for name in SYNC_COLUMNS}
+
+    def _consume(self, ready, tq):
+        # drop used samples, keeping the reference samples still needed to bracket pending queries
+        if self.mode == 'lockin':
+            self._lock_t = self._lock_t[ready:]
+            self._lock = {f: v[ready:] for f, v in self._lock.items()}
+            keep = max(np.searchsorted(self._enc_t, tq[-1], side='right') - 1, 0) if len(tq) else 0
+            self._enc_t, self._enc_pos = self._enc_t[keep:], self._enc_pos[keep:]
+        else:
+            self._enc_t, self._enc_pos = self._enc_t[ready:], self._enc_pos[ready:]
+            keep = max(np.searchsorted(self._lock_t, tq[-1], side='right') - 1, 0) if len(tq) else 0
+            self._lock_t = self._lock_t[keep:]
+            self._lock = {f: v[keep:] for f, v in self._lock.items()}
+
+    def _bound_history(self):
+        # keep at most `history` seconds of each stream: of the reference stream plus one bracketing sample, of
+        # the other stream counting what is discarded unmerged as dropped
+        enc_keep = self._window(self._enc_t, bracket=self.mode == 'lockin')
+        lock_keep = self._window(self._lock_t, bracket=self.mode == 'encoder')
+        self.dropped += enc_keep if self.mode == 'encoder' else lock_keep
+        if enc_keep:
+            self._enc_t, self._enc_pos = self._enc_t[enc_keep:], self._enc_pos[enc_keep:]
+        if lock_keep:
+            self._lock_t = self._lock_t[lock_keep:]
+            self._lock = {f: v[lock_keep:] for f, v in self._lock.items()}
+
+    def _window(self, t, bracket):
+        if len(t) < 2:
+            return 0
+        keep = np.searchsorted(t, t[-1] - self.history, side='right' if bracket else 'left')
+        return max(keep - 1, 0) if bracket else int(keep)
+
+    def _keep_monotonic(self, out):
+        opd = self.direction * out['opd_mm']
+        prev = np.maximum.accumulate(np.concatenate([[-np.inf if self._last_opd is None else self._last_opd], opd[:-1]]))
+        keep = opd >= prev # repeated (quantised) positions are not out of order
+        self.dropped += int(np.count_nonzero(~keep))
+        if keep.any():
+            self._last_opd = max(prev[-1], opd[-1])
+        return {name: v[keep] for name, v in out.items()}
+
+    @staticmethod
+    def _empty():
+        return {name: np.empty(0) for name in SYNC_COLUMNS}
@@ -0,0 +1,177 @@
+### OPD-triggered lock-in sampling ###
+
+import numpy as np
+from .synchronizer import SYNC_COLUMNS, interp_sorted
+
+TRIGGER_COLUMNS = SYNC_COLUMNS + ['target_opd_mm']
+
+class OPDTrigger:
+    def __init__(self, step_mm, opd_factor=2.0, direction=1, start_opd=None, latency=None, velocity_window=64,
+                 smoothing=0.1):
+        """
+        Decides when to read the lock-in so that readings land on a uniform OPD grid. Encoder blocks update a
+        velocity estimate (least-squares slope of the last `velocity_window` samples); the next grid crossing is
+        extrapolated from the newest sample and a reading is due `latency` seconds before it, so that the
+        lock-in samples close to the crossing. Readings are later given the encoder position interpolated at
+        their (estimated) sampling time, so the grid error can be checked in the 'target_opd_mm' column.
+
+        Inputs:
+            step_mm (float): OPD grid step [mm]
+            opd_factor (float): optical path difference per unit mirror displacement (default=2.0)
+            direction (int): +1 for increasing OPD, -1 for decreasing (default=1)
+            start_opd (float): OPD [mm] of one grid point (if None, the grid is aligned to multiples of step_mm)
+            latency (float): time [s] from issuing a read to the lock-in sampling (if None, estimated as half
+                the measured read round trip)
+            velocity_window (int): encoder samples in the velocity fit (default=64)
+            smoothing (float): weight of each new round trip in the running latency estimate (default=0.1)
+        """
+        if step_mm <= 0:
+            raise ValueError('step_mm must be positive.')
+        self.step = step_mm
+        self.opd_factor = opd_factor
+        self.start_opd = start_opd
+        self.fixed_latency = latency
+        self.velocity_window = velocity_window
+        self.smoothing = smoothing
+        self.reset(direction)
+
+    def reset(self, direction=None):
+        """Forget the encoder history, pending readings and counters (optionally with a new direction)."""
+        if direction is not None:
+            self.direction = 1 if direction >= 0 else -1
+        self.latency = self.fixed_latency or 0.0
+        self.velocity = None # OPD [mm/s]
+        self.target = None
+        self.fired = 0
+        self.missed = 0 # grid points passed before a reading could be taken
+        self._enc_t = np.empty(0)
+        self._enc_opd = np.empty(0)
+        self._pending = [] # (t_sample, x, y, r, theta, target)
+        self._err_sq = 0.0
+        self._err_n = 0
+
+    def update(self, t, position):
+        """
+        Add a block of encoder samples.
+
+        Inputs:
+            t (array-like): timestamps [s], ascending
+            position (array-like): mirror positions [mm]
+        """
+        t = np.asarray(t, dtype=float)
+        if not t.size:
+            return
+        opd = self.opd_factor * np.asarray(position, dtype=float)
+        self._enc_t = np.concatenate([self._enc_t, t])
+        self._enc_opd = np.concatenate([self._enc_opd, opd])
+        if self.target is None:
+            self.target = self._first_target(opd[0])
+        self._fit_velocity()
+        self._trim()
+
+    def _first_target(self, opd):
+        origin = 0.0 if self.start_opd is None else self.start_opd
+        k = (opd - origin) / self.step
+        k = np.floor(k) + 1 if self.direction > 0 else np.ceil(k) - 1
+        return origin + k * self.step
+
+    def _fit_velocity(self):
+        t = self._enc_t[-self.velocity_window:]
+        p = self._enc_opd[-self.velocity_window:]
+        if t.size < 2:
+            return
+        dt = t - t.mean()
+        var = np.dot(dt, dt)
+        if var > 0:
+            self.velocity = float(np.dot(dt, p - p.mean()) / var)
+
+    def _trim(self):
+        # keep the velocity window and anything needed to bracket pending readings
+        keep = self._enc_t.size - self.velocity_window
+        if self._pending:
+            keep = min(keep, np.searchsorted(self._enc_t, self._pending[0][0], side='right') - 1)
+        if keep > 0:
+            self._enc_t, self._enc_opd = self._enc_t[keep:], self._enc_opd[keep:]
+
+    def predict(self, now):
+        """Predicted OPD [mm] at time `now` (None before the first velocity estimate)."""
+        if self.velocity is None:
+            return None
+        return self._enc_opd[-1] + self.velocity * (now - self._enc_t[-1])
+
+    def time_to_fire(self, now):
+        """Time [s] from `now` until the next reading is due (<= 0 if due; None if the mirror is not approaching the next grid point)."""
+        if self.velocity is None or self.target is None or self.velocity * self.direction <= 0:
+            return None
+        t_cross = self._enc_t[-1] + (self.target - self._enc_opd[-1]) / self.velocity
+        return t_cross - self.latency - now
+
+    def due(self, now):
+        wait = self.time_to_fire(now)
+        return wait is not None and wait <= 0
+
+    def record(self, t0, t1, x, y, r, theta):
+        """
+        Register a lock-in reading issued at t0 and answered at t1, and move on to the next grid point.
+        Grid points the mirror will already have passed by the time of the next reading are skipped.
+        """
+        rtt = t1 - t0
+        if self.fixed_latency is None:
+            half = rtt / 2
+            self.latency = half if self.fired == 0 else (1 - self.smoothing) * self.latency + self.smoothing * half
+            t_sample = t0 + half # this reading's own best estimate, even if it was unusually slow
+        else:
+            t_sample = t0 + self.fixed_latency
+        self._pending.append((t_sample, x, y, r, theta, self.target))
+        self.fired += 1
+        self.target += self.direction * self.step
+        ahead = self.predict(t1 + rtt)
+        if ahead is not None:
+            behind = int(np.floor(self.direction * (ahead - self.target) / self.step)) + 1
+            if behind > 0:
+                self.target += self.direction * behind * self.step
+                self.missed += behind
+
+    def resolve(self, flush=False):
+        """
+        Readings whose sampling time is now bracketed by encoder samples, with positions interpolated.
+
+        Inputs:
+            flush (bool): also return readings past the last encoder sample, with extrapolated positions (default=False)
+
+        Returns: dict of TRIGGER_COLUMNS -> arrays
+        """
+        if not self._pending or (self._enc_t.size < 2 and not flush):
+            return {name: np.empty(0) for name in TRIGGER_COLUMNS}
+        last = self._enc_t[-1] if self._enc_t.size else -np.inf
+        n = len(self._pending) if flush else int(np.searchsorted([p[0] for p in self._pending], last, side='right'))
+        ready, self._pending = self._pending[:n], self._pending[n:]
+        if not ready:
+            return {name: np.empty(0) for name in TRIGGER_COLUMNS}
+        cols = np.array(ready, dtype=float).T
+        out = dict(zip(['timestamp', 'x', 'y', 'r', 'theta', 'target_opd_mm'], cols))
+        if self._enc_t.size >= 2:
+            opd = interp_sorted(out['timestamp'], self._enc_t, self._enc_opd)
+        else:
+            opd = np.full(n, np.nan)
+        if flush and self.velocity is not None:
+            late = out['timestamp'] > last
+            opd[late] = np.asarray([self.predict(ts) for ts in out['timestamp'][late]])
+        out['opd_mm'] = opd
+        out['position_mm'] = opd / self.opd_factor
+        err = opd - out['target_opd_mm']
+        err = err[np.isfinite(err)]
+        self._err_sq += float(np.dot(err, err))
+        self._err_n += err.size
+        self._trim()
+        return {name: out[name] for name in TRIGGER_COLUMNS}
+
+    def get_stats(self):
+        """Readings taken, grid points missed, current latency [s] and velocity [mm/s OPD], and rms grid error [mm]."""
+        return {
+            'fired': self.fired,
+            'missed': self.missed,
+            'latency': self.latency,
+            'velocity': self.velocity,
+            'rms_error': float(np.sqrt(self._err_sq / self._err_n)) if self._err_n else None,
+            }
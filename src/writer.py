@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import struct
+import numpy as np
+from . import metrics
+
+NPY_HEADER_LEN = 128 # fixed so the row count can be rewritten in place
+SIDECAR = 'scan.json'
+FORMAT_VERSION = 1 # version of the npy-directory sidecar (see archive.py); 0 = written before versioning
+UNITS = {
+    'timestamp': 's',
+    'position_mm': 'mm',
+    'opd_mm': 'mm',
+    'target_opd_mm': 'mm',
+    'x': 'V',
+    'y': 'V',
+    'r': 'V',
+    'theta': 'deg',
+    'count': 'count',
+    'freq_ghz': 'GHz',
+    'photocurrent_na': 'nA',
+    }
+
+FLUSH_LATENCY = metrics.histogram('cryo_fts_writer_flush_seconds', 'Time to append pending rows and sync the scan file', ['backend'])
+ROWS_WRITTEN = metrics.counter('cryo_fts_writer_rows_total', 'Rows flushed to scan files', ['backend'])
+
+class ScanWriter:
+    def __init__(self, path, columns, flush_interval=1.0, chunk_rows=65536, metadata=None, units=None):
+        """
+        Base class for streaming scan writers. Blocks of samples are buffered in memory and appended to disk
+        whenever `chunk_rows` rows are pending or `flush_interval` seconds have passed, so memory use stays flat
+        and every row is written exactly once.
+
+        Inputs:
+            path (str): where to write the scan
+            columns (dict or list): column name -> dtype (a list of names defaults every column to float64)
+            flush_interval (float): max time [s] between flushes to disk (default=1.0)
+            chunk_rows (int): max rows buffered before a flush (default=65536)
+            metadata (dict): JSON-serialisable scan metadata stored alongside the data
+            units (dict): column name -> unit string, for columns not in UNITS (default=None)
+        """
+        if not isinstance(columns, dict):
+            columns = {name: 'f8' for name in columns}
+        self.path = path
+        self.columns = {name: np.dtype(dt) for name, dt in columns.items()}
+        self.flush_interval = flush_interval
+        self.chunk_rows = chunk_rows
+        self.metadata = dict(metadata or {})
+        self.units = {name: (units or {}).get(name, UNITS.get(name, '')) for name in self.columns}
+        self.created = time.time()
+        self.rows = 0
+        self.closed = False
+        self._pending = {name: [] for name in self.columns}
+        self._pending_rows = 0
+        self._last_flush = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, block=None, **columns):
+        """
+        Append a block of rows. The data are copied, so the caller may reuse or overwrite its arrays (e.g.
+        views into a RingBuffer that wraps) before the next flush.
+
+        Inputs:
+            block (numpy.ndarray): structured array with (at least) this writer's column names
+            **columns (array-like): alternatively, one equal-length array per column
+        """
+        if block is not None:
+            columns = {name: block[name] for name in self.columns}
+        missing = set(self.columns) - set(columns)
+        if missing:
+            raise ValueError(f'Missing columns: {sorted(missing)}')
+        n = None
+        for name, dt in self.columns.items():
+            col = np.array(columns[name], dtype=dt) # a copy: callers may hand in views of a ring buffer
+            if n is None:
+                n = len(col)
+            elif len(col) != n:
+                raise ValueError('All columns must have the same length.')
+            self._pending[name].append(col)
+        self._pending_rows += n
+        if self._pending_rows >= self.chunk_rows or time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all pending rows to disk and make the file consistent up to them.
+        """
+        backend = type(self).__name__
+        t0 = time.time()
+        p0 = time.perf_counter()
+        n = self._pending_rows
+        if self._pending_rows:
+            cols = {name: np.concatenate(blocks) for name, blocks in self._pending.items()}
+            self._append(cols, self._pending_rows)
+            self.rows += self._pending_rows
+            self._pending = {name: [] for name in self.columns}
+            self._pending_rows = 0
+        self._sync(complete=False)
+        self._last_flush = time.time()
+        dt = time.perf_counter() - p0
+        FLUSH_LATENCY.labels(backend=backend).observe(dt)
+        ROWS_WRITTEN.labels(backend=backend).inc(n)
+        metrics.TRACER.add('writer.flush', t0, dt, rows=n)
+
+    def close(self):
+        """
+        Flush remaining rows and mark the scan complete.
+        """
+        if self.closed:
+            return
+        self.flush()
+        self._sync(complete=True)
+        self._close()
+        self.closed = True
+
+    def _append(self, cols, n):
+        raise NotImplementedError
+
+    def _sync(self, complete):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+class NpyScanWriter(ScanWriter):
+    def __init__(self, path, columns, compression=None, **kwargs):
+        """
+        Write each column to its own append-mode .npy file in the directory `path`, with a JSON sidecar holding
+        the column list, row count and metadata. The .npy headers and the sidecar are rewritten on every flush,
+        so a scan interrupted mid-run is still loadable with np.load up to the last flush.
+        """
+        if compression is not None:
+            raise ValueError('The npy backend does not support compression; use an .h5 path.')
+        super().__init__(path, columns, **kwargs)
+        os.makedirs(path, exist_ok=True)
+        self._files = {}
+        for name, dt in self.columns.items():
+            f = open(os.path.join(path, f'{name}.npy'), 'w+b')
+            f.write(self._header(dt, 0))
+            self._files[name] = f
+        self._sync(complete=False)
+
+    @staticmethod
+    def _header(dtype, rows):
+        d = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (np.lib.format.dtype_to_descr(dtype), rows)
+        d = d.ljust(NPY_HEADER_LEN - 11) + '\n'
+        return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(d)) + d.encode('latin1')
+
+    def _append(self, cols, n):
+        for name, f in self._files.items():
+            f.write(cols[name].tobytes())
+
+    def _sync(self, complete):
+        for name, f in self._files.items():
+            f.flush()
+            f.seek(0)
+            f.write(self._header(self.columns[name], self.rows))
+            f.seek(0, os.SEEK_END)
+            f.flush()
+            os.fsync(f.fileno())
+        info = {
+            'format': 'cryo_fts.scan',
+            'version': FORMAT_VERSION,
+            'created': self.created,
+            'columns': {name: np.lib.format.dtype_to_descr(dt) for name, dt in self.columns.items()},
+            'units': self.units,
+            'rows': self.rows,
+            'complete': complete,
+            'metadata': self.metadata,
+            }
+        tmp = os.path.join(self.path, SIDECAR + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(info, f, indent=2)
+        os.replace(tmp, os.path.join(self.path, SIDECAR))
+
+    def _close(self):
+        for f in self._files.values():
+            f.close()
+
+class HDF5ScanWriter(ScanWriter):
+    def __init__(self, path, columns, compression='gzip', compression_opts=None, **kwargs):
+        """
+        Write each column to a chunked, resizable dataset in an HDF5 file. The file is opened in SWMR mode so
+        it stays readable (up to the last flush) while the scan runs or after a crash. Requires h5py.
+
+        Inputs:
+            compression (str): HDF5 compression filter, e.g. 'gzip', 'lzf' or None (default='gzip')
+            compression_opts (int): filter options, e.g. the gzip level
+        """
+        import h5py
+        super().__init__(path, columns, **kwargs)
+        self._file = h5py.File(path, 'w', libver='latest')
+        self._datasets = {}
+        for name, dt in self.columns.items():
+            self._datasets[name] = self._file.create_dataset(
+                name, shape=(0,), maxshape=(None,), dtype=dt, chunks=(min(self.chunk_rows, 65536),),
+                compression=compression, compression_opts=compression_opts)
+        self._file.attrs['metadata'] = json.dumps(self.metadata)
+        self._file.attrs['units'] = json.dumps(self.units)
+        self._file.attrs['rows'] = 0
+        self._file.attrs['complete'] = False
+        self._file.swmr_mode = True
+
+    def _append(self, cols, n):
+        for name, ds in self._datasets.items():
+            ds.resize((self.rows + n,))
+            ds[self.rows:] = cols[name]
+
+    def _sync(self, complete):
+        for ds in self._datasets.values():
+            ds.flush()
+        self._file.flush()
+        if complete: # attributes cannot be modified in SWMR mode
+            self._file.close()
+            import h5py
+            with h5py.File(self.path, 'a') as f:
+                f.attrs['rows'] = self.rows
+                f.attrs['complete'] = True
+
+class CsvScanWriter(ScanWriter):
+    def __init__(self, path, columns, compression=None, **kwargs):
+        """
+        Write rows to a CSV file, one block at a time. Metadata is written as '#' comment lines.
+        """
+        if compression is not None:
+            raise ValueError('The csv backend does not support compression; use an .h5 path.')
+        super().__init__(path, columns, **kwargs)
+        self._file = open(path, 'w')
+        for key, val in self.metadata.items():
+            self._file.write(f'# {key}: {val}\n')
+        self._file.write(','.join(self.columns) + '\n')
+
+    def _append(self, cols, n):
+        np.savetxt(self._file, np.column_stack([cols[name] for name in self.columns]), delimiter=',', fmt='%.17g')
+
+    def _sync(self, complete):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _close(self):
+        self._file.close()
+
+BACKENDS = {
+    'npy': NpyScanWriter,
+    'hdf5': HDF5ScanWriter,
+    'csv': CsvScanWriter,
+    }
+
+def open_writer(path, columns, backend=None, **kwargs):
+    """
+    Open a scan writer for `path`.
+
+    Inputs:
+        path (str): output path
+        columns (dict or list): column name -> dtype
+        backend (str): 'npy', 'hdf5' or 'csv' (if None, chosen from the file extension: .h5/.hdf5 -> 'hdf5',
+            .csv -> 'csv', anything else -> 'npy' directory)
+        **kwargs: passed to the writer (flush_interval, chunk_rows, compression, metadata)
+    """
+    if backend is None:
+        ext = os.path.splitext(path)[1].lower()
+        backend = {'.h5': 'hdf5', '.hdf5': 'hdf5', '.csv': 'csv'}.get(ext, 'npy')
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend: {backend}')
+    return BACKENDS[backend](path, columns, **kwargs)
+
+def read_scan(path):
+    """
+    Load a scan written by a ScanWriter (including a partially written one).
+
+    Returns: (columns, metadata) where columns is a dict of column name -> array
+    """
+    if os.path.isdir(path):
+        with open(os.path.join(path, SIDECAR)) as f:
+            info = json.load(f)
+        cols = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in info['columns']}
+        return cols, info['metadata']
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.h5', '.hdf5'):
+        import h5py
+        with h5py.File(path, 'r', libver='latest', swmr=True) as f:
+            cols = {name: f[name][()] for name in f.keys()}
+            return cols, json.loads(f.attrs['metadata'])
+    import pandas as pd
+    df = pd.read_csv(path, comment='#', float_precision='round_trip') # exact for the %.17g the writer uses
+    return {name: df[name].values for name in df.columns}, {}
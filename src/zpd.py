@@ -0,0 +1,151 @@
+### Zero-path-difference location and scan alignment ###
+
+import numpy as np
+from .spectrum import next_fast_len
+
+def envelope(x, axis=-1):
+    """
+    Magnitude of the analytic signal (Hilbert envelope) of the mean-subtracted interferogram(s) along `axis`.
+    Works on a single scan or a 2-D batch in one FFT.
+    """
+    x = np.asarray(x, dtype=float)
+    x = x - x.mean(axis=axis, keepdims=True)
+    n = x.shape[axis]
+    nfft = next_fast_len(n)
+    X = np.fft.fft(x, nfft, axis=axis)
+    h = np.zeros(nfft)
+    h[0] = 1
+    h[1:(nfft + 1) // 2] = 2
+    if nfft % 2 == 0:
+        h[nfft // 2] = 1
+    shape = [1] * x.ndim
+    shape[axis] = nfft
+    z = np.fft.ifft(X * h.reshape(shape), axis=axis)
+    return np.abs(np.take(z, np.arange(n), axis=axis))
+
+def parabolic(y, i, width=1):
+    """
+    Sub-sample peak position from a parabola through y[i-width] .. y[i+width] (least squares if width > 1,
+    which averages down noise on broad peaks), for each row of a 2-D y. The vertex is kept within the fitted
+    samples; peaks too close to either end are not refined.
+
+    Returns: fractional indices (float array with one entry per row)
+    """
+    y = np.atleast_2d(y)
+    i = np.atleast_1d(i)
+    w = max(int(width), 1)
+    k = np.arange(-w, w + 1)
+    inner = (i >= w) & (i < y.shape[1] - w)
+    idx = np.clip(i[:, None] + k, 0, y.shape[1] - 1)
+    coef = y[np.arange(y.shape[0])[:, None], idx] @ np.linalg.pinv(np.vander(k, 3)).T # rows of (a, b, c)
+    a, b = coef[:, 0], coef[:, 1]
+    shift = np.divide(-b, 2 * a, out=np.zeros(a.shape), where=a < 0)
+    return i + np.where(inner, np.clip(shift, -w, w), 0.0)
+
+def _halfwidth(env):
+    # a quarter of the (median) full width at half maximum of the envelopes, in samples
+    env = np.atleast_2d(env)
+    fwhm = np.count_nonzero(env >= env.max(axis=1, keepdims=True) / 2, axis=1)
+    return max(int(np.median(fwhm)) // 4, 1)
+
+def _fringe_period(x):
+    # period [samples] of the strongest spectral component
+    nfft = next_fast_len(x.size)
+    power = np.abs(np.fft.rfft(x, nfft))
+    k = int(np.argmax(power[1:])) + 1 if power.size > 1 else 1
+    return nfft / k
+
+def find_zpd(x, width=None):
+    """
+    ZPD of uniformly sampled interferogram(s): the peak of the Hilbert envelope, refined to sub-sample precision
+    by a parabola fitted over the top of the envelope.
+
+    Inputs:
+        x (array-like): one scan, or a 2-D array with one scan per row
+        width (int): half-width [samples] of the parabola fit (if None, a quarter of the envelope FWHM)
+
+    Returns: fractional sample index (a float, or an array with one entry per row)
+    """
+    x = np.asarray(x, dtype=float)
+    env = np.atleast_2d(envelope(x))
+    idx = parabolic(env, np.argmax(env, axis=1), width or _halfwidth(env))
+    return float(idx[0]) if x.ndim == 1 else idx
+
+def cross_correlate(x, ref):
+    """
+    Full linear cross-correlation of each row of x with ref via zero-padded FFTs, O(N log N) per row.
+
+    Returns: (lags, correlation) where correlation[k, j] = sum_n x[k, n + lags[j]] * ref[n], so the peak
+    lag is how far each scan is shifted relative to ref
+    """
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    ref = np.asarray(ref, dtype=float)
+    n, m = x.shape[1], ref.size
+    nfft = next_fast_len(n + m - 1)
+    corr = np.fft.irfft(np.fft.rfft(x, nfft, axis=1) * np.conj(np.fft.rfft(ref, nfft)), nfft, axis=1)
+    lags = np.arange(-(m - 1), n)
+    return lags, np.concatenate([corr[:, nfft - (m - 1):], corr[:, :n]], axis=1)
+
+def align(x, reference=None, search=None):
+    """
+    Shift of each scan relative to a reference, to sub-sample precision. The envelope peaks give a coarse
+    shift; the fringe cross-correlation is then maximized within `search` samples of it and refined with a
+    parabola. Neighbouring fringes of the correlation differ little in height, so the search is kept under
+    half a fringe period: it picks the fringe the envelopes point to rather than comparing fringes.
+
+    Inputs:
+        x (array-like): 2-D array of uniformly sampled scans on a common grid, one per row
+        reference (array-like): reference scan (if None, the first row)
+        search (float): half-width [samples] of the lag search around the envelope estimate (if None, a quarter
+            of the envelope's full width at half maximum, but less than half the dominant fringe period and at
+            least 1)
+
+    Returns: dict with 'shift' (samples; positive means the scan's ZPD lies later than the reference's),
+    'zpd' (envelope ZPD index of every scan) and 'peak' (normalized correlation at the shift)
+    """
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    x = x - x.mean(axis=1, keepdims=True)
+    ref = x[0] if reference is None else np.asarray(reference, dtype=float) - np.mean(reference)
+    env = envelope(x)
+    ref_env = envelope(ref)
+    w = _halfwidth(ref_env)
+    zpd = parabolic(env, np.argmax(env, axis=1), w)
+    ref_zpd = float(parabolic(ref_env, np.argmax(ref_env), w)[0])
+    if search is None:
+        search = max(min(w, 0.45 * _fringe_period(ref)), 1)
+    lags, corr = cross_correlate(x, ref)
+    coarse = zpd - ref_zpd
+    allowed = np.abs(lags[None, :] - coarse[:, None]) <= search
+    masked = np.where(allowed, corr, -np.inf)
+    best = np.argmax(masked, axis=1)
+    shift = lags[0] + parabolic(corr, best)
+    norm = np.sqrt((x ** 2).sum(axis=1) * (ref ** 2).sum())
+    peak = np.divide(corr[np.arange(len(best)), best], norm, out=np.zeros(len(best)), where=norm > 0)
+    return {'shift': shift, 'zpd': zpd, 'peak': peak}
+
+def to_grid(positions, signals, step=None, opd_factor=2.0):
+    """
+    Resample scans with different sample positions onto one uniform OPD grid, as rows of a 2-D array ready
+    for find_zpd() or align(). Samples outside a scan's range are set to that scan's mean.
+
+    Inputs:
+        positions (list): mirror positions [mm] of each scan
+        signals (list): detector readings of each scan
+        step (float): grid step [mm OPD] (if None, the median sample spacing of the first scan)
+        opd_factor (float): optical path difference per unit mirror displacement (default=2.0)
+
+    Returns: (grid OPD [mm], 2-D array of resampled scans)
+    """
+    opds = [opd_factor * np.asarray(p, dtype=float) for p in positions]
+    if step is None:
+        step = float(np.median(np.abs(np.diff(np.sort(opds[0])))))
+    lo = min(o.min() for o in opds)
+    hi = max(o.max() for o in opds)
+    grid = lo + step * np.arange(int(np.floor((hi - lo) / step)) + 1)
+    out = np.empty((len(opds), grid.size))
+    for k, (o, s) in enumerate(zip(opds, signals)):
+        order = np.argsort(o, kind='stable')
+        s = np.asarray(s, dtype=float)[order]
+        fill = s.mean()
+        out[k] = np.interp(grid, o[order], s, left=fill, right=fill)
+    return grid, out
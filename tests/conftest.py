@@ -0,0 +1,4 @@
+import sys, os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import tempfile
+os.environ.setdefault('CRYO_FTS_CONFIG_DIR', tempfile.mkdtemp()) # never touch the user's ~/.cryo_fts
@@ -0,0 +1,27 @@
+import numpy as np
+from src.batch import load_scan
+
+def test_rebins_step_scan_that_stopped_early(tmp_path):
+    path = str(tmp_path / 'scan.npz')
+    pos = np.arange(6) * 0.1
+    sig = np.repeat(np.arange(6.0), 4) + np.tile([-0.3, -0.1, 0.1, 0.3], 6)
+    np.savez(path, R_V=sig, ENCODER_POS_mm=pos, NSTEPS=10, NINT=4)
+    scan = load_scan(path)
+    assert np.allclose(scan['position'], pos)
+    assert np.allclose(scan['signal'], np.arange(6.0))
+
+def test_process_scan_phase_corrects_about_zpd(tmp_path):
+    from src.batch import process_scan
+    from src import spectrum
+    path = str(tmp_path / 'scan.npz')
+    pos = np.linspace(0, 4, 2001) # one-sided: ZPD 0.5 mm from the start
+    opd = 2 * (pos - 0.5)
+    sig = np.exp(-(opd / 0.3)**2) * np.cos(2 * np.pi * 10 * opd + 0.8) # dispersed line at 10 /mm
+    np.savez(path, R_V=sig, ENCODER_POS_mm=pos, NINT=1)
+    res = process_scan(path)
+    assert abs(res['zpd_mm'] - 0.5) < 0.005
+    ref = spectrum.compute_spectrum(pos, sig, phase_correction='mertz', zpd=250) # 0.5 mm at 2 um/sample
+    assert np.allclose(res['power'], ref['power'])
+    peak = np.argmax(res['power'])
+    assert abs(res['wavenumber'][peak] - 100) < 2
+    assert ref['spectrum'][peak] > 0 # the dispersion phase is removed
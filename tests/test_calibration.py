@@ -0,0 +1,12 @@
+import os
+from src.calibration import CALIBRATION_FILE
+from src.simulate import SimulatedBench
+
+def test_simulated_bench_keeps_offsets_in_memory():
+    bench = SimulatedBench()
+    mirror = bench.mirror(use_lockin=False)
+    mirror.init()
+    assert mirror.calibration is bench.calibration and bench.calibration.path is None
+    assert list(bench.calibration.entries) == [bench.e201.serial_number]
+    assert not os.path.exists(CALIBRATION_FILE)
+    mirror.close()
@@ -0,0 +1,33 @@
+import numpy as np
+from src.encoder import RecordReader
+
+def records(counts):
+    return b''.join(b'%8d\r' % c for c in counts)
+
+def test_decodes_records_split_across_chunks():
+    data = records([12345678, 12345679, 12345680])
+    reader = RecordReader()
+    _, a = reader.feed(data[:13], t=1.0)
+    _, b = reader.feed(data[13:], t=2.0)
+    assert list(np.concatenate([a, b])) == [12345678, 12345679, 12345680]
+    assert reader.bytes_dropped == 0
+
+def test_long_garbage_after_terminator():
+    reader = RecordReader(capacity=64)
+    reader.feed(b'\n' + b'x' * 50, t=1.0)
+    reader.feed(b'y' * 50, t=2.0)
+    _, counts = reader.feed(b'\r' + records([12345678]), t=3.0)
+    assert list(counts) == [12345678]
+    assert reader.bytes_dropped == 1 + 50 + 50 + 1 # everything before the record
+    assert reader.bytes_read == 1 + 50 + 50 + 1 + 9
+
+def test_corrupt_records_are_not_joined():
+    reader = RecordReader()
+    _, counts = reader.feed(b'12345677\r12345678' + b'1234569\r12345680\r', t=1.0)
+    assert list(counts) == [12345677, 12345680]
+
+def test_garbage_before_record_in_next_chunk():
+    reader = RecordReader()
+    reader.feed(b'123', t=1.0)
+    _, counts = reader.feed(b'45678' + b'1234569\r' + records([12345680]), t=2.0)
+    assert list(counts) == [12345680]
@@ -0,0 +1,36 @@
+import time
+import asyncio
+import numpy as np
+from src.simulate import SimulatedBench, Stage
+from src.laser_async import AsyncTopticaController
+
+def run_scan(velocity, start):
+    async def main():
+        bench = SimulatedBench(stage=Stage(limit_max=1.0))
+        laser = AsyncTopticaController(clients=[bench.dlc.async_client() for _ in range(3)], encoder=bench.encoder(),
+                                       motor=bench.motor(), calibration=bench.calibration)
+        await laser.init()
+        laser.motor.move_absolute(start)
+        try:
+            return await asyncio.wait_for(laser.scan_and_collect(100.0, velocity, interval_ms=20), 10)
+        finally:
+            await laser.close()
+    return asyncio.run(main())
+
+def test_lockin_stamped_on_host_clock(monkeypatch):
+    monkeypatch.setenv('TZ', 'America/New_York') # the DLC stamps are UTC, on a clock 1.7 s ahead
+    time.tzset()
+    try:
+        t0 = time.time()
+        out = run_scan(2.0, 0.0)
+    finally:
+        monkeypatch.delenv('TZ')
+        time.tzset()
+    assert len(out['timestamp']) > 10
+    assert t0 < out['timestamp'][0] and out['timestamp'][-1] < time.time()
+    assert (np.diff(out['position_mm']) > 0).all()
+
+def test_negative_velocity_scan_ends():
+    out = run_scan(-2.0, 1.0)
+    assert len(out['timestamp']) > 10
+    assert (np.diff(out['position_mm']) < 0).all()
@@ -0,0 +1,55 @@
+import numpy as np
+from src.mirror import find_stop_index
+
+RES = 0.000244140625 # [mm/count]
+TOL = 2.5 * RES
+
+def in_blocks(t, pos, block=100, pos_max=np.inf):
+    """Feed the samples block by block, returning the global stop index (or None)."""
+    history = None
+    for i in range(0, t.size, block):
+        index, history = find_stop_index(t[i:i + block], pos[i:i + block], pos_max, TOL, 0.5, history)
+        if index is not None:
+            return i + index
+    return None
+
+def test_dither_at_rest_stops_after_timeout():
+    t = np.arange(2000) / 1000
+    pos = 10 + RES * np.random.default_rng(0).integers(-1, 2, t.size)
+    index = in_blocks(t, pos)
+    assert index is not None and abs(t[index] - 0.5) < 0.01
+
+def test_slow_scan_keeps_going():
+    t = np.arange(5000) / 1000
+    pos = 10 + RES * np.floor(t * 20) # 20 counts/s: consecutive samples differ by at most one count
+    assert in_blocks(t, pos) is None
+
+def test_stops_at_end_of_travel():
+    t = np.arange(1000) / 1000
+    assert in_blocks(t, t * 10, pos_max=5.0) == 500
+
+def test_instrument_settings_record_lockin_identity():
+    from src.simulate import SimulatedBench
+    mirror = SimulatedBench().mirror(use_lockin=True)
+    mirror.init()
+    settings = mirror.instrument_settings()
+    mirror.close()
+    assert settings['lockin'].startswith('Stanford_Research_Systems,SR865A')
+    assert settings['lockin_adapter'].startswith('Prologix')
+
+def test_multi_stroke_scan_runs_every_stroke(tmp_path):
+    from src.simulate import SimulatedBench, Stage
+    from src.writer import read_scan
+    mirror = SimulatedBench(stage=Stage(limit_max=1.0)).mirror(use_lockin=False)
+    mirror.init()
+    path = str(tmp_path / 'scan')
+    mirror.scan_and_collect(2.0, save_to=path, strokes=3)
+    mirror._scan_thread.join()
+    mirror.close()
+    cols, meta = read_scan(path)
+    assert list(np.unique(cols['stroke'])) == [0, 1, 2] # no stationary stop at the turnarounds
+    for k, direction in enumerate([1, -1, 1]):
+        sel = cols['stroke'] == k
+        assert (cols['direction'][sel] == direction).all()
+        assert np.ptp(cols['position_mm'][sel]) > 0.8
+    assert meta['strokes'] == 3
@@ -0,0 +1,49 @@
+import time
+import numpy as np
+import pytest
+from multiprocessing import shared_memory
+from src.ringbuffer import RingBuffer
+from src.encoder import ENCODER_DTYPE
+
+def test_ring_on_external_buffer_is_shared():
+    shm = shared_memory.SharedMemory(create=True, size=RingBuffer.nbytes(8, ENCODER_DTYPE))
+    try:
+        producer = RingBuffer(8, ENCODER_DTYPE, buffer=shm.buf)
+        producer.clear()
+        consumer = RingBuffer(8, ENCODER_DTYPE, buffer=shm.buf)
+        cursor = 0
+        for start in (0, 5, 10): # the third block wraps the ring
+            producer.write(timestamp=np.arange(start, start + 5) * 0.1, count=np.arange(start, start + 5))
+            view, cursor = consumer.read_since(cursor)
+            assert np.array_equal(view['count'], np.arange(start, start + 5))
+        assert consumer.head == 15 and consumer.overflows == 0
+        assert int(consumer.latest()['count']) == 14
+        del view, producer, consumer
+    finally:
+        shm.close()
+        shm.unlink()
+
+def test_ring_rejects_small_buffer():
+    with pytest.raises(ValueError):
+        RingBuffer(8, ENCODER_DTYPE, buffer=bytearray(RingBuffer.nbytes(8, ENCODER_DTYPE) - 1))
+
+def test_process_encoder_follows_the_stage():
+    from src.simulate import SimulatedBench, Stage
+    from src.procacq import ProcessEncoder
+    bench = SimulatedBench(stage=Stage())
+    encoder = ProcessEncoder(connection=bench.e201, buffer_size=1 << 14, context='fork')
+    try:
+        encoder.init()
+        encoder.start_transmission()
+        time.sleep(0.1)
+        first = encoder.get_count()
+        bench.stage.move_to(bench.stage.position() + 1.0, speed=10.0) # moved here, read in the reader process
+        bench.stage.wait_until_idle()
+        time.sleep(0.1)
+        records = np.array(encoder.get_all())
+        assert records.size > 100 and np.all(np.diff(records['timestamp']) >= 0)
+        moved = (encoder.get_count() - first) * encoder.ENC_RES
+        assert abs(moved - 1.0) < 0.01
+        encoder.stop_transmission()
+    finally:
+        encoder.close()
@@ -0,0 +1,27 @@
+import numpy as np
+from src.spectrum import phase_correct, get_plan
+
+def band_interferogram(n=4096, zpd=200, phase=0.0, f0=0.15, width=0.02):
+    """Interferogram of a Gaussian band centred on f0 [cycles/sample] with a constant phase error."""
+    k = np.arange(n) - zpd
+    return np.exp(-2 * (np.pi * width * k)**2) * np.cos(2 * np.pi * f0 * k + phase)
+
+def test_forman_matches_mertz():
+    plan = get_plan(4096, pad=False)
+    x = band_interferogram(phase=0.7)
+    true, _ = phase_correct(band_interferogram(phase=0.0), 200, plan, 'mertz')
+    mertz, _ = phase_correct(x, 200, plan, 'mertz')
+    forman, _ = phase_correct(x, 200, plan, 'forman')
+    assert np.corrcoef(mertz, true)[0, 1] > 0.999
+    assert np.corrcoef(forman, mertz)[0, 1] > 0.999
+    assert (forman > -0.01 * forman.max()).all()
+
+def test_window_centred_on_zpd():
+    x = band_interferogram(phase=0.7)
+    plain, _ = phase_correct(x, 200, get_plan(4096, pad=False), 'mertz')
+    for method in ('mertz', 'forman'):
+        hann, _ = phase_correct(x, 200, get_plan(4096, pad=False, window='hann'), method)
+        # the band's fringes die out near ZPD, where the window is ~1, so apodizing barely changes the spectrum
+        assert 0.95 < hann.max() / plain.max() < 1.05
+    w = get_plan(4096, pad=False, window='hann').window_about(200)
+    assert w[200] == w.max() and np.allclose(w[150:200], w[250:200:-1])
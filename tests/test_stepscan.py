@@ -0,0 +1,54 @@
+import time
+from src.stepscan import StepScanner
+
+class StreamingEncoder:
+    """Transmitting encoder whose count steps through `counts` every 20 ms, then holds."""
+    transmitting = True
+
+    def __init__(self, counts):
+        self.counts = list(counts)
+        self.t0 = time.time()
+
+    def get_latest(self):
+        t = time.time()
+        return t, self.counts[min(int((t - self.t0) / 0.02), len(self.counts) - 1)]
+
+    def get_count(self):
+        return self.get_latest()[1]
+
+def test_settle_needs_advancing_timestamps():
+    enc = StreamingEncoder([100])
+    enc.get_latest = lambda: (enc.t0, 100) # the same cached record on every read
+    scanner = StepScanner(None, enc, None, settle_time=0.05, settle_timeout=0.2, poll_interval=0.001)
+    t0 = time.time()
+    assert scanner.settle() == (100, False)
+    assert time.time() - t0 >= 0.2
+
+def test_settle_after_motion_stops():
+    enc = StreamingEncoder([0, 50, 100, 150, 151])
+    scanner = StepScanner(None, enc, None, settle_tolerance=2, settle_time=0.05, settle_timeout=1.0,
+                          poll_interval=0.001)
+    assert scanner.settle() == (151, True)
+    assert time.time() - enc.t0 >= 0.06 + 0.05 # held within tolerance from 150 on
+
+def test_capture_transfer_overlaps_next_move():
+    import numpy as np
+    from src.simulate import SimulatedBench
+    mirror = SimulatedBench().mirror(use_lockin=True)
+    mirror.init()
+    calls = []
+    move = mirror.motor.move_absolute
+    mirror.motor.move_absolute = lambda *args, **kwargs: (calls.append(('move', time.time())), move(*args, **kwargs))[1]
+    collect = StepScanner.collect
+    def traced(self, t0, t1, **kwargs):
+        calls.append(('collect', time.time()))
+        return collect(self, t0, t1, **kwargs)
+    StepScanner.collect = traced
+    try:
+        res = mirror.step_scan(np.linspace(1, 2, 4), nsamps=20, capture=True, settle_time=0.02)
+    finally:
+        StepScanner.collect = collect
+        mirror.close()
+    assert np.isfinite(res['data']).all()
+    order = [name for name, _ in calls]
+    assert order == ['move', 'move', 'collect', 'move', 'collect', 'move', 'collect', 'collect']
@@ -0,0 +1,13 @@
+from src.simulate import SimulatedBench
+from src.sweep import SweepScheduler
+from src.writer import read_scan
+
+def test_metadata_records_resolved_nesting(tmp_path):
+    top = SimulatedBench().toptica()
+    top.init()
+    scheduler = SweepScheduler(top, settle_timeout=0.1) # convergence does not matter here
+    path = str(tmp_path / 'sweep')
+    out = scheduler.run([300.0, 300.02], [0.0, 0.1], save_to=path, verbose=False)
+    _, meta = read_scan(path)
+    assert out['nesting'] in ('frequency', 'position')
+    assert meta['nesting'] == out['nesting']
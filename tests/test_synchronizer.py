@@ -0,0 +1,31 @@
+import numpy as np
+from src.synchronizer import Synchronizer
+
+def test_encoder_history_bounded_without_lockin_samples():
+    sync = Synchronizer(mode='lockin', history=1.0)
+    for k in range(50):
+        t = k * 0.1 + np.arange(100) * 1e-3
+        sync.push_encoder(t, t * 10)
+        sync.process()
+    assert sync._enc_t[-1] - sync._enc_t[0] <= 1.0 + 1e-3
+    sync.push_lockin(timestamp=np.array([4.95]), x=np.ones(1), y=np.zeros(1), r=np.ones(1), theta=np.zeros(1))
+    out = sync.process()
+    assert np.allclose(out['position_mm'], [49.5])
+
+def test_encoder_mode_bounded_without_lockin_samples():
+    sync = Synchronizer(mode='encoder', history=1.0)
+    for k in range(50):
+        t = k * 0.1 + np.arange(100) * 1e-3
+        sync.push_encoder(t, t * 10)
+        sync.process()
+    assert sync._enc_t[-1] - sync._enc_t[0] <= 1.0
+    assert sync.dropped == 5000 - len(sync._enc_t)
+
+def test_repeated_counts_are_kept():
+    res = 0.000244140625
+    sync = Synchronizer(mode='encoder')
+    t = np.arange(200) * 1e-4
+    sync.push_encoder(t, res * np.floor(t * 1e3)) # 10 samples per count
+    sync.push_lockin(timestamp=np.array([-1.0, 1.0]), x=np.ones(2), y=np.zeros(2), r=np.ones(2), theta=np.zeros(2))
+    out = sync.process()
+    assert len(out['timestamp']) == 200 and sync.dropped == 0
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from src.trigger import OPDTrigger, TRIGGER_COLUMNS
+
+def run(trigger, velocity, rtt, duration=1.0, dt=1e-3, x0=0.0):
+    """Drive the trigger from a mirror at constant `velocity` [mm/s], sampled every dt, whose lock-in reads
+    take `rtt` seconds and sample half way through."""
+    rows = []
+    t = 0.0
+    while t < duration:
+        trigger.update([t], [x0 + velocity * t])
+        if trigger.due(t):
+            during = np.arange(t + dt, t + rtt, dt) # encoder samples that arrive while the read is out
+            trigger.update(during, x0 + velocity * during)
+            trigger.record(t, t + rtt, 1.0, 0.0, 1.0, 0.0)
+            t += rtt
+            rows.append(trigger.resolve())
+        t += dt
+    rows.append(trigger.resolve(flush=True))
+    return {name: np.concatenate([r[name] for r in rows]) for name in TRIGGER_COLUMNS}
+
+@pytest.mark.parametrize('velocity', [1.0, -1.0])
+def test_readings_land_on_the_grid(velocity):
+    trigger = OPDTrigger(0.02, direction=np.sign(velocity))
+    out = run(trigger, velocity, rtt=0.004, x0=5.0)
+    assert out['timestamp'].size > 40
+    assert np.allclose(np.diff(out['target_opd_mm']), 0.02 * np.sign(velocity))
+    assert np.allclose(out['target_opd_mm'] / 0.02, np.round(out['target_opd_mm'] / 0.02)) # multiples of step
+    err = out['opd_mm'] - out['target_opd_mm']
+    # the first read learns the latency and samples late; the rest land within one encoder sample of OPD travel
+    assert np.abs(err[1:]).max() < 2 * abs(velocity) * 1e-3 + 1e-9
+    stats = trigger.get_stats()
+    assert stats['missed'] == 0 and abs(stats['latency'] - 0.002) < 1e-9
+    assert stats['rms_error'] == pytest.approx(np.sqrt(np.mean(err**2)))
+
+def test_grid_points_passed_during_a_slow_read_are_skipped():
+    trigger = OPDTrigger(0.002)
+    out = run(trigger, 1.0, rtt=0.005, duration=0.5)
+    assert trigger.get_stats()['missed'] > 0
+    assert np.all(np.diff(out['target_opd_mm']) > 0.002) # fewer readings, still on grid points
+    assert np.abs(out['opd_mm'] - out['target_opd_mm'])[1:].max() < 0.004
+
+def test_step_must_be_positive():
+    with pytest.raises(ValueError):
+        OPDTrigger(0.0)
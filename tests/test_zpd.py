@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+from src.zpd import align, find_zpd
+
+def fringes(n, centre, period, width=40.0):
+    i = np.arange(n)
+    return np.cos(2 * np.pi * (i - centre) / period) * np.exp(-((i - centre) / width) ** 2)
+
+@pytest.mark.parametrize('period', [7.3, 20.0])
+def test_align_non_integer_shifts(period):
+    shifts = np.array([0.0, 0.37, 1.6, -0.75, 3.5])
+    x = np.array([fringes(1024, 500 + s, period) for s in shifts])
+    res = align(x)
+    assert np.allclose(res['shift'], shifts, atol=0.1)
+    assert (res['peak'] > 0.85).all() # at the nearest integer lag
+
+def test_find_zpd_sub_sample():
+    assert abs(find_zpd(fringes(1024, 512.4, 7.3)) - 512.4) < 0.2